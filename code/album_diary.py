@@ -0,0 +1,82 @@
+"""
+사진이 많은 앨범의 일기 생성 (map-reduce)
+
+- map: 사진을 시간 순서(업로드/앨범 순서)대로 DIARY_CHUNK_SIZE장씩 나누어 구간별 요약을 동시에 생성합니다
+- reduce: 구간별 요약을 순서대로 이어 붙여 최종 일기를 한 번 더 생성합니다
+- 구간 요약은 서로 독립적이라 동시에 보낼 수 있으므로, 사진 수가 늘어도 전체 지연 시간은
+  (구간 수 / 동시 요청 수) 라운드 + 최종 일기 한 번 정도로만 늘어납니다
+- 이미지를 함께 보내는 경우(gpt_img_kw.py)에도 요청마다 해당 구간의 이미지만 첨부합니다
+"""
+import asyncio
+import os
+from contextlib import nullcontext
+from llm_utils import DIARY_MODEL, DIARY_TEMPERATURE, acreate_with_retry, usage_to_dict
+from prompt_builder import build_chunk_prompt, build_compose_prompt, chunk_photos
+
+# 한 구간에 넣을 사진 수 (사진이 이보다 많으면 map-reduce로 생성)
+DIARY_CHUNK_SIZE = int(os.getenv("DIARY_CHUNK_SIZE", "12"))
+# 동시에 보낼 최대 구간 요약 요청 수
+DIARY_CHUNK_CONCURRENCY = int(os.getenv("DIARY_CHUNK_CONCURRENCY", "4"))
+# 구간 요약 하나의 최대 토큰 수 (최종 일기 프롬프트가 구간 수에 비례해 커지지 않도록 짧게 유지)
+CHUNK_SUMMARY_MAX_TOKENS = int(os.getenv("DIARY_CHUNK_SUMMARY_MAX_TOKENS", "300"))
+
+
+def needs_map_reduce(num_photos, chunk_size=DIARY_CHUNK_SIZE):
+    """사진 수가 한 구간보다 많아 map-reduce로 생성해야 하는지 여부 (chunk_size가 0 이하면 항상 한 번에 생성)"""
+    return chunk_size > 0 and num_photos > chunk_size
+
+
+async def summarize_chunks(client, photos, variant="blip", formatted_date=None, images=None,
+                           chunk_size=DIARY_CHUNK_SIZE, concurrency=DIARY_CHUNK_CONCURRENCY, semaphore=None,
+                           use_cache=True, model=DIARY_MODEL, trace=None):
+    """
+    구간별 요약을 동시에 생성하는 함수 (map 단계)
+    - images가 주어지면 photos와 같은 순서로 나누어 구간마다 해당 이미지만 첨부합니다
+    - semaphore를 주면 그것으로 동시 요청 수를 제한합니다 (여러 앨범이 한도를 공유할 때)
+    - [(첫 사진 번호, 마지막 사진 번호, 요약 텍스트), ...]를 시간 순서대로 반환합니다
+    """
+    chunks = chunk_photos(photos, chunk_size)
+    semaphore = semaphore or asyncio.Semaphore(max(1, concurrency))
+
+    async def summarize(start, chunk):
+        chunk_images = images[start - 1:start - 1 + len(chunk)] if images else None
+        chunk_prompt = build_chunk_prompt(chunk, variant, start, formatted_date, chunk_images, model)
+        async with semaphore:
+            response = await acreate_with_retry(
+                client,
+                use_cache=use_cache,
+                model=model,
+                messages=chunk_prompt.messages,
+                temperature=DIARY_TEMPERATURE,
+                max_tokens=CHUNK_SUMMARY_MAX_TOKENS
+            )
+        if trace is not None:
+            trace.record_usage(usage_to_dict(response.usage))
+        return start, start + len(chunk) - 1, response.choices[0].message.content or ""
+
+    return await asyncio.gather(*[summarize(start, chunk) for start, chunk in chunks])
+
+
+async def generate_album_diary(client, photos, variant="blip", mood="", formatted_date=None, images=None,
+                               chunk_size=DIARY_CHUNK_SIZE, concurrency=DIARY_CHUNK_CONCURRENCY, semaphore=None,
+                               use_cache=True, model=DIARY_MODEL, trace=None, **kwargs):
+    """
+    구간별 요약(map) 뒤 최종 일기(reduce)까지 생성하는 함수
+    - kwargs는 최종 일기 요청에 그대로 전달됩니다 (temperature, max_tokens 등)
+    - (최종 응답, 구간별 요약 목록)을 반환합니다. 토큰 사용량은 trace에 합산됩니다
+    """
+    semaphore = semaphore or asyncio.Semaphore(max(1, concurrency))
+    with trace.span("map") if trace is not None else nullcontext():
+        summaries = await summarize_chunks(
+            client, photos, variant, formatted_date, images, chunk_size, concurrency, semaphore,
+            use_cache, model, trace
+        )
+    compose_prompt = build_compose_prompt(summaries, variant, mood, formatted_date, model)
+    with trace.span("reduce") if trace is not None else nullcontext():
+        async with semaphore:
+            response = await acreate_with_retry(
+                client, use_cache=use_cache, model=model, messages=compose_prompt.messages, **kwargs
+            )
+    if trace is not None:
+        trace.record_usage(usage_to_dict(response.usage))
+    return response, summaries
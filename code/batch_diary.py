@@ -0,0 +1,341 @@
+"""
+앨범 폴더 단위로 일기를 일괄 생성하는 CLI (Streamlit 없이 실행)
+
+앨범 폴더 구조:
+    albums_dir/
+        album_a/
+            001.jpg
+            002.jpg
+            album.json   (선택)
+
+album.json 예시:
+    {
+        "date": "2025-02-01",
+        "mood": "설레는",
+        "photos": [
+            {"file": "001.jpg", "person": "민수", "location": "파리", "keywords": "에펠탑"},
+            {"file": "002.jpg", "location": "센 강"}
+        ]
+    }
+
+- 사진 순서는 album.json의 photos 순서를 따르고, 목록에 없는 사진은 파일명 순으로 뒤에 붙습니다
+- 결과는 앨범마다 JSONL 한 줄로 기록되며, 다시 실행하면 이미 성공한 앨범은 건너뜁니다
+- 사진이 --chunk_size장보다 많은 앨범은 구간별 요약 후 최종 일기를 만드는 map-reduce로 생성합니다 (album_diary.py)
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import dotenv
+from PIL import Image
+from album_diary import DIARY_CHUNK_SIZE, generate_album_diary, needs_map_reduce
+from cache_utils import PersistentLRUCache
+from caption_utils import (CAPTION_MODEL_NAME, CAPTION_NUM_THREADS, DEFAULT_CAPTION_BATCH_SIZE, caption_cache_key,
+                           configured_generation_settings, load_local_captioner)
+from llm_utils import (DIARY_MODEL, DIARY_TEMPERATURE, DIARY_MAX_TOKENS, acreate_with_retry, create_client,
+                       usage_to_dict)
+from prompt_builder import build_diary_prompt, format_korean_date
+from metrics import Trace, write_trace
+
+# 환경 변수 로드
+dotenv.load_dotenv()
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+SIDECAR_NAME = "album.json"
+
+
+def load_album(album_dir):
+    """앨범 폴더에서 사진 목록과 사이드카(album.json) 정보를 읽는 함수"""
+    album_dir = Path(album_dir)
+    sidecar_path = album_dir / SIDECAR_NAME
+    sidecar = {}
+    if sidecar_path.exists():
+        with open(sidecar_path, 'r', encoding='utf-8') as f:
+            sidecar = json.load(f)
+
+    image_files = sorted(
+        p.name for p in album_dir.iterdir()
+        if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS
+    )
+    photo_infos = {photo["file"]: photo for photo in sidecar.get("photos", []) if "file" in photo}
+    ordered = [name for name in photo_infos if name in image_files]
+    ordered += [name for name in image_files if name not in photo_infos]
+
+    photos = []
+    for name in ordered:
+        info = photo_infos.get(name, {})
+        photos.append({
+            'image': name,
+            'path': str(album_dir / name),
+            'person': info.get('person') or "",
+            'location': info.get('location') or "어딘가",
+            'keywords': info.get('keywords') or ""
+        })
+
+    date = datetime.date.fromisoformat(sidecar["date"]) if sidecar.get("date") else None
+    return {
+        'album_id': album_dir.name,
+        'formatted_date': format_korean_date(date),
+        'mood': sidecar.get('mood') or "",
+        'photos': photos
+    }
+
+
+def find_albums(albums_dir):
+    """사진이 들어 있는 하위 폴더를 앨범으로 찾는 함수"""
+    return [
+        p for p in sorted(Path(albums_dir).iterdir())
+        if p.is_dir() and any(c.suffix.lower() in IMAGE_EXTENSIONS for c in p.iterdir())
+    ]
+
+
+def load_completed(output_file):
+    """이전 실행에서 성공적으로 기록된 앨범 ID를 읽는 함수 (중단된 실행 이어하기용)"""
+    completed = set()
+    if not Path(output_file).exists():
+        return completed
+    with open(output_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 비정상 종료로 마지막 줄이 잘린 경우
+                continue
+            if record.get('status') == 'ok':
+                completed.add(record['album_id'])
+    return completed
+
+
+# 캡션 워커 프로세스 상태 (프로세스마다 모델을 한 번만 로드)
+_worker_captioner = None
+
+
+def _init_caption_worker(model_name, num_threads):
+    global _worker_captioner
+    _worker_captioner = load_local_captioner(model_name, num_threads=num_threads)
+
+
+def _caption_worker(image_paths, batch_size):
+    """워커 프로세스에서 이미지들의 캡션을 배치로 생성하는 함수"""
+    images = [Image.open(path).convert('RGB') for path in image_paths]
+    _worker_captioner.max_batch_size = batch_size
+    return _worker_captioner.caption(images)
+
+
+class BatchDiaryRunner:
+    """앨범별로 캡션 생성 -> 프롬프트 구성 -> 일기 생성 -> JSONL 기록을 비동기로 수행하는 실행기"""
+
+    def __init__(self, output_file, caption_pool, client, llm_concurrency, caption_cache=None,
+                 model_name=CAPTION_MODEL_NAME, batch_size=DEFAULT_CAPTION_BATCH_SIZE, use_response_cache=True,
+                 chunk_size=DIARY_CHUNK_SIZE):
+        self.output_file = Path(output_file)
+        self.caption_pool = caption_pool
+        self.client = client
+        self.llm_semaphore = asyncio.Semaphore(max(1, llm_concurrency))
+        self.caption_cache = caption_cache
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.use_response_cache = use_response_cache
+        self.chunk_size = chunk_size
+        self.generation_settings = configured_generation_settings()
+        self.done_count = 0
+
+    def lookup_cached_captions(self, paths):
+        """사진 파일을 읽어 캡션 캐시 키를 만들고 캐시를 조회하는 함수 ((키 목록, 캡션 목록) 반환)"""
+        keys = [
+            caption_cache_key(Path(path).read_bytes(), self.model_name, self.generation_settings)
+            for path in paths
+        ]
+        return keys, [self.caption_cache.get(key) for key in keys]
+
+    def store_captions(self, keys, captions):
+        for key, caption in zip(keys, captions):
+            self.caption_cache.set(key, caption)
+
+    async def caption_album(self, album):
+        """
+        앨범 사진의 캡션을 생성하는 함수 (캐시에 없는 사진만 워커 풀로 보냄)
+        - 사진 읽기/해시와 캐시 조회·저장(SQLite)은 스레드에서 실행해, 그동안에도 다른 앨범의 LLM 요청이 진행되도록 합니다
+        """
+        loop = asyncio.get_running_loop()
+        paths = [photo['path'] for photo in album['photos']]
+        captions = [None] * len(paths)
+        keys = None
+        if self.caption_cache is not None:
+            keys, captions = await loop.run_in_executor(None, self.lookup_cached_captions, paths)
+
+        missing = [i for i, caption in enumerate(captions) if caption is None]
+        if missing:
+            new_captions = await loop.run_in_executor(
+                self.caption_pool, _caption_worker, [paths[i] for i in missing], self.batch_size
+            )
+            for i, caption in zip(missing, new_captions):
+                captions[i] = caption
+            if keys is not None:
+                await loop.run_in_executor(
+                    None, self.store_captions, [keys[i] for i in missing], new_captions
+                )
+        return captions
+
+    async def process_album(self, album_dir, total):
+        """앨범 하나를 처리하고 결과를 JSONL에 기록하는 함수"""
+        start = time.perf_counter()
+        record = {'album_id': Path(album_dir).name, 'album_dir': str(album_dir)}
+        trace = Trace("batch_diary", variant="blip")
+        try:
+            album = load_album(album_dir)
+            with trace.span("caption"):
+                captions = await self.caption_album(album)
+            captions_with_info = [
+                {**photo, 'caption': caption} for photo, caption in zip(album['photos'], captions)
+            ]
+            if needs_map_reduce(len(captions_with_info), self.chunk_size):
+                response, summaries = await self.generate_chunked(album, captions_with_info, trace)
+                record['chunks'] = [
+                    {'photos': [first, last], 'summary': summary} for first, last, summary in summaries
+                ]
+                usage = dict(trace.usage)
+            else:
+                response = await self.generate_single(album, captions_with_info, trace)
+                usage = usage_to_dict(response.usage)
+
+            record.update({
+                'status': 'ok',
+                'date': album['formatted_date'],
+                'photos': [
+                    {key: info[key] for key in ('image', 'caption', 'person', 'location', 'keywords')}
+                    for info in captions_with_info
+                ],
+                'diary': response.choices[0].message.content,
+                'usage': usage,
+                'cached': getattr(response, 'cached', False),
+            })
+        except Exception as e:
+            record.update({'status': 'error', 'error': f"{type(e).__name__}: {e}"})
+
+        record['elapsed'] = round(time.perf_counter() - start, 3)
+        record['timings'] = {stage: round(seconds, 3) for stage, seconds in trace.spans.items()}
+        trace.labels['status'] = record['status']
+        write_trace(trace)
+        self.write_record(record)
+        self.done_count += 1
+        print(f"[{self.done_count}/{total}] {record['album_id']}: {record['status']} ({record['elapsed']:.1f}초)")
+
+    async def generate_single(self, album, captions_with_info, trace):
+        """사진 정보를 한 프롬프트에 모두 넣어 일기를 생성하는 함수"""
+        with trace.span("prompt"):
+            diary_prompt = build_diary_prompt(captions_with_info, "blip", album['mood'], album['formatted_date'])
+
+        # 동시 요청 수 제한으로 기다린 시간과 실제 LLM 왕복 시간을 나눠서 기록
+        with trace.span("llm_queue"):
+            await self.llm_semaphore.acquire()
+        try:
+            with trace.span("llm"):
+                response = await acreate_with_retry(
+                    self.client,
+                    use_cache=self.use_response_cache,
+                    model=DIARY_MODEL,
+                    messages=diary_prompt.messages,
+                    temperature=DIARY_TEMPERATURE,
+                    max_tokens=DIARY_MAX_TOKENS
+                )
+        finally:
+            self.llm_semaphore.release()
+        trace.record_usage(usage_to_dict(response.usage))
+        return response
+
+    async def generate_chunked(self, album, captions_with_info, trace):
+        """
+        사진이 많은 앨범을 구간별 요약(map) -> 최종 일기(reduce)로 생성하는 함수
+        - 구간 요약 요청도 다른 앨범의 요청과 같은 llm_semaphore로 동시 요청 수를 제한합니다
+        """
+        return await generate_album_diary(
+            self.client,
+            captions_with_info,
+            "blip",
+            album['mood'],
+            album['formatted_date'],
+            chunk_size=self.chunk_size,
+            semaphore=self.llm_semaphore,
+            use_cache=self.use_response_cache,
+            trace=trace,
+            temperature=DIARY_TEMPERATURE,
+            max_tokens=DIARY_MAX_TOKENS
+        )
+
+    def write_record(self, record):
+        """결과 한 줄을 JSONL에 추가하고 바로 디스크에 반영하는 함수 (중단되어도 기록이 남도록)"""
+        with open(self.output_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def run(self, album_dirs, max_pending):
+        """앨범들을 동시에 처리하는 함수 (max_pending개까지만 동시에 진행)"""
+        slots = asyncio.Semaphore(max(1, max_pending))
+
+        async def bounded(album_dir):
+            async with slots:
+                await self.process_album(album_dir, len(album_dirs))
+
+        await asyncio.gather(*[bounded(album_dir) for album_dir in album_dirs])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='앨범 폴더 단위 일기 일괄 생성')
+    parser.add_argument('--albums_dir', type=str, required=True,
+                        help='앨범 폴더들이 들어 있는 디렉토리 경로')
+    parser.add_argument('--output_file', type=str, default='diaries.jsonl',
+                        help='결과를 기록할 JSONL 파일 경로')
+    parser.add_argument('--caption_workers', type=int, default=1,
+                        help='캡션 생성 워커 프로세스 수 (프로세스마다 BLIP-2 모델을 로드)')
+    parser.add_argument('--caption_batch_size', type=int, default=DEFAULT_CAPTION_BATCH_SIZE,
+                        help='한 번의 generate 호출에 넣을 최대 이미지 수')
+    parser.add_argument('--llm_concurrency', type=int, default=8,
+                        help='동시에 보낼 최대 일기 생성 요청 수')
+    parser.add_argument('--chunk_size', type=int, default=DIARY_CHUNK_SIZE,
+                        help='사진이 이보다 많은 앨범은 이 수만큼씩 나누어 구간 요약 후 일기 생성 (0이면 항상 한 번에 생성)')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='캡션 캐시와 일기 응답 캐시를 사용하지 않음')
+    args = parser.parse_args()
+
+    album_dirs = find_albums(args.albums_dir)
+    completed = load_completed(args.output_file)
+    pending = [album_dir for album_dir in album_dirs if album_dir.name not in completed]
+    print(f"앨범 {len(album_dirs)}개 중 완료 {len(album_dirs) - len(pending)}개, 처리할 앨범 {len(pending)}개")
+    if not pending:
+        return
+
+    Path(args.output_file).parent.mkdir(parents=True, exist_ok=True)
+    caption_cache = None if args.no_cache else PersistentLRUCache(table="captions")
+    client = create_client(async_client=True, max_retries=0)
+
+    # CPU 백엔드에서 워커끼리 코어를 두고 경쟁하지 않도록 스레드 수를 나눔
+    num_threads = CAPTION_NUM_THREADS or max(1, (os.cpu_count() or 1) // max(1, args.caption_workers))
+
+    start = time.perf_counter()
+    # CUDA를 사용하는 워커도 안전하게 띄울 수 있도록 spawn 방식 사용
+    with ProcessPoolExecutor(
+        max_workers=max(1, args.caption_workers),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_caption_worker,
+        initargs=(CAPTION_MODEL_NAME, num_threads)
+    ) as caption_pool:
+        runner = BatchDiaryRunner(
+            args.output_file, caption_pool, client, args.llm_concurrency,
+            caption_cache=caption_cache, batch_size=args.caption_batch_size,
+            use_response_cache=not args.no_cache, chunk_size=args.chunk_size
+        )
+        # 캡션 워커와 LLM 요청이 모두 쉬지 않도록 그보다 조금 많은 앨범을 동시에 진행
+        asyncio.run(runner.run(pending, max_pending=args.caption_workers * 2 + args.llm_concurrency))
+
+    print(f"완료: {runner.done_count}개 앨범 ({time.perf_counter() - start:.1f}초), 결과: {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
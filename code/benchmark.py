@@ -0,0 +1,435 @@
+"""
+성능 벤치마크 모음 (변경 전후 속도를 비교하기 위한 용도)
+
+실행:
+    python benchmark.py --num_images 200 --image_size 1024x768
+    python benchmark.py --benchmarks parse,html,diary --compare ../output/benchmarks/bench_20250201_120000.json
+
+- 합성 데이터셋(이미지 N장과 같은 형식의 keyword.txt)을 만들어 측정하므로 실제 데이터 없이 실행할 수 있습니다
+- parse: keyword.txt 파싱 속도
+- html: 정성평가 HTML 생성 시간 (썸네일이 없을 때 / 있을 때)
+- bertscore: calculate_bert_scores 처리량 (임베딩 캐시가 비었을 때 / 찼을 때)
+- caption: 캡션 모델 x 백엔드(cpu, cpu-int8 등) 조합별 캡션 생성 처리량
+- diary: 스텁 LLM 서버를 상대로 한 일기 생성 지연 시간 (프롬프트 구성 + 스트리밍)
+- 결과는 JSON 파일과 history.jsonl(실행마다 한 줄)에 기록되어 실행 간 비교가 가능합니다
+- 필요한 패키지가 없는 항목은 skipped로 기록합니다
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from PIL import Image, ImageDraw
+from keyword_parser import FIELD_SEPARATOR, IMAGE_SEPARATOR, iter_keyword_records, load_keyword_frame
+
+BENCHMARKS = ["parse", "html", "bertscore", "caption", "diary"]
+
+# 합성 데이터 생성에 사용하는 어휘
+SYNTHETIC_SUBJECTS = ["a dog", "a woman", "two friends", "a child", "a cat", "a group of people", "a man"]
+SYNTHETIC_ACTIONS = ["sitting on", "walking along", "standing in front of", "playing near", "eating at"]
+SYNTHETIC_PLACES = ["the beach", "a park", "a cafe", "the eiffel tower", "a river", "a mountain trail"]
+SYNTHETIC_KEYWORDS = ["바다", "공원", "카페", "에펠탑", "강", "산책", "친구", "강아지", "저녁", "여행"]
+
+
+def make_synthetic_dataset(data_dir, num_images, width, height, num_rows=None, seed=0):
+    """
+    합성 이미지와 keyword.txt를 만드는 함수
+    - data_dir/all_imgs에 JPEG 이미지를, data_dir/keyword.txt에 num_rows 줄(기본: 이미지 수)을 씁니다
+    - 같은 seed이면 항상 같은 데이터가 만들어집니다
+    - (이미지 파일명 목록, keyword.txt 경로)를 반환합니다
+    """
+    rng = random.Random(seed)
+    data_dir = Path(data_dir)
+    img_dir = data_dir / "all_imgs"
+    img_dir.mkdir(parents=True, exist_ok=True)
+
+    image_files = []
+    for i in range(num_images):
+        name = f"synthetic_{i:05d}.jpg"
+        image_files.append(name)
+        path = img_dir / name
+        if path.exists():
+            continue
+        # 단색 배경 위에 도형을 그려 JPEG 압축률이 실제 사진과 크게 다르지 않도록 함
+        image = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x0, y0 = rng.randrange(width), rng.randrange(height)
+            x1, y1 = x0 + rng.randrange(width // 2 + 1), y0 + rng.randrange(height // 2 + 1)
+            draw.ellipse((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+        image.effect_spread(3).save(path, format="JPEG", quality=90)
+
+    keyword_file = data_dir / "keyword.txt"
+    with open(keyword_file, "w", encoding="utf-8") as f:
+        for i in range(num_rows or num_images):
+            caption = f"{rng.choice(SYNTHETIC_SUBJECTS)} {rng.choice(SYNTHETIC_ACTIONS)} {rng.choice(SYNTHETIC_PLACES)}"
+            keyword = ", ".join(rng.sample(SYNTHETIC_KEYWORDS, 3))
+            label = "O" if rng.random() < 0.7 else "X"
+            f.write(f"{image_files[i % num_images]}{IMAGE_SEPARATOR}{caption}{FIELD_SEPARATOR}{keyword}"
+                    f"{FIELD_SEPARATOR}{label}\n")
+    return image_files, keyword_file
+
+
+def _percentile(values, q):
+    """정렬된 값에서 q(0~100) 백분위수를 구하는 함수"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _timed(fn, *args, **kwargs):
+    """함수를 실행하고 (결과, 실행 시간(초))를 반환하는 함수"""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_parse(keyword_file, repeat=5):
+    """keyword.txt 파싱 속도 측정 (pandas 일괄 파싱과 한 줄씩 스트리밍 파싱)"""
+    frame_times = []
+    stream_times = []
+    rows = 0
+    for _ in range(repeat):
+        (df, _), elapsed = _timed(load_keyword_frame, keyword_file)
+        frame_times.append(elapsed)
+        rows = len(df)
+        _, elapsed = _timed(lambda: sum(1 for _ in iter_keyword_records(keyword_file)))
+        stream_times.append(elapsed)
+    frame_best = min(frame_times)
+    stream_best = min(stream_times)
+    return {
+        "rows": rows,
+        "frame_seconds": frame_best,
+        "frame_rows_per_second": rows / frame_best if frame_best else None,
+        "stream_seconds": stream_best,
+        "stream_rows_per_second": rows / stream_best if stream_best else None,
+    }
+
+
+def bench_html(keyword_file, img_dir, output_dir, page_size=200, thumb_size=300):
+    """정성평가 HTML 생성 시간 측정 (썸네일을 처음 만들 때와 재사용할 때)"""
+    import quan_eval_html_generator
+    from keyword_parser import load_keyword_columns
+
+    columns = load_keyword_columns(keyword_file)
+    shutil.rmtree(Path(output_dir) / quan_eval_html_generator.THUMBNAIL_DIR_NAME, ignore_errors=True)
+    _, cold = _timed(quan_eval_html_generator.generate_html_report, *columns, img_dir, output_dir,
+                     page_size=page_size, thumb_size=thumb_size)
+    _, warm = _timed(quan_eval_html_generator.generate_html_report, *columns, img_dir, output_dir,
+                     page_size=page_size, thumb_size=thumb_size)
+    rows = len(columns[0])
+    return {
+        "rows": rows,
+        "cold_seconds": cold,
+        "warm_seconds": warm,
+        "warm_rows_per_second": rows / warm if warm else None,
+    }
+
+
+def bench_bertscore(keyword_file, batch_size=32):
+    """calculate_bert_scores 처리량 측정 (새 채점기로 한 번, 임베딩 캐시가 찬 상태로 한 번)"""
+    from bert_score_eval import calculate_bert_scores
+    from bert_scoring import BERT_SCORE_LAYER, BERT_SCORE_MODEL, CachedBERTScorer
+    from keyword_parser import load_keyword_columns
+
+    _, captions, keywords, _ = load_keyword_columns(keyword_file)
+    scorer, load_seconds = _timed(CachedBERTScorer, BERT_SCORE_MODEL, BERT_SCORE_LAYER, batch_size=batch_size)
+    _, cold = _timed(calculate_bert_scores, captions, keywords, scorer=scorer)
+    _, warm = _timed(calculate_bert_scores, captions, keywords, scorer=scorer)
+    rows = len(captions)
+    return {
+        "rows": rows,
+        "model_load_seconds": load_seconds,
+        "cold_seconds": cold,
+        "cold_rows_per_second": rows / cold if cold else None,
+        "warm_seconds": warm,
+        "warm_rows_per_second": rows / warm if warm else None,
+    }
+
+
+def bench_caption(img_dir, image_files, model_names, backends, num_images=8, batch_size=4,
+                  max_new_tokens=None, num_beams=None, num_threads=None):
+    """
+    캡션 모델 x 백엔드 조합별 캡션 생성 처리량 측정 (모델 로드 시간은 따로 기록)
+    - GPU가 없으면 cuda 백엔드는, 메모리가 부족하면 CPU의 BLIP-2 조합은 건너뜁니다
+    """
+    import torch
+    from caption_utils import CAPTION_BACKENDS, load_local_captioner
+
+    images = [Image.open(Path(img_dir) / name).convert("RGB") for name in image_files[:num_images]]
+    options = {}
+    for model_name in model_names:
+        for backend in backends:
+            option = f"{model_name}@{backend}"
+            if CAPTION_BACKENDS[backend]["device"] == "cuda" and not torch.cuda.is_available():
+                options[option] = {"skipped": "CUDA를 사용할 수 없습니다"}
+                continue
+            try:
+                captioner, load_seconds = _timed(load_local_captioner, model_name, backend=backend,
+                                                 max_new_tokens=max_new_tokens, num_beams=num_beams,
+                                                 num_threads=num_threads, max_batch_size=batch_size)
+            except MemoryError as e:
+                # BLIP-2를 CPU로 불러올 메모리가 부족한 환경에서는 해당 조합만 건너뜀
+                options[option] = {"skipped": str(e)}
+                continue
+            # 첫 배치의 초기화 비용이 측정에 섞이지 않도록 한 장으로 먼저 실행
+            captioner.caption(images[:1])
+            captions, elapsed = _timed(captioner.caption, images)
+            options[option] = {
+                "torch_threads": torch.get_num_threads(),
+                "model_load_seconds": load_seconds,
+                "seconds": elapsed,
+                "seconds_per_image": elapsed / len(images) if images else None,
+                "images_per_second": len(images) / elapsed if elapsed else None,
+                "sample_caption": captions[0] if captions else None,
+            }
+            del captioner
+    return {
+        "images": len(images),
+        "batch_size": batch_size,
+        "generate_kwargs": {"max_new_tokens": max_new_tokens, "num_beams": num_beams},
+        "options": options,
+    }
+
+
+def bench_diary(keyword_file, num_requests=20, concurrency=4, photos_per_diary=5,
+                latency=0.2, tokens_per_second=100.0, response_tokens=120):
+    """스텁 LLM 서버를 띄우고 일기 생성 요청(프롬프트 구성 + 스트리밍)의 지연 시간 측정"""
+    import llm_stub_server
+    from keyword_parser import load_keyword_columns
+    from llm_utils import create_client, stream_chat_completion
+    from prompt_builder import build_diary_prompt
+
+    config = llm_stub_server.StubConfig(latency=latency, tokens_per_second=tokens_per_second,
+                                        response_tokens=response_tokens)
+    server = llm_stub_server.create_server("127.0.0.1", 0, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = create_client(backend="stub", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1")
+
+    image_files, captions, keywords, _ = load_keyword_columns(keyword_file)
+    photos = [
+        {"image": image, "caption": caption, "keywords": keyword, "person": "", "location": "어딘가"}
+        for image, caption, keyword in zip(image_files, captions, keywords)
+    ]
+
+    def one_request(i):
+        start = time.perf_counter()
+        selected = [photos[(i * photos_per_diary + j) % len(photos)] for j in range(photos_per_diary)]
+        prompt = build_diary_prompt(selected, "blip", "", "2025년 2월 1일, 토요일")
+        prompt_seconds = time.perf_counter() - start
+        result = stream_chat_completion(client, prompt.messages, use_cache=False)
+        return prompt_seconds, result.time_to_first_token, time.perf_counter() - start
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            timings, wall = _timed(lambda: list(executor.map(one_request, range(num_requests))))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    prompt_times = [t[0] for t in timings]
+    first_token_times = [t[1] for t in timings if t[1] is not None]
+    latencies = [t[2] for t in timings]
+    return {
+        "requests": num_requests,
+        "concurrency": concurrency,
+        "stub_latency": latency,
+        "stub_tokens_per_second": tokens_per_second,
+        "prompt_build_p50_seconds": _percentile(prompt_times, 50),
+        "time_to_first_token_p50_seconds": _percentile(first_token_times, 50),
+        "latency_p50_seconds": _percentile(latencies, 50),
+        "latency_p95_seconds": _percentile(latencies, 95),
+        "requests_per_second": num_requests / wall if wall else None,
+    }
+
+
+def environment_info():
+    """결과 비교에 필요한 실행 환경 정보를 모으는 함수"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _split(value):
+    """쉼표로 구분된 문자열을 공백을 제거한 목록으로 바꾸는 함수"""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def run_benchmarks(names, args):
+    """선택한 벤치마크를 차례로 실행하고 항목별 결과 dict를 반환하는 함수"""
+    work_dir = Path(args.work_dir)
+    data_dir = work_dir / "data"
+    img_dir = data_dir / "all_imgs"
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+
+    print(f"합성 데이터 생성 중... (이미지 {args.num_images}장, {width}x{height}, 행 {args.num_rows or args.num_images}개)")
+    image_files, keyword_file = make_synthetic_dataset(
+        data_dir, args.num_images, width, height, num_rows=args.num_rows, seed=args.seed
+    )
+
+    runners = {
+        "parse": lambda: bench_parse(keyword_file),
+        "html": lambda: bench_html(keyword_file, img_dir, work_dir / "output"),
+        "bertscore": lambda: bench_bertscore(keyword_file),
+        "caption": lambda: bench_caption(img_dir, image_files, _split(args.caption_models),
+                                         _split(args.caption_backends), num_images=args.caption_images,
+                                         batch_size=args.caption_batch_size,
+                                         max_new_tokens=args.caption_max_new_tokens,
+                                         num_beams=args.caption_num_beams, num_threads=args.caption_num_threads),
+        "diary": lambda: bench_diary(keyword_file, num_requests=args.diary_requests,
+                                     concurrency=args.diary_concurrency, latency=args.stub_latency,
+                                     tokens_per_second=args.stub_tokens_per_second),
+    }
+
+    results = {}
+    for name in names:
+        print(f"[{name}] 측정 중...")
+        try:
+            results[name] = {"status": "ok", "metrics": runners[name]()}
+        except ImportError as e:
+            results[name] = {"status": "skipped", "reason": f"필요한 패키지가 없습니다: {e}"}
+        except Exception as e:
+            results[name] = {"status": "error", "reason": f"{type(e).__name__}: {e}"}
+        print(f"[{name}] {results[name]['status']}")
+    return results
+
+
+def write_results(report, output_dir):
+    """결과를 실행별 JSON 파일로 저장하고 history.jsonl에 한 줄 추가하는 함수"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    result_file = output_dir / f"bench_{stamp}.json"
+    with open(result_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(output_dir / "history.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps(report, ensure_ascii=False) + "\n")
+    return result_file
+
+
+def _flatten(metrics, prefix=""):
+    """중첩된 지표(dict)를 "상위.하위" 키의 평평한 dict로 바꾸는 함수"""
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare_results(previous, current):
+    """두 실행의 수치 지표를 비교해 출력하는 함수 (변화율 %)"""
+    print(f"\n=== 비교: {previous.get('environment', {}).get('git_commit')} -> "
+          f"{current.get('environment', {}).get('git_commit')} ===")
+    for name, result in current["results"].items():
+        before = previous.get("results", {}).get(name, {}).get("metrics")
+        after = result.get("metrics")
+        if not before or not after:
+            continue
+        before, after = _flatten(before), _flatten(after)
+        for metric, value in after.items():
+            old = before.get(metric)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                print(f"{name}.{metric}: {old:.4g} -> {value:.4g} ({(value - old) / old * 100:+.1f}%)")
+
+
+def main():
+    default_base_dir = Path(__file__).parent.parent
+
+    parser = argparse.ArgumentParser(description='Auto Diary 성능 벤치마크')
+    parser.add_argument('--benchmarks', type=str, default=",".join(BENCHMARKS),
+                        help=f'실행할 벤치마크 (쉼표로 구분, 선택: {", ".join(BENCHMARKS)})')
+    parser.add_argument('--num_images', type=int, default=100,
+                        help='합성 이미지 수')
+    parser.add_argument('--image_size', type=str, default='1024x768',
+                        help='합성 이미지 크기 (가로x세로)')
+    parser.add_argument('--num_rows', type=int, default=None,
+                        help='keyword.txt 행 수 (기본: 이미지 수, 파싱 벤치마크를 키울 때 사용)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='합성 데이터 난수 시드')
+    parser.add_argument('--caption_models', type=str,
+                        default="Salesforce/blip2-opt-2.7b,Salesforce/blip-image-captioning-base",
+                        help='캡션 벤치마크에 사용할 체크포인트 (쉼표로 구분)')
+    parser.add_argument('--caption_backends', type=str, default="cpu,cpu-int8",
+                        help='캡션 벤치마크에서 비교할 백엔드 (쉼표로 구분, cuda-8bit/cuda-fp16/cpu/cpu-int8)')
+    parser.add_argument('--caption_max_new_tokens', type=int, default=None,
+                        help='캡션 최대 토큰 수 (지정하지 않으면 모델 기본값)')
+    parser.add_argument('--caption_num_beams', type=int, default=None,
+                        help='캡션 빔 서치 크기 (지정하지 않으면 모델 기본값)')
+    parser.add_argument('--caption_num_threads', type=int, default=None,
+                        help='CPU 백엔드 스레드 수 (지정하지 않으면 CPU 코어 수)')
+    parser.add_argument('--caption_images', type=int, default=8,
+                        help='캡션 벤치마크에 사용할 이미지 수')
+    parser.add_argument('--caption_batch_size', type=int, default=4,
+                        help='캡션 벤치마크 배치 크기')
+    parser.add_argument('--diary_requests', type=int, default=20,
+                        help='일기 생성 벤치마크 요청 수')
+    parser.add_argument('--diary_concurrency', type=int, default=4,
+                        help='일기 생성 벤치마크 동시 요청 수')
+    parser.add_argument('--stub_latency', type=float, default=0.2,
+                        help='스텁 서버 첫 응답 지연 (초)')
+    parser.add_argument('--stub_tokens_per_second', type=float, default=100.0,
+                        help='스텁 서버 스트리밍 속도 (초당 조각 수)')
+    parser.add_argument('--work_dir', type=str, default=str(default_base_dir / "cache" / "benchmark"),
+                        help='합성 데이터와 임시 결과를 둘 디렉토리')
+    parser.add_argument('--output_dir', type=str, default=str(default_base_dir / "output" / "benchmarks"),
+                        help='벤치마크 결과(JSON)를 저장할 디렉토리')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='비교할 이전 결과 JSON 파일')
+    args = parser.parse_args()
+
+    names = _split(args.benchmarks)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"알 수 없는 벤치마크: {', '.join(unknown)}")
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": environment_info(),
+        "parameters": {
+            "num_images": args.num_images, "image_size": args.image_size,
+            "num_rows": args.num_rows or args.num_images, "seed": args.seed,
+        },
+        "results": run_benchmarks(names, args),
+    }
+    result_file = write_results(report, args.output_dir)
+
+    print("\n=== 벤치마크 결과 ===")
+    for name, result in report["results"].items():
+        if result["status"] != "ok":
+            print(f"{name}: {result['status']} ({result['reason']})")
+            continue
+        summary = ", ".join(
+            f"{metric}={value:.4g}" if isinstance(value, float) else f"{metric}={value}"
+            for metric, value in result["metrics"].items()
+        )
+        print(f"{name}: {summary}")
+    print(f"결과 파일: {result_file}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare_results(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,40 @@
 import os
-from bert_score.scorer import BERTScorer
+import asyncio
+import json
 import pandas as pd
 from dotenv import load_dotenv
-from openai import OpenAI
 import argparse
 from pathlib import Path
+from cache_utils import PersistentLRUCache, make_cache_key
+from calibration import calibration_report, print_calibration
+from bert_scoring import BERT_SCORE_LAYER, BERT_SCORE_MODEL, DEFAULT_SHARD_SIZE, get_bert_scorer, score_sharded
+from incremental_eval import FINGERPRINT_COLUMN, load_previous_rows, row_fingerprints, split_delta
+from keyword_parser import load_keyword_columns
+from llm_utils import acreate_with_retry, create_client
+from metrics import Trace, write_trace
+from results_store import DEFAULT_RESULTS_DB, save_run
 
 # .env 파일 로드
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# 번역 설정
+TRANSLATION_MODEL = os.getenv("TRANSLATION_MODEL", "gpt-4o-mini")  # 또는 사용 가능한 모델로 변경
+TRANSLATION_TEMPERATURE = 0.3
+TRANSLATION_SYSTEM_PROMPT = "영어를 한국어로 번역해주세요. 자연스러운 한국어로 번역하되, 간단명료하게 번역해주세요."
+TRANSLATION_BATCH_SYSTEM_PROMPT = (
+    TRANSLATION_SYSTEM_PROMPT
+    + ' 입력은 {"texts": [...]} 형태의 JSON입니다.'
+    + ' 각 문장을 같은 순서로 번역하여 {"translations": [...]} 형태의 JSON만 출력해주세요.'
+)
 
 def load_captions_and_keywords(file_path):
-    """키워드 파일에서 캡션과 키워드를 로드하는 함수"""
-    image_files = []
-    blip2_captions = []
-    keywords = []
-    manual_scores = []  # O/X 평가 저장
-    
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            parts = line.strip().split(' : ')
-            if len(parts) == 2:
-                image_files.append(parts[0])
-                caption_keyword_sim = parts[1].split(' / ')
-                if len(caption_keyword_sim) == 3:
-                    blip2_captions.append(caption_keyword_sim[0])
-                    keywords.append(caption_keyword_sim[1])
-                    manual_scores.append(caption_keyword_sim[2])
-    
-    return image_files, blip2_captions, keywords, manual_scores
-
-def calculate_bert_scores(captions, keywords):
-    """BERTScore를 계산하는 함수"""
-    # rescale_with_baseline을 False로 설정
-    scorer = BERTScorer(
-        lang="ko",
-        model_type="klue/bert-base",
-        num_layers=9,
-        batch_size=32,
-        nthreads=4,
-        rescale_with_baseline=False  # 베이스라인 스케일링 비활성화
-    )
+    """키워드 파일에서 캡션과 키워드를 로드하는 함수 (형식이 잘못된 줄은 줄 번호와 함께 출력)"""
+    return load_keyword_columns(file_path)
+
+def calculate_bert_scores(captions, keywords, scorer=None):
+    """BERTScore를 계산하는 함수 (한 번 로드한 채점기와 임베딩 캐시를 재사용)"""
+    if scorer is None:
+        scorer = get_bert_scorer()
     
     try:
         # BERTScore 계산
@@ -57,29 +51,291 @@ def calculate_bert_scores(captions, keywords):
         print(f"Error during BERTScore calculation: {e}")
         raise e 
 
-def translate_with_gpt4(texts):
-    """GPT-4를 사용하여 영어 텍스트를 한국어로 번역"""
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-    translated_texts = []
-    
-    for text in texts:
+async def _create_with_retry(client, messages, max_retries, base_delay, **kwargs):
+    """번역 요청을 보내는 함수 (요청 제한/연결 오류 시 지수 백오프로 재시도)"""
+    # 번역은 문장 단위 번역 캐시(translations)를 따로 쓰므로 응답 캐시는 건너뜀
+    return await acreate_with_retry(
+        client, max_retries=max_retries, base_delay=base_delay, use_cache=False,
+        model=TRANSLATION_MODEL,
+        messages=messages,
+        temperature=TRANSLATION_TEMPERATURE,
+        **kwargs
+    )
+
+async def _translate_one(client, semaphore, text, max_retries, base_delay):
+    """캡션 하나를 번역하는 함수 (실패하면 None 반환)"""
+    async with semaphore:
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",  # 또는 사용 가능한 모델로 변경
-                messages=[
-                    {"role": "system", "content": "영어를 한국어로 번역해주세요. 자연스러운 한국어로 번역하되, 간단명료하게 번역해주세요."},
+            response = await _create_with_retry(
+                client,
+                [
+                    {"role": "system", "content": TRANSLATION_SYSTEM_PROMPT},
                     {"role": "user", "content": text}
                 ],
-                temperature=0.3
+                max_retries, base_delay
             )
             translated_text = response.choices[0].message.content.strip()
-            translated_texts.append(translated_text)
             print(f"번역 완료: {text} -> {translated_text}")
+            return translated_text
         except Exception as e:
             print(f"번역 중 오류 발생: {e}")
-            translated_texts.append(text)
+            return None
+
+def _unpack_translations(content, expected_count):
+    """묶음 번역 응답(JSON)에서 번역 결과 리스트를 꺼내는 함수"""
+    content = content.strip()
+    # 코드 블록(```json ... ```)으로 감싸서 응답하는 경우 제거
+    if content.startswith("```"):
+        content = content.strip("`").removeprefix("json").strip()
+    translations = json.loads(content)["translations"]
+    if not isinstance(translations, list) or len(translations) != expected_count:
+        raise ValueError(f"번역 결과 개수가 맞지 않습니다 (기대: {expected_count})")
+    return translations
+
+async def _translate_packed(client, semaphore, texts, max_retries, base_delay):
+    """
+    여러 캡션을 JSON 배열 하나로 묶어 한 번의 요청으로 번역하는 함수
+    - 응답을 해석할 수 없으면 캡션별 개별 번역으로 대체합니다
+    - 개별 항목이 비어 있거나 문자열이 아니면 해당 항목만 None으로 반환합니다
+    """
+    async with semaphore:
+        try:
+            response = await _create_with_retry(
+                client,
+                [
+                    {"role": "system", "content": TRANSLATION_BATCH_SYSTEM_PROMPT},
+                    {"role": "user", "content": json.dumps({"texts": list(texts)}, ensure_ascii=False)}
+                ],
+                max_retries, base_delay,
+                response_format={"type": "json_object"}
+            )
+            translations = _unpack_translations(response.choices[0].message.content, len(texts))
+        except Exception as e:
+            print(f"묶음 번역 중 오류 발생, 개별 번역으로 대체합니다: {e}")
+            translations = None
+
+    if translations is None:
+        return await asyncio.gather(
+            *[_translate_one(client, semaphore, text, max_retries, base_delay) for text in texts]
+        )
+
+    results = []
+    for text, translated_text in zip(texts, translations):
+        if isinstance(translated_text, str) and translated_text.strip():
+            translated_text = translated_text.strip()
+            print(f"번역 완료: {text} -> {translated_text}")
+            results.append(translated_text)
+        else:
+            print(f"번역 결과가 비어 있습니다: {text}")
+            results.append(None)
+    return results
+
+def translation_cache_key(text, pack_size=1):
+    """
+    (원문, 모델, 시스템 프롬프트, temperature)로 번역 캐시 키를 만드는 함수
+    - 시스템 프롬프트는 번역 방식에 맞춰 고릅니다 (pack_size > 1이면 묶음 번역용 프롬프트)
+    - 개별/묶음 번역 결과는 서로 따로 캐시되며, 각 프롬프트를 바꾸면 해당 방식의 캐시만 무효화됩니다
+      (묶음 응답을 해석하지 못해 개별 번역으로 대체된 항목도 묶음 방식의 키로 저장됩니다)
+    """
+    system_prompt = TRANSLATION_SYSTEM_PROMPT if pack_size <= 1 else TRANSLATION_BATCH_SYSTEM_PROMPT
+    return make_cache_key("translation", text, TRANSLATION_MODEL, system_prompt, TRANSLATION_TEMPERATURE)
+
+async def _translate_uncached(texts, concurrency, pack_size, max_retries, base_delay, client):
+    """API로 번역하는 함수 (입력 순서대로 반환, 실패한 항목은 None)"""
+    if client is None:
+        # 재시도는 _create_with_retry에서 직접 처리하므로 클라이언트 자체 재시도는 끔
+        client = create_client(async_client=True, max_retries=0)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    if pack_size <= 1:
+        return await asyncio.gather(
+            *[_translate_one(client, semaphore, text, max_retries, base_delay) for text in texts]
+        )
+
+    chunks = [texts[i:i + pack_size] for i in range(0, len(texts), pack_size)]
+    chunk_results = await asyncio.gather(
+        *[_translate_packed(client, semaphore, chunk, max_retries, base_delay) for chunk in chunks]
+    )
+    return [translated_text for chunk in chunk_results for translated_text in chunk]
+
+async def translate_texts_async(texts, concurrency=8, pack_size=1, max_retries=5, base_delay=1.0,
+                                client=None, cache=None):
+    """
+    asyncio로 여러 캡션을 동시에 번역하는 함수
+    - concurrency: 동시에 보낼 최대 요청 수
+    - pack_size: 한 요청에 묶어 보낼 캡션 수 (1이면 캡션마다 개별 요청)
+    - cache: 번역 캐시 (있으면 API 호출 전에 먼저 조회하고, 성공한 번역만 저장)
+    - 같은 문장은 한 번만 번역하며, 결과는 입력 순서대로 반환되고 실패한 항목은 원문을 그대로 사용합니다
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+
+    results = [None] * len(texts)
+    if cache is not None:
+        results = [cache.get(translation_cache_key(text, pack_size)) for text in texts]
+
+    # 캐시에 없는 고유 문장만 API로 번역
+    pending = list(dict.fromkeys(text for text, result in zip(texts, results) if result is None))
+    translated = {}
+    if pending:
+        translated = dict(zip(
+            pending,
+            await _translate_uncached(pending, concurrency, pack_size, max_retries, base_delay, client)
+        ))
+        if cache is not None:
+            for text, translated_text in translated.items():
+                if translated_text is not None:
+                    cache.set(translation_cache_key(text, pack_size), translated_text)
+
+    return [
+        result if result is not None else (translated.get(text) or text)
+        for text, result in zip(texts, results)
+    ]
+
+def translate_with_gpt4(texts, concurrency=8, pack_size=1, cache=None):
+    """GPT-4를 사용하여 영어 텍스트를 한국어로 번역 (동시 요청 + 선택적 묶음 요청 + 캐시)"""
+    return asyncio.run(translate_texts_async(texts, concurrency=concurrency, pack_size=pack_size, cache=cache))
+
+def run_bert_score_evaluation(image_files, blip2_captions, keywords, manual_scores, output_file,
+                              concurrency=8, pack_size=1, use_cache=True, trace=None,
+                              score_workers=1, shard_size=DEFAULT_SHARD_SIZE, incremental=False, img_dir=None,
+                              results_db=DEFAULT_RESULTS_DB):
+    """
+    로드된 데이터로 캡션 번역, BERTScore 계산, 결과 저장까지 수행하는 함수
+    - run_eval.py에서 같은 프로세스 안에서 호출할 수 있도록 main과 분리되어 있습니다
+    - score_workers가 2 이상이면 행을 샤드로 나누어 여러 프로세스에서 채점하고,
+      끝난 샤드는 <output_file>.partial.jsonl에 기록해 중단된 실행을 이어서 계산합니다
+    - incremental=True이면 기존 output_file에서 행 지문이 같은 행은 재사용하고, 새로 생기거나 바뀐 행만 계산해 합칩니다
+      (img_dir를 주면 이미지 파일의 수정 시각/크기도 지문에 포함)
+    - CSV와 함께 results_db(SQLite)에 설정과 행별 점수를 새 실행으로 추가합니다 (None이면 저장하지 않음)
+    - 단계별 처리 시간을 trace에 기록합니다 (trace가 없으면 직접 만들어 지표 파일에 기록)
+    - 결과 DataFrame을 반환합니다
+    """
+    own_trace = trace is None
+    if own_trace:
+        trace = Trace("bert_score_eval")
+
+    fingerprints = row_fingerprints(image_files, blip2_captions, keywords, manual_scores, img_dir)
+    previous_rows = load_previous_rows(output_file) if incremental else {}
+    reused, pending = split_delta(fingerprints, previous_rows)
+    if incremental:
+        print(f"증분 평가: 재사용 {len(reused)}행 / 새로 계산 {len(pending)}행")
+    pending_captions = [blip2_captions[i] for i in pending]
+    pending_keywords = [keywords[i] for i in pending]
+
+    # BLIP-2 캡션 번역 (다시 계산할 행만)
+    print("캡션 번역 중...")
+    translation_cache = PersistentLRUCache(table="translations", max_disk_entries=200000) if use_cache else None
+    with trace.span("translate"):
+        translated_pending = translate_with_gpt4(pending_captions, concurrency=concurrency,
+                                                 pack_size=pack_size, cache=translation_cache)
+    
+    print("BERTScore 계산 중...")
+    if not pending:
+        # 모든 행을 재사용하면 채점 모델을 불러오지 않음
+        pending_scores = ([], [], [])
+    elif score_workers > 1:
+        # 워커 프로세스들이 샤드를 나누어 채점 (임베딩 캐시는 읽기만 함)
+        partial_file = Path(output_file).with_suffix(".partial.jsonl")
+        with trace.span("score"):
+            pending_scores = score_sharded(
+                translated_pending, pending_keywords, num_workers=score_workers, shard_size=shard_size,
+                partial_file=partial_file, load_cache=use_cache
+            )
+        partial_file.unlink(missing_ok=True)
+    else:
+        with trace.span("score"):
+            scorer = get_bert_scorer()
+            if use_cache:
+                loaded = scorer.load_embedding_cache()
+                print(f"저장된 임베딩 {loaded}개를 불러왔습니다.")
+            # 번역된 캡션으로 BERTScore 계산
+            pending_scores = calculate_bert_scores(translated_pending, pending_keywords, scorer)
+        print(f"새로 임베딩한 문장: {scorer.embedded_count}개")
+        if use_cache:
+            scorer.save_embedding_cache()
     
-    return translated_texts
+    # 재사용한 행과 새로 계산한 행을 keyword.txt 순서대로 합침
+    translated_captions = [None] * len(fingerprints)
+    precision_scores = [None] * len(fingerprints)
+    recall_scores = [None] * len(fingerprints)
+    f1_scores = [None] * len(fingerprints)
+    for i in reused:
+        row = previous_rows[fingerprints[i]]
+        translated_captions[i] = row['BLIP-2 캡션(번역)']
+        precision_scores[i] = row['BERTScore_Precision']
+        recall_scores[i] = row['BERTScore_Recall']
+        f1_scores[i] = row['BERTScore_F1']
+    for position, i in enumerate(pending):
+        translated_captions[i] = translated_pending[position]
+        precision_scores[i] = pending_scores[0][position]
+        recall_scores[i] = pending_scores[1][position]
+        f1_scores[i] = pending_scores[2][position]
+
+    # 결과를 DataFrame으로 정리
+    results_df = pd.DataFrame({
+        '이미지 파일': image_files,
+        'BLIP-2 캡션(원본)': blip2_captions,
+        'BLIP-2 캡션(번역)': translated_captions,
+        '키워드': keywords,
+        '수동 평가': manual_scores,
+        'BERTScore_Precision': precision_scores,
+        'BERTScore_Recall': recall_scores,
+        'BERTScore_F1': f1_scores,
+        FINGERPRINT_COLUMN: fingerprints
+    })
+    
+    # 통계 계산
+    avg_precision = sum(precision_scores) / len(precision_scores)
+    avg_recall = sum(recall_scores) / len(recall_scores)
+    avg_f1 = sum(f1_scores) / len(f1_scores)
+    
+    print("\n=== BERTScore 평가 결과 ===")
+    print(f"평균 Precision: {avg_precision:.4f}")
+    print(f"평균 Recall: {avg_recall:.4f}")
+    print(f"평균 F1 Score: {avg_f1:.4f}")
+    
+    # 수동 평가(O/X)와의 비교
+    o_scores = results_df[results_df['수동 평가'] == 'O']['BERTScore_F1'].mean()
+    x_scores = results_df[results_df['수동 평가'] == 'X']['BERTScore_F1'].mean()
+    
+    print("\n=== 수동 평가와의 비교 ===")
+    print(f"수동 평가 'O'인 경우의 평균 F1 Score: {o_scores:.4f}")
+    print(f"수동 평가 'X'인 경우의 평균 F1 Score: {x_scores:.4f}")
+
+    # 수동 평가를 기준으로 임계값별 자동 판정 성능(ROC-AUC, 최적 임계값, 혼동 행렬) 계산
+    with trace.span("calibrate"):
+        calibration = calibration_report(results_df)
+    print_calibration(calibration)
+    
+    # 결과를 CSV 파일로 저장
+    with trace.span("save"):
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+        results_df.to_csv(output_file, index=False, encoding='utf-8-sig')
+        run_id = None
+        if results_db is not None:
+            run_id = save_run(results_df, {
+                "scorer_model": BERT_SCORE_MODEL,
+                "scorer_layer": BERT_SCORE_LAYER,
+                "translation_model": TRANSLATION_MODEL,
+                "translation_temperature": TRANSLATION_TEMPERATURE,
+                "pack_size": pack_size,
+                "incremental": incremental,
+            }, results_db)
+        calibration_file = Path(output_file).with_name(Path(output_file).stem + "_calibration.json")
+        with open(calibration_file, 'w', encoding='utf-8') as f:
+            json.dump(calibration, f, ensure_ascii=False, indent=2)
+    print(f"\n결과가 {output_file}에 저장되었습니다. (보정 결과: {calibration_file})")
+    if run_id is not None:
+        print(f"결과 저장소에 실행 {run_id}로 기록했습니다: {results_db}")
+
+    if translation_cache is not None:
+        print(f"번역 캐시: 적중 {translation_cache.hits}건 / 미스 {translation_cache.misses}건")
+    if own_trace:
+        write_trace(trace)
+
+    return results_df
 
 def main():
     """
@@ -107,6 +363,24 @@ def main():
     parser.add_argument('--output_file', type=str, 
                        default='bert_score_results.csv',
                        help='결과를 저장할 CSV 파일명')
+    parser.add_argument('--concurrency', type=int,
+                       default=8,
+                       help='번역 시 동시에 보낼 최대 요청 수')
+    parser.add_argument('--pack_size', type=int,
+                       default=1,
+                       help='한 번의 번역 요청에 묶어 보낼 캡션 수 (1이면 개별 요청)')
+    parser.add_argument('--no_cache', action='store_true',
+                       help='번역 캐시와 임베딩 캐시를 사용하지 않고 모두 다시 계산')
+    parser.add_argument('--score_workers', type=int,
+                       default=1,
+                       help='BERTScore를 나누어 계산할 워커 프로세스 수 (2 이상이면 분할 채점, 중단 시 이어서 계산)')
+    parser.add_argument('--incremental', action='store_true',
+                       help='기존 결과 CSV에서 바뀌지 않은 행은 재사용하고 새로 생기거나 바뀐 행만 계산')
+    parser.add_argument('--no_store', action='store_true',
+                       help='결과 저장소(SQLite)에 실행 기록을 남기지 않음')
+    parser.add_argument('--shard_size', type=int,
+                       default=DEFAULT_SHARD_SIZE,
+                       help='분할 채점 시 워커에 한 번에 보낼 행 수')
     
     args = parser.parse_args()
     
@@ -123,47 +397,13 @@ def main():
     # 데이터 로드
     image_files, blip2_captions, keywords, manual_scores = load_captions_and_keywords(str(keyword_file))
     
-    # BLIP-2 캡션 번역
-    print("캡션 번역 중...")
-    translated_captions = translate_with_gpt4(blip2_captions)
-    
-    print("BERTScore 계산 중...")
-    # 번역된 캡션으로 BERTScore 계산
-    precision_scores, recall_scores, f1_scores = calculate_bert_scores(translated_captions, keywords)
-    
-    # 결과를 DataFrame으로 정리
-    results_df = pd.DataFrame({
-        '이미지 파일': image_files,
-        'BLIP-2 캡션(원본)': blip2_captions,
-        'BLIP-2 캡션(번역)': translated_captions,
-        '키워드': keywords,
-        '수동 평가': manual_scores,
-        'BERTScore_Precision': precision_scores,
-        'BERTScore_Recall': recall_scores,
-        'BERTScore_F1': f1_scores
-    })
-    
-    # 통계 계산
-    avg_precision = sum(precision_scores) / len(precision_scores)
-    avg_recall = sum(recall_scores) / len(recall_scores)
-    avg_f1 = sum(f1_scores) / len(f1_scores)
-    
-    print("\n=== BERTScore 평가 결과 ===")
-    print(f"평균 Precision: {avg_precision:.4f}")
-    print(f"평균 Recall: {avg_recall:.4f}")
-    print(f"평균 F1 Score: {avg_f1:.4f}")
-    
-    # 수동 평가(O/X)와의 비교
-    o_scores = results_df[results_df['수동 평가'] == 'O']['BERTScore_F1'].mean()
-    x_scores = results_df[results_df['수동 평가'] == 'X']['BERTScore_F1'].mean()
-    
-    print("\n=== 수동 평가와의 비교 ===")
-    print(f"수동 평가 'O'인 경우의 평균 F1 Score: {o_scores:.4f}")
-    print(f"수동 평가 'X'인 경우의 평균 F1 Score: {x_scores:.4f}")
-    
-    # 결과를 CSV 파일로 저장
-    results_df.to_csv(output_file, index=False, encoding='utf-8-sig')
-    print(f"\n결과가 {output_file}에 저장되었습니다.")
+    run_bert_score_evaluation(
+        image_files, blip2_captions, keywords, manual_scores, output_file,
+        concurrency=args.concurrency, pack_size=args.pack_size, use_cache=not args.no_cache,
+        score_workers=args.score_workers, shard_size=args.shard_size,
+        incremental=args.incremental, img_dir=data_dir / 'all_imgs',
+        results_db=None if args.no_store else DEFAULT_RESULTS_DB
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
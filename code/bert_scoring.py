@@ -0,0 +1,278 @@
+import json
+import multiprocessing
+import os
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import torch
+from torch.nn.utils.rnn import pad_sequence
+from bert_score.scorer import BERTScorer
+from bert_score.utils import get_bert_embedding, greedy_cos_idf
+from cache_utils import DEFAULT_CACHE_PATH, make_cache_key
+
+# BERTScore 설정 (평가 결과 비교를 위해 모델과 레이어를 고정)
+BERT_SCORE_MODEL = "klue/bert-base"
+BERT_SCORE_LAYER = 9
+# 분할 채점 시 한 번에 워커로 보낼 행 수 (부분 결과 저장 단위)
+DEFAULT_SHARD_SIZE = 1024
+
+
+class CachedBERTScorer:
+    """
+    BERTScorer를 한 번만 로드해 재사용하고, 문장별 토큰 임베딩을 캐시하는 채점기
+    - 같은 키워드/캡션은 한 번만 임베딩하고, 이후에는 캐시된 임베딩으로 바로 점수를 계산합니다
+    - 점수 계산 방식은 bert_score의 BERTScorer.score(idf 미사용, 베이스라인 스케일링 미사용)와 같습니다
+    """
+
+    def __init__(self, model_type=BERT_SCORE_MODEL, num_layers=BERT_SCORE_LAYER,
+                 batch_size=32, nthreads=4, max_cache_entries=10000):
+        self.model_type = model_type
+        self.num_layers = num_layers
+        self.batch_size = batch_size
+        self.max_cache_entries = max_cache_entries
+        self.scorer = BERTScorer(
+            lang="ko",
+            model_type=model_type,
+            num_layers=num_layers,
+            batch_size=batch_size,
+            nthreads=nthreads,
+            rescale_with_baseline=False  # 베이스라인 스케일링 비활성화
+        )
+
+        # idf를 사용하지 않으므로 모든 토큰 가중치는 1, [SEP]/[CLS]만 0 (BERTScorer.score와 동일)
+        tokenizer = self.scorer._tokenizer
+        self._idf_dict = defaultdict(lambda: 1.0)
+        self._idf_dict[tokenizer.sep_token_id] = 0
+        self._idf_dict[tokenizer.cls_token_id] = 0
+
+        # 문장 -> (토큰 임베딩, 토큰 가중치), LRU 순서로 유지
+        self._embeddings = OrderedDict()
+        self.embedded_count = 0
+
+    @property
+    def default_cache_file(self):
+        """모델과 레이어별 임베딩 캐시 파일 경로"""
+        model_name = self.model_type.replace("/", "_")
+        return DEFAULT_CACHE_PATH.parent / f"bert_embeddings_{model_name}_L{self.num_layers}.pt"
+
+    def _embed_missing(self, sentences):
+        """캐시에 없는 문장만 배치로 임베딩하여 캐시에 저장하는 함수"""
+        missing = [s for s in dict.fromkeys(sentences) if s not in self._embeddings]
+        # 길이가 비슷한 문장끼리 묶어 패딩을 줄임 (bert_score와 같은 정렬 기준)
+        missing.sort(key=lambda x: len(x.split(" ")), reverse=True)
+
+        with torch.no_grad():
+            for start in range(0, len(missing), self.batch_size):
+                sen_batch = missing[start:start + self.batch_size]
+                embs, masks, padded_idf = get_bert_embedding(
+                    sen_batch, self.scorer._model, self.scorer._tokenizer, self._idf_dict,
+                    device=self.scorer.device
+                )
+                embs, masks, padded_idf = embs.cpu(), masks.cpu(), padded_idf.cpu()
+                for i, sen in enumerate(sen_batch):
+                    sequence_len = masks[i].sum().item()
+                    # 슬라이스는 패딩된 배치 전체 텐서를 공유하므로, 복사해 두어야 배치 텐서가 해제되고
+                    # torch.save도 문장별 크기만큼만 저장함
+                    self._embeddings[sen] = (embs[i, :sequence_len].clone(), padded_idf[i, :sequence_len].clone())
+        self.embedded_count += len(missing)
+
+    def _pad_batch(self, sen_batch, device):
+        """캐시된 임베딩을 배치 단위로 패딩하는 함수"""
+        stats = [self._embeddings[s] for s in sen_batch]
+        for s in sen_batch:
+            self._embeddings.move_to_end(s)
+        emb = [e.to(device) for e, _ in stats]
+        idf = [i.to(device) for _, i in stats]
+        lens = torch.tensor([e.size(0) for e in emb], dtype=torch.long)
+        emb_pad = pad_sequence(emb, batch_first=True, padding_value=2.0)
+        idf_pad = pad_sequence(idf, batch_first=True)
+        pad_mask = (torch.arange(int(lens.max())).expand(len(lens), -1) < lens.unsqueeze(1)).to(device)
+        return emb_pad, pad_mask, idf_pad
+
+    def _evict(self):
+        """캐시 크기 제한을 넘으면 가장 오래 사용되지 않은 임베딩부터 삭제하는 함수"""
+        while len(self._embeddings) > self.max_cache_entries:
+            self._embeddings.popitem(last=False)
+
+    def score(self, cands, refs):
+        """후보 문장(cands)과 참조 문장(refs)의 BERTScore P, R, F1 텐서를 반환하는 함수"""
+        cands, refs = list(cands), list(refs)
+        if len(cands) != len(refs):
+            raise ValueError("cands와 refs의 개수가 같아야 합니다")
+        if not cands:
+            empty = torch.zeros(0)
+            return empty, empty, empty
+
+        self._embed_missing(cands + refs)
+
+        device = self.scorer.device
+        preds = []
+        with torch.no_grad():
+            for start in range(0, len(refs), self.batch_size):
+                ref_stats = self._pad_batch(refs[start:start + self.batch_size], device)
+                hyp_stats = self._pad_batch(cands[start:start + self.batch_size], device)
+                P, R, F = greedy_cos_idf(*ref_stats, *hyp_stats)
+                preds.append(torch.stack((P, R, F), dim=-1).cpu())
+        preds = torch.cat(preds, dim=0)
+
+        self._evict()
+        return preds[..., 0], preds[..., 1], preds[..., 2]
+
+    def load_embedding_cache(self, path=None):
+        """디스크에 저장된 임베딩 캐시를 불러오는 함수 (불러온 문장 수 반환)"""
+        path = Path(path) if path else self.default_cache_file
+        if not path.exists():
+            return 0
+        saved = torch.load(path, map_location="cpu")
+        if saved.get("model_type") != self.model_type or saved.get("num_layers") != self.num_layers:
+            return 0
+        for sen, (embedding, idf) in saved["embeddings"].items():
+            # 이전 버전이 저장한 캐시는 배치 텐서를 공유하는 슬라이스일 수 있으므로 문장별로 복사
+            self._embeddings.setdefault(sen, (embedding.clone(), idf.clone()))
+        self._evict()
+        return len(saved["embeddings"])
+
+    def save_embedding_cache(self, path=None):
+        """임베딩 캐시를 디스크에 저장하는 함수"""
+        path = Path(path) if path else self.default_cache_file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        torch.save({
+            "model_type": self.model_type,
+            "num_layers": self.num_layers,
+            "embeddings": dict(self._embeddings),
+        }, path)
+        return path
+
+
+_scorers = {}
+
+
+def get_bert_scorer(model_type=BERT_SCORE_MODEL, num_layers=BERT_SCORE_LAYER, **kwargs):
+    """프로세스 안에서 재사용할 CachedBERTScorer를 반환하는 함수 (모델/레이어별로 한 번만 로드)"""
+    key = (model_type, num_layers)
+    if key not in _scorers:
+        _scorers[key] = CachedBERTScorer(model_type=model_type, num_layers=num_layers, **kwargs)
+    return _scorers[key]
+
+
+# 채점 워커 프로세스 상태 (프로세스마다 모델을 한 번만 로드)
+_worker_scorer = None
+
+
+def _init_score_worker(model_type, num_layers, num_threads, cpu_sets, load_cache):
+    """채점 워커 초기화: 사용할 CPU 코어와 torch 스레드 수를 고정하고 채점기를 로드"""
+    global _worker_scorer
+    cpus = cpu_sets.get() if cpu_sets is not None else None
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(num_threads)
+    try:
+        # 워커 사이에서는 이미 프로세스로 병렬화하므로 연산 간 병렬화는 끔
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    _worker_scorer = get_bert_scorer(model_type, num_layers)
+    if load_cache:
+        _worker_scorer.load_embedding_cache()
+
+
+def _score_shard(start, cands, refs):
+    """워커 프로세스에서 한 샤드를 채점하는 함수 (시작 행 번호와 P, R, F1 리스트 반환)"""
+    P, R, F = _worker_scorer.score(cands, refs)
+    return start, P.tolist(), R.tolist(), F.tolist()
+
+
+def _split_cpus(num_workers):
+    """사용 가능한 CPU 코어를 워커 수만큼 겹치지 않게 나누는 함수 (코어 고정을 지원하지 않으면 None)"""
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < num_workers:
+        return None
+    per_worker = len(cpus) // num_workers
+    return [set(cpus[i * per_worker:(i + 1) * per_worker]) for i in range(num_workers)]
+
+
+def _load_partial_scores(partial_file, run_id):
+    """부분 결과 파일에서 같은 실행(run_id)의 완료된 샤드를 읽는 함수 ({시작 행: (P, R, F1)})"""
+    done = {}
+    if partial_file is None or not Path(partial_file).exists():
+        return done
+    with open(partial_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 비정상 종료로 마지막 줄이 잘린 경우
+                continue
+            if record.get("run") == run_id:
+                done[record["start"]] = (record["P"], record["R"], record["F"])
+    return done
+
+
+def score_sharded(cands, refs, num_workers=None, threads_per_worker=None, shard_size=DEFAULT_SHARD_SIZE,
+                  partial_file=None, model_type=BERT_SCORE_MODEL, num_layers=BERT_SCORE_LAYER, load_cache=True):
+    """
+    행을 샤드로 나누어 여러 워커 프로세스에서 BERTScore를 계산하는 함수 (P, R, F1 리스트를 입력 순서대로 반환)
+    - 워커마다 CPU 코어를 겹치지 않게 고정하고 torch 스레드 수를 threads_per_worker로 맞춥니다
+    - partial_file을 주면 끝난 샤드를 JSONL로 바로 기록하고, 다시 실행하면 같은 입력의 완료된 샤드는 건너뜁니다
+    """
+    cands, refs = list(cands), list(refs)
+    if len(cands) != len(refs):
+        raise ValueError("cands와 refs의 개수가 같아야 합니다")
+    num_workers = max(1, num_workers or os.cpu_count() or 1)
+    shard_size = max(1, shard_size)
+
+    # 입력이나 설정이 바뀌면 이전 부분 결과를 쓰지 않도록 실행 식별자를 만듦
+    run_id = make_cache_key("bertscore_shards", model_type, num_layers, shard_size, cands, refs)
+    done = _load_partial_scores(partial_file, run_id)
+    all_starts = range(0, len(cands), shard_size)
+    total_shards = len(all_starts)
+    starts = [start for start in all_starts if start not in done]
+    if done:
+        print(f"이전 실행에서 완료된 샤드 {len(done)}개를 불러왔습니다 (남은 샤드 {len(starts)}개)")
+
+    if starts:
+        if partial_file is not None:
+            Path(partial_file).parent.mkdir(parents=True, exist_ok=True)
+        num_workers = min(num_workers, len(starts))
+        threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        cpu_sets = None
+        ctx = multiprocessing.get_context("spawn")
+        cpu_groups = _split_cpus(num_workers)
+        if cpu_groups is not None:
+            cpu_sets = ctx.Queue()
+            for cpus in cpu_groups:
+                cpu_sets.put(cpus)
+        print(f"BERTScore 분할 채점: 샤드 {len(starts)}개, 워커 {num_workers}개 x 스레드 {threads_per_worker}개")
+
+        out = open(partial_file, "a", encoding="utf-8") if partial_file is not None else None
+        try:
+            with ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=ctx,
+                initializer=_init_score_worker,
+                initargs=(model_type, num_layers, threads_per_worker, cpu_sets, load_cache)
+            ) as pool:
+                futures = [
+                    pool.submit(_score_shard, start, cands[start:start + shard_size], refs[start:start + shard_size])
+                    for start in starts
+                ]
+                for future in as_completed(futures):
+                    start, P, R, F = future.result()
+                    done[start] = (P, R, F)
+                    if out is not None:
+                        out.write(json.dumps({"run": run_id, "start": start, "P": P, "R": R, "F": F}) + "\n")
+                        out.flush()
+                    print(f"샤드 완료: {len(done)}/{total_shards}")
+        finally:
+            if out is not None:
+                out.close()
+
+    precision, recall, f1 = [], [], []
+    for start in sorted(done):
+        P, R, F = done[start]
+        precision.extend(P)
+        recall.extend(R)
+        f1.extend(F)
+    return precision, recall, f1
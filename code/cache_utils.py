@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# 캐시 DB 기본 경로 (프로젝트 루트의 cache 디렉토리)
+DEFAULT_CACHE_PATH = Path(os.getenv(
+    "AUTODIARY_CACHE_PATH",
+    str(Path(__file__).parent.parent / "cache" / "autodiary_cache.sqlite3")
+))
+
+
+def hash_bytes(data):
+    """바이트 데이터의 SHA-256 해시를 반환하는 함수"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_cache_key(*parts):
+    """여러 값을 JSON으로 직렬화한 뒤 해시하여 캐시 키를 만드는 함수"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hash_bytes(payload.encode("utf-8"))
+
+
+class PersistentLRUCache:
+    """
+    메모리(LRU)와 SQLite 디스크를 함께 사용하는 2단 캐시
+    - 메모리: 세션 동안 빠르게 조회하기 위한 LRU (max_memory_entries 개까지 보관)
+    - 디스크: 재시작 후에도 유지되며, max_disk_entries 개를 넘으면 가장 오래 조회되지 않은 항목부터 삭제
+      (메모리에서 조회된 항목의 디스크 조회 시각은 touch_interval초마다, 그리고 삭제 전에 모아서 갱신)
+    - ttl(초)을 지정하면 저장한 지 ttl이 지난 항목은 없는 것으로 보고 삭제
+    - 값은 JSON으로 직렬화 가능한 객체여야 합니다
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, table="cache",
+                 max_memory_entries=512, max_disk_entries=10000, ttl=None, touch_interval=30.0):
+        if not table.isidentifier():
+            raise ValueError(f"잘못된 테이블 이름입니다: {table}")
+        self.db_path = Path(db_path)
+        self.table = table
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # 메모리에서 조회되어 디스크 last_access 갱신을 기다리는 {키: 조회 시각}
+        self._touched = {}
+        self._last_touch_flush = time.monotonic()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Streamlit은 세션마다 다른 스레드에서 실행되므로 스레드 간 공유를 허용하고 락으로 보호
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{self.table}_last_access ON {self.table} (last_access)"
+        )
+        self._conn.commit()
+
+    def _expired(self, created_at):
+        """저장 시각이 TTL을 지났는지 확인하는 함수"""
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _remember(self, key, value, created_at):
+        """메모리 LRU에 값을 넣고, 크기를 넘으면 가장 오래된 항목을 제거하는 함수"""
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key, default=None):
+        """캐시에서 값을 조회하는 함수 (없으면 default 반환)"""
+        with self._lock:
+            if key in self._memory:
+                value, created_at = self._memory[key]
+                if not self._expired(created_at):
+                    self._memory.move_to_end(key)
+                    self._touched[key] = time.time()
+                    if time.monotonic() - self._last_touch_flush >= self.touch_interval:
+                        self._flush_touched()
+                        self._conn.commit()
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            row = self._conn.execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or self._expired(row[1]):
+                if row is not None:
+                    self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return default
+
+            self._conn.execute(
+                f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            value = json.loads(row[0])
+            self._remember(key, value, row[1])
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """캐시에 값을 저장하고, 디스크 크기 제한을 넘으면 LRU 순서로 삭제하는 함수"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _flush_touched(self):
+        """메모리에서 조회된 항목의 디스크 last_access를 한 번에 갱신하는 함수 (커밋은 호출하는 쪽에서)"""
+        if self._touched:
+            self._conn.executemany(
+                f"UPDATE {self.table} SET last_access = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._touched.items()]
+            )
+            self._touched.clear()
+        self._last_touch_flush = time.monotonic()
+
+    def _evict(self):
+        """만료된 항목을 지우고, 디스크 항목 수가 제한을 넘으면 가장 오래 조회되지 않은 항목부터 삭제하는 함수"""
+        if self.ttl is not None:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+        count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            # 메모리에서만 조회된 자주 쓰는 항목이 먼저 삭제되지 않도록 조회 시각을 먼저 반영
+            self._flush_touched()
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._memory and not self._expired(self._memory[key][1]):
+                return True
+            row = self._conn.execute(
+                f"SELECT created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            return row is not None and not self._expired(row[0])
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def close(self):
+        """아직 반영하지 않은 조회 시각을 기록하고 DB 연결을 닫는 함수"""
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
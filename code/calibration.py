@@ -0,0 +1,173 @@
+"""
+BERTScore와 수동 평가(O/X)의 일치도 보정(calibration) 리포트
+
+사용 예:
+    python calibration.py                                   # output/bert_score_results.csv 기준
+    python calibration.py --runs RUN_A RUN_B                # 결과 저장소의 실행별 비교
+    python calibration.py --json output/calibration.json    # 결과를 JSON으로 저장
+
+- 'O'를 양성으로 보고, 점수 >= 임계값이면 O로 판정하는 자동 기준을 평가합니다
+- 모든 임계값을 NumPy로 한 번에 계산하므로(정렬 1회 + 누적합) 수십만 행도 바로 처리됩니다
+- 지표마다 ROC-AUC, F1이 가장 높은 임계값과 그때의 혼동 행렬, O/X별 점수 구간 히스토그램을 구합니다
+"""
+import argparse
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+SCORE_METRICS = ['BERTScore_Precision', 'BERTScore_Recall', 'BERTScore_F1']
+LABEL_COLUMN = '수동 평가'
+POSITIVE_LABEL = 'O'
+NEGATIVE_LABEL = 'X'
+
+
+def threshold_curve(scores, positives):
+    """
+    가능한 모든 임계값(서로 다른 점수값)에서의 TP, FP 수를 계산하는 함수
+    - (내림차순 임계값, TP 누적 수, FP 누적 수)를 반환합니다 (점수 >= 임계값이면 양성으로 판정)
+    """
+    order = np.argsort(scores, kind="stable")[::-1]
+    sorted_scores = scores[order]
+    sorted_positives = positives[order]
+    # 같은 점수가 여러 개면 마지막 위치에서만 임계값을 끊음
+    cut = np.flatnonzero(np.diff(sorted_scores)) if len(sorted_scores) > 1 else np.array([], dtype=int)
+    cut = np.append(cut, len(sorted_scores) - 1)
+    tp = np.cumsum(sorted_positives)[cut]
+    fp = (cut + 1) - tp
+    return sorted_scores[cut], tp, fp
+
+
+def roc_auc(tp, fp):
+    """누적 TP/FP로 ROC 곡선 아래 면적을 사다리꼴 공식으로 계산하는 함수"""
+    if tp[-1] == 0 or fp[-1] == 0:
+        return None
+    tpr = np.concatenate(([0.0], tp / tp[-1]))
+    fpr = np.concatenate(([0.0], fp / fp[-1]))
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+
+def calibrate_metric(scores, positives, bins=10):
+    """
+    점수 하나(P/R/F1)에 대한 보정 결과를 계산하는 함수
+    - scores: 점수 배열, positives: 수동 평가가 O인지 나타내는 bool 배열
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    positives = np.asarray(positives, dtype=bool)
+    total_positive = int(positives.sum())
+    total_negative = int(len(positives) - total_positive)
+    result = {"rows": int(len(scores)), "positives": total_positive, "negatives": total_negative}
+    if len(scores) == 0:
+        return result
+
+    thresholds, tp, fp = threshold_curve(scores, positives)
+    result["roc_auc"] = roc_auc(tp, fp)
+
+    # 각 임계값에서 O 판정의 정밀도/재현율/F1 (0으로 나누는 경우는 0으로 처리)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = tp / total_positive if total_positive else np.zeros_like(tp, dtype=np.float64)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    best = int(np.argmax(f1))
+    best_tp, best_fp = int(tp[best]), int(fp[best])
+    result["best_threshold"] = {
+        "threshold": float(thresholds[best]),
+        "f1": float(f1[best]),
+        "precision": float(precision[best]),
+        "recall": float(recall[best]),
+        "accuracy": float((best_tp + total_negative - best_fp) / len(scores)),
+        # 행: 실제 O/X, 열: 판정 O/X
+        "confusion_matrix": [[best_tp, total_positive - best_tp], [best_fp, total_negative - best_fp]],
+    }
+
+    low, high = float(scores.min()), float(scores.max())
+    edges = np.linspace(low, high if high > low else low + 1e-9, bins + 1)
+    result["histogram"] = {
+        "edges": edges.round(6).tolist(),
+        POSITIVE_LABEL: np.histogram(scores[positives], bins=edges)[0].tolist(),
+        NEGATIVE_LABEL: np.histogram(scores[~positives], bins=edges)[0].tolist(),
+    }
+    return result
+
+
+def calibration_report(results_df, metrics=SCORE_METRICS, bins=10):
+    """결과 DataFrame에서 O/X로 평가된 행만 골라 지표별 보정 결과를 계산하는 함수"""
+    labels = results_df[LABEL_COLUMN].astype(str).str.strip().to_numpy()
+    labelled = (labels == POSITIVE_LABEL) | (labels == NEGATIVE_LABEL)
+    positives = labels[labelled] == POSITIVE_LABEL
+    return {
+        metric: calibrate_metric(results_df[metric].to_numpy()[labelled], positives, bins=bins)
+        for metric in metrics if metric in results_df.columns
+    }
+
+
+def print_calibration(report, title="BERTScore 보정 결과"):
+    """보정 결과를 콘솔에 출력하는 함수"""
+    print(f"\n=== {title} ===")
+    for metric, result in report.items():
+        best = result.get("best_threshold")
+        if best is None:
+            print(f"{metric}: 평가된 행이 없습니다")
+            continue
+        auc = "-" if result["roc_auc"] is None else f"{result['roc_auc']:.4f}"
+        (tp, fn), (fp, tn) = best["confusion_matrix"]
+        print(f"{metric}: ROC-AUC {auc}, 최적 임계값 {best['threshold']:.4f} "
+              f"(F1 {best['f1']:.4f}, 정확도 {best['accuracy']:.4f})")
+        print(f"  혼동 행렬 [실제 O: 판정 O {tp} / X {fn}] [실제 X: 판정 O {fp} / X {tn}]")
+        histogram = result["histogram"]
+        for i, (o_count, x_count) in enumerate(zip(histogram[POSITIVE_LABEL], histogram[NEGATIVE_LABEL])):
+            low, high = histogram["edges"][i], histogram["edges"][i + 1]
+            print(f"  {low:.3f}~{high:.3f}: O {o_count} / X {x_count}")
+
+
+def load_run_frame(conn, run_id, metrics=SCORE_METRICS):
+    """결과 저장소에서 실행 하나의 평가 값과 점수 컬럼만 읽는 함수"""
+    from results_store import SCORE_TABLE_COLUMNS
+    columns = {SCORE_TABLE_COLUMNS[name]: name for name in [LABEL_COLUMN, *metrics]}
+    frame = pd.read_sql_query(
+        f"SELECT {', '.join(columns)} FROM scores WHERE run_id = ?", conn, params=(run_id,)
+    )
+    return frame.rename(columns=columns)
+
+
+def main():
+    default_output_dir = Path(__file__).parent.parent / 'output'
+
+    parser = argparse.ArgumentParser(description='BERTScore와 수동 평가(O/X)의 보정 리포트')
+    parser.add_argument('--csv', type=str, default=str(default_output_dir / 'bert_score_results.csv'),
+                        help='BERTScore 결과 CSV 경로 (--runs를 주지 않을 때 사용)')
+    parser.add_argument('--runs', type=str, nargs='*', default=None,
+                        help='결과 저장소의 실행 ID (여러 개 지정 가능)')
+    parser.add_argument('--db', type=str, default=None,
+                        help='결과 저장소 DB 경로 (기본: output/eval_results.sqlite3)')
+    parser.add_argument('--bins', type=int, default=10,
+                        help='히스토그램 구간 수')
+    parser.add_argument('--json', type=str, default=None,
+                        help='결과를 저장할 JSON 파일 경로')
+    args = parser.parse_args()
+
+    reports = {}
+    if args.runs:
+        from results_store import DEFAULT_RESULTS_DB, connect
+        conn = connect(args.db or DEFAULT_RESULTS_DB)
+        try:
+            for run_id in args.runs:
+                reports[run_id] = calibration_report(load_run_frame(conn, run_id), bins=args.bins)
+        finally:
+            conn.close()
+    else:
+        results_df = pd.read_csv(args.csv, encoding='utf-8-sig', usecols=[LABEL_COLUMN, *SCORE_METRICS])
+        reports[args.csv] = calibration_report(results_df, bins=args.bins)
+
+    for name, report in reports.items():
+        print_calibration(report, title=f"BERTScore 보정 결과: {name}")
+
+    if args.json:
+        Path(args.json).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+        print(f"\n보정 결과를 {args.json}에 저장했습니다.")
+
+
+if __name__ == "__main__":
+    main()
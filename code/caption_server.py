@@ -0,0 +1,229 @@
+"""
+BLIP-2 모델 하나를 여러 Streamlit 세션/서버 프로세스가 함께 쓰는 로컬 캡션 서버
+
+실행:
+    python caption_server.py --port 8810 --max_batch_size 8 --max_wait_ms 20
+
+앱에서 사용:
+    CAPTION_SERVER_URL=http://127.0.0.1:8810 streamlit run blip_streamlit.py
+
+- POST /caption: {"images": [base64 원본 이미지, ...]} -> {"captions": [...]}
+- GET /health: 모델 로드 상태, 모델 이름, 백엔드, 생성 설정(캐시 키용), 배치 통계
+- --backend cpu-int8이면 GPU 없이 동적 int8 양자화한 모델로 실행합니다 (caption_utils.CAPTION_BACKENDS 참고)
+- 여러 요청에서 들어온 이미지를 모아 최대 max_wait_ms 동안 기다린 뒤 한 번의 generate로 처리합니다 (동적 마이크로 배치)
+"""
+import argparse
+import base64
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from PIL import Image
+from caption_utils import (CAPTION_BACKEND, CAPTION_BACKENDS, CAPTION_MAX_NEW_TOKENS, CAPTION_NUM_BEAMS,
+                           CAPTION_NUM_THREADS, DEFAULT_CAPTION_BATCH_SIZE, BackgroundLoader, configured_caption_model,
+                           load_local_captioner)
+
+
+class MicroBatcher:
+    """
+    여러 스레드에서 제출한 이미지를 모아 배치로 캡션을 생성하는 객체
+    - 첫 이미지가 들어온 뒤 max_wait초 동안, 또는 max_batch_size개가 찰 때까지 모아서 한 번에 처리합니다
+    - submit()은 Future를 반환하며, 배치 처리가 끝나면 캡션(또는 예외)이 설정됩니다
+    """
+
+    def __init__(self, caption_fn, max_batch_size=DEFAULT_CAPTION_BATCH_SIZE, max_wait=0.02):
+        self.caption_fn = caption_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.batch_count = 0
+        self.image_count = 0
+        self.busy_seconds = 0.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="caption-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def _collect(self):
+        """첫 항목을 기다린 뒤, 대기 시간 안에 들어온 항목을 배치 크기까지 모으는 함수"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            start = time.perf_counter()
+            try:
+                captions = self.caption_fn([image for image, _ in batch])
+                for (_, future), caption in zip(batch, captions):
+                    future.set_result(caption)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            self.busy_seconds += time.perf_counter() - start
+            self.batch_count += 1
+            self.image_count += len(batch)
+
+    def stats(self):
+        return {
+            "batches": self.batch_count,
+            "images": self.image_count,
+            "average_batch_size": self.image_count / self.batch_count if self.batch_count else 0.0,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "queued": self._queue.qsize(),
+        }
+
+
+class CaptionService:
+    """모델 로더와 마이크로 배처를 묶어 요청을 처리하는 객체"""
+
+    def __init__(self, model_name, max_batch_size, max_wait, request_timeout=300, **captioner_kwargs):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.request_timeout = request_timeout
+        # captioner_kwargs: backend, max_new_tokens, num_beams, num_threads (load_local_captioner 인자)
+        self.loader = BackgroundLoader(load_local_captioner, model_name, **captioner_kwargs).start()
+        self._batcher = None
+        self._lock = threading.Lock()
+
+    def batcher(self):
+        """모델이 준비된 뒤 배처를 한 번만 만드는 함수"""
+        with self._lock:
+            if self._batcher is None:
+                captioner = self.loader.result
+                captioner.max_batch_size = self.max_batch_size
+                self._batcher = MicroBatcher(captioner.caption,
+                                             self.max_batch_size, self.max_wait)
+            return self._batcher
+
+    def health(self):
+        if self.loader.ready:
+            status = "ready"
+        elif self.loader.error is not None:
+            status = "error"
+        else:
+            status = "loading"
+        result = {
+            "status": status,
+            "fraction": self.loader.fraction,
+            "message": self.loader.message,
+            "model": self.model_name,
+            "load_seconds": round(self.loader.elapsed, 1),
+        }
+        if self.loader.ready:
+            result["backend"] = self.loader.result.backend
+            result["generation_settings"] = self.loader.result.generation_settings
+            result["stats"] = self.batcher().stats()
+        return result
+
+    def caption(self, images_b64):
+        images = [Image.open(BytesIO(base64.b64decode(data))).convert("RGB") for data in images_b64]
+        batcher = self.batcher()
+        futures = [batcher.submit(image) for image in images]
+        return [future.result(timeout=self.request_timeout) for future in futures]
+
+
+class CaptionHandler(BaseHTTPRequestHandler):
+    """캡션 서버 HTTP 핸들러"""
+
+    service = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self._send_json(200, self.service.health())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/caption":
+            self._send_json(404, {"error": "not found"})
+            return
+        if not self.service.loader.ready:
+            self._send_json(503, {"error": "모델을 불러오는 중입니다", **self.service.health()})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            captions = self.service.caption(body.get("images", []))
+        except (ValueError, OSError) as e:
+            self._send_json(400, {"error": f"잘못된 요청입니다: {e}"})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._send_json(200, {"captions": captions})
+
+
+def create_server(host="127.0.0.1", port=8810, service=None):
+    """캡션 서버를 만드는 함수 (serve_forever는 호출하는 쪽에서 실행)"""
+    handler = type("ConfiguredCaptionHandler", (CaptionHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='공유 캡션 서버 (동적 마이크로 배치)')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='바인딩할 주소 (기본: 로컬에서만 접근 가능)')
+    parser.add_argument('--port', type=int, default=8810,
+                        help='바인딩할 포트')
+    parser.add_argument('--model', type=str, default=None,
+                        help='사용할 캡션 체크포인트 (BLIP-2 또는 BLIP, 기본: CAPTION_MODEL 또는 백엔드에 맞는 기본값)')
+    parser.add_argument('--backend', type=str, default=CAPTION_BACKEND, choices=['auto', *CAPTION_BACKENDS],
+                        help='캡션 백엔드 (auto: GPU가 있으면 cuda-8bit, 없으면 cpu-int8)')
+    parser.add_argument('--max_new_tokens', type=int, default=CAPTION_MAX_NEW_TOKENS,
+                        help='캡션 최대 토큰 수 (지정하지 않으면 모델 기본값)')
+    parser.add_argument('--num_beams', type=int, default=CAPTION_NUM_BEAMS,
+                        help='빔 서치 크기 (지정하지 않으면 모델 기본값)')
+    parser.add_argument('--num_threads', type=int, default=CAPTION_NUM_THREADS,
+                        help='CPU 백엔드에서 사용할 스레드 수 (지정하지 않으면 CPU 코어 수)')
+    parser.add_argument('--max_batch_size', type=int, default=DEFAULT_CAPTION_BATCH_SIZE,
+                        help='한 번의 generate에 넣을 최대 이미지 수')
+    parser.add_argument('--max_wait_ms', type=float, default=20.0,
+                        help='배치를 채우기 위해 첫 이미지 이후 기다릴 최대 시간 (밀리초)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    model_name = args.model or configured_caption_model(args.backend)
+    service = CaptionService(model_name, args.max_batch_size, args.max_wait_ms / 1000,
+                             backend=args.backend, max_new_tokens=args.max_new_tokens,
+                             num_beams=args.num_beams, num_threads=args.num_threads)
+    server = create_server(args.host, args.port, service)
+    print(f"캡션 서버 실행 중: http://{args.host}:{args.port} (모델은 백그라운드에서 로드, Ctrl+C로 종료)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"종료 ({time.perf_counter() - start:.1f}초 실행), 배치 통계: "
+              f"{service.batcher().stats() if service.loader.ready else '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+import base64
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from io import BytesIO
+import torch
+from PIL import Image
+from cache_utils import hash_bytes, make_cache_key
+
+BLIP_MODEL_NAME = "Salesforce/blip2-opt-2.7b"
+# CPU 서버용 가벼운 캡션 모델 (BLIP, 약 0.25B)
+LIGHT_CAPTION_MODEL_NAME = "Salesforce/blip-image-captioning-base"
+
+# 한 번의 generate 호출에 넣을 최대 이미지 수 (환경 변수로 조정 가능)
+DEFAULT_CAPTION_BATCH_SIZE = int(os.getenv("CAPTION_BATCH_SIZE", "8"))
+
+# 캡션 백엔드별 장치/정밀도 설정
+# - cuda-8bit: 기존 방식 (bitsandbytes 8비트, GPU 필요)
+# - cpu-int8: float32로 불러온 뒤 Linear 레이어를 동적 int8 양자화 (GPU 없이 실행)
+CAPTION_BACKENDS = {
+    "cuda-8bit": {"device": "cuda", "dtype": torch.float16, "load_in_8bit": True},
+    "cuda-fp16": {"device": "cuda", "dtype": torch.float16},
+    "cpu": {"device": "cpu", "dtype": torch.float32},
+    "cpu-int8": {"device": "cpu", "dtype": torch.float32, "quantize": True},
+}
+
+
+def _env_int(name):
+    value = os.getenv(name, "").strip()
+    return int(value) if value else None
+
+
+# BLIP-2(2.7B)를 CPU 백엔드로 불러올 때 필요한 대략적인 메모리(GB) (양자화 전 float32 가중치 전체)
+BLIP2_CPU_MIN_MEMORY_GB = float(os.getenv("BLIP2_CPU_MIN_MEMORY_GB", "16"))
+
+# 캡션 모델 설정 (환경 변수로 선택, 비워 두면 모델 기본값 사용)
+CAPTION_BACKEND = os.getenv("CAPTION_BACKEND", "auto")
+CAPTION_MAX_NEW_TOKENS = _env_int("CAPTION_MAX_NEW_TOKENS")
+CAPTION_NUM_BEAMS = _env_int("CAPTION_NUM_BEAMS")
+CAPTION_NUM_THREADS = _env_int("CAPTION_NUM_THREADS")
+
+
+def resolve_caption_backend(backend=CAPTION_BACKEND):
+    """auto이면 GPU가 있을 때 cuda-8bit, 없으면 cpu-int8을 고르는 함수"""
+    if backend == "auto":
+        return "cuda-8bit" if torch.cuda.is_available() else "cpu-int8"
+    if backend not in CAPTION_BACKENDS:
+        raise ValueError(f"지원하지 않는 캡션 백엔드입니다: {backend} (선택: auto, {', '.join(CAPTION_BACKENDS)})")
+    return backend
+
+
+def default_caption_model(backend=CAPTION_BACKEND):
+    """백엔드에 맞는 기본 캡션 체크포인트를 고르는 함수 (GPU: BLIP-2, CPU: 가벼운 BLIP)"""
+    if CAPTION_BACKENDS[resolve_caption_backend(backend)]["device"] == "cpu":
+        return LIGHT_CAPTION_MODEL_NAME
+    return BLIP_MODEL_NAME
+
+
+def configured_caption_model(backend=CAPTION_BACKEND):
+    """
+    사용할 캡션 체크포인트를 정하는 함수 (CAPTION_MODEL 환경 변수, 없으면 백엔드에 맞는 기본값)
+    - GPU가 없는 환경에서 기본값으로 BLIP-2를 불러오다 메모리가 부족해지지 않도록 CPU에서는 BLIP을 사용합니다
+    """
+    return os.getenv("CAPTION_MODEL") or default_caption_model(backend)
+
+
+CAPTION_MODEL_NAME = configured_caption_model()
+
+
+def available_memory_gb():
+    """사용 가능한 메모리(GB)를 /proc/meminfo에서 읽는 함수 (Linux가 아니면 None)"""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024 / 1024
+    except OSError:
+        pass
+    return None
+
+
+def check_cpu_memory(model_name, device):
+    """BLIP-2를 CPU로 불러오기 전에 메모리가 충분한지 확인하는 함수 (부족하면 MemoryError)"""
+    if device != "cpu" or "blip2" not in model_name.lower():
+        return
+    available = available_memory_gb()
+    if available is not None and available < BLIP2_CPU_MIN_MEMORY_GB:
+        raise MemoryError(
+            f"{model_name} 모델을 CPU에서 불러오려면 약 {BLIP2_CPU_MIN_MEMORY_GB:.0f}GB 메모리가 필요합니다 "
+            f"(사용 가능: {available:.1f}GB). 환경 변수 CAPTION_MODEL에 가벼운 모델({LIGHT_CAPTION_MODEL_NAME})을 "
+            f"지정하거나 GPU 백엔드를 사용해주세요."
+        )
+
+
+def caption_generate_kwargs(max_new_tokens=CAPTION_MAX_NEW_TOKENS, num_beams=CAPTION_NUM_BEAMS):
+    """generate에 넘길 생성 옵션을 만드는 함수 (None인 항목은 모델 기본값을 쓰도록 제외)"""
+    options = {"max_new_tokens": max_new_tokens, "num_beams": num_beams}
+    return {key: value for key, value in options.items() if value is not None}
+
+
+def configure_cpu_threads(num_threads=CAPTION_NUM_THREADS):
+    """CPU 추론에 사용할 스레드 수를 정하는 함수 (지정하지 않으면 CPU 코어 수)"""
+    num_threads = num_threads or os.cpu_count() or 1
+    torch.set_num_threads(num_threads)
+    return num_threads
+
+
+def load_captioning_model(model_name=CAPTION_MODEL_NAME, backend=CAPTION_BACKEND, progress=None):
+    """
+    캡션 모델(BLIP-2 또는 BLIP)과 프로세서를 불러오는 함수 (device, processor, model, dtype 반환)
+    - backend에 따라 GPU 8비트/fp16 또는 CPU float32/동적 int8 양자화로 불러옵니다
+    - safetensors 체크포인트가 있으면 메모리 매핑으로 읽어 로드 시간과 최대 메모리 사용량을 줄입니다
+    - progress(비율, 메시지)가 주어지면 단계별 진행 상황을 알립니다
+    """
+    # transformers는 import만으로도 수 초가 걸리므로 실제로 모델을 불러올 때 import
+    from transformers import (Blip2ForConditionalGeneration, Blip2Processor, BlipForConditionalGeneration,
+                              BlipProcessor)
+
+    start = time.perf_counter()
+    report = progress or (lambda fraction, message: None)
+    backend = resolve_caption_backend(backend)
+    config = CAPTION_BACKENDS[backend]
+    device = config["device"]
+    check_cpu_memory(model_name, device)
+    if "blip2" in model_name.lower():
+        processor_class, model_class = Blip2Processor, Blip2ForConditionalGeneration
+    else:
+        processor_class, model_class = BlipProcessor, BlipForConditionalGeneration
+
+    report(0.0, "프로세서 불러오는 중")
+    processor = processor_class.from_pretrained(model_name)
+
+    report(0.1, "모델 가중치 불러오는 중")
+    model_kwargs = dict(torch_dtype=config["dtype"], low_cpu_mem_usage=True)
+    if device == "cuda":
+        model_kwargs["device_map"] = {"": 0}
+    if config.get("load_in_8bit"):
+        model_kwargs["load_in_8bit"] = True
+    try:
+        model = model_class.from_pretrained(model_name, use_safetensors=True, **model_kwargs)
+    except OSError:
+        # safetensors 파일이 없는 체크포인트는 기존 형식(.bin)으로 로드
+        model = model_class.from_pretrained(model_name, **model_kwargs)
+    model.eval()
+
+    if config.get("quantize"):
+        report(0.9, "int8 양자화 중")
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    report(1.0, "완료")
+    print(f"캡션 모델 로드 완료: {model_name} [{backend}] ({time.perf_counter() - start:.1f}초)")
+    return device, processor, model, config["dtype"]
+
+
+class BackgroundLoader:
+    """
+    모델을 백그라운드 스레드에서 불러오는 객체
+    - start()는 바로 반환하고, 스레드에서 load_fn(*args, progress=..., **kwargs)를 실행합니다
+    - fraction/message로 진행 상황을, ready/error로 결과를 확인하고, wait()로 완료를 기다릴 수 있습니다
+    """
+
+    def __init__(self, load_fn, *args, **kwargs):
+        self.load_fn = load_fn
+        self.args = args
+        self.kwargs = kwargs
+        self.fraction = 0.0
+        self.message = "대기 중"
+        self.result = None
+        self.error = None
+        self._started_at = None
+        self._finished_at = None
+        self._thread = None
+        self._done = threading.Event()
+
+    def start(self):
+        """로드를 시작하는 함수 (이미 시작했으면 아무 것도 하지 않음)"""
+        if self._thread is None:
+            self._started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, name="model-loader", daemon=True)
+            self._thread.start()
+        return self
+
+    def _progress(self, fraction, message):
+        self.fraction = fraction
+        self.message = message
+
+    def _run(self):
+        try:
+            self.result = self.load_fn(*self.args, progress=self._progress, **self.kwargs)
+        except Exception as e:
+            self.error = e
+            self.message = f"실패: {e}"
+            print(f"모델 로드 실패: {e}")
+        finally:
+            self._finished_at = time.perf_counter()
+            self._done.set()
+            if self.error is None:
+                print(f"백그라운드 모델 준비 완료 ({self.elapsed:.1f}초, 그동안 UI는 바로 사용 가능)")
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def ready(self):
+        return self.done and self.error is None
+
+    @property
+    def elapsed(self):
+        """로드 시작 후 지난 시간 (완료되었으면 전체 로드 시간)"""
+        if self._started_at is None:
+            return 0.0
+        return (self._finished_at or time.perf_counter()) - self._started_at
+
+    def wait(self, timeout=None):
+        """로드가 끝날 때까지 기다린 뒤 결과를 반환하는 함수 (실패했으면 예외 발생)"""
+        self.start()
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"모델 로드가 {timeout}초 안에 끝나지 않았습니다")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def group_by_length(lengths, max_batch_size):
+    """길이가 비슷한 항목끼리 묶어 패딩을 최소화한 배치 인덱스 목록을 반환하는 함수"""
+    # 정렬은 안정 정렬이므로 길이가 같으면 원래 순서가 유지됩니다
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + max_batch_size] for i in range(0, len(order), max_batch_size)]
+
+
+def generate_captions(images, processor, model, device, max_batch_size=DEFAULT_CAPTION_BATCH_SIZE,
+                      prompts=None, dtype=torch.float16, **generate_kwargs):
+    """
+    여러 이미지의 캡션(BLIP-2 또는 BLIP)을 배치 단위로 생성하는 함수
+    - 이미지는 프로세서에서 같은 크기로 리사이즈되므로, 패딩은 프롬프트 길이에만 영향을 받습니다
+    - 프롬프트가 없으면 입력 순서대로 max_batch_size개씩 묶고, 프롬프트가 있으면 길이가 비슷한 것끼리 묶어 패딩을 줄입니다
+    - 결과는 입력(업로드) 순서대로 반환합니다
+    """
+    if not images:
+        return []
+    if prompts is not None and len(prompts) != len(images):
+        raise ValueError("prompts의 개수는 images의 개수와 같아야 합니다")
+
+    max_batch_size = max(1, int(max_batch_size))
+    if prompts is None:
+        # 패딩이 생기지 않으므로 정렬 없이 순서대로 나눔
+        batches = [
+            list(range(start, min(start + max_batch_size, len(images))))
+            for start in range(0, len(images), max_batch_size)
+        ]
+    else:
+        batches = group_by_length([len(processor.tokenizer(p)["input_ids"]) for p in prompts], max_batch_size)
+
+    captions = [None] * len(images)
+    with torch.inference_mode():
+        for batch_indices in batches:
+            batch_images = [images[i] for i in batch_indices]
+            if prompts is None:
+                inputs = processor(images=batch_images, return_tensors="pt")
+            else:
+                batch_prompts = [prompts[i] for i in batch_indices]
+                inputs = processor(images=batch_images, text=batch_prompts, padding=True, return_tensors="pt")
+            inputs = inputs.to(device, dtype)
+            generated_ids = model.generate(**inputs, **generate_kwargs)
+            texts = processor.batch_decode(generated_ids, skip_special_tokens=True)
+            for i, text in zip(batch_indices, texts):
+                captions[i] = text.strip()
+
+    return captions
+
+
+def caption_cache_key(image_bytes, model_name, generation_settings):
+    """이미지 내용 해시, 모델 이름, 생성 설정으로 캡션 캐시 키를 만드는 함수"""
+    return make_cache_key("caption", hash_bytes(image_bytes), model_name, generation_settings)
+
+
+def caption_generation_settings(dtype=torch.float16, **generate_kwargs):
+    """캡션 캐시 키에 들어갈 생성 설정을 만드는 함수"""
+    return {"dtype": str(dtype), **generate_kwargs}
+
+
+def lookup_cached_captions(image_bytes_list, cache, model_name=None, generation_settings=None):
+    """
+    캐시에 있는 캡션만 조회하는 함수 (모델이 필요 없음)
+    - model_name/generation_settings를 주지 않으면 환경 변수로 설정된 캡션 모델 기준으로 키를 만듭니다
+    - (캡션 목록(없으면 None), 캐시 키 목록)을 반환합니다
+    """
+    model_name = model_name or CAPTION_MODEL_NAME
+    if generation_settings is None:
+        generation_settings = configured_generation_settings()
+    keys = [caption_cache_key(data, model_name, generation_settings) for data in image_bytes_list]
+    return [cache.get(key) for key in keys], keys
+
+
+class LocalCaptioner:
+    """이 프로세스에 올린 캡션 모델로 캡션을 생성하는 객체"""
+
+    def __init__(self, device, processor, model, model_name=CAPTION_MODEL_NAME,
+                 max_batch_size=DEFAULT_CAPTION_BATCH_SIZE, dtype=torch.float16, backend=None, **generate_kwargs):
+        self.device = device
+        self.processor = processor
+        self.model = model
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.dtype = dtype
+        self.backend = backend
+        self.generate_kwargs = generate_kwargs
+        settings_kwargs = dict(generate_kwargs, backend=backend) if backend else generate_kwargs
+        self.generation_settings = caption_generation_settings(dtype, **settings_kwargs)
+
+    def caption(self, images, image_bytes_list=None):
+        if images is None:
+            # 원본 바이트만 받은 경우 여기서 디코딩하고, 캡션 생성이 끝나면 원본 크기 이미지는 바로 해제
+            images = [Image.open(BytesIO(data)).convert("RGB") for data in image_bytes_list]
+        return generate_captions(images, self.processor, self.model, self.device,
+                                 max_batch_size=self.max_batch_size, dtype=self.dtype, **self.generate_kwargs)
+
+
+def configured_generation_settings(backend=CAPTION_BACKEND, max_new_tokens=CAPTION_MAX_NEW_TOKENS,
+                                   num_beams=CAPTION_NUM_BEAMS):
+    """설정대로 불러올 캡션 모델의 생성 설정을 모델 없이 계산하는 함수 (캐시 키용)"""
+    backend = resolve_caption_backend(backend)
+    return caption_generation_settings(
+        CAPTION_BACKENDS[backend]["dtype"], backend=backend, **caption_generate_kwargs(max_new_tokens, num_beams)
+    )
+
+
+def load_local_captioner(model_name=CAPTION_MODEL_NAME, progress=None, backend=CAPTION_BACKEND,
+                         max_new_tokens=CAPTION_MAX_NEW_TOKENS, num_beams=CAPTION_NUM_BEAMS,
+                         num_threads=CAPTION_NUM_THREADS, max_batch_size=DEFAULT_CAPTION_BATCH_SIZE):
+    """설정된 백엔드로 캡션 모델을 불러와 LocalCaptioner로 감싸는 함수 (BackgroundLoader에서 사용)"""
+    backend = resolve_caption_backend(backend)
+    if CAPTION_BACKENDS[backend]["device"] == "cpu":
+        print(f"CPU 스레드 수: {configure_cpu_threads(num_threads)}")
+    device, processor, model, dtype = load_captioning_model(model_name, backend, progress=progress)
+    return LocalCaptioner(device, processor, model, model_name=model_name, max_batch_size=max_batch_size,
+                          dtype=dtype, backend=backend, **caption_generate_kwargs(max_new_tokens, num_beams))
+
+
+class RemoteCaptioner:
+    """캡션 서버(caption_server.py)에 원본 이미지 바이트를 보내 캡션을 받는 객체"""
+
+    def __init__(self, url, model_name, generation_settings, timeout=300):
+        self.url = url.rstrip("/")
+        self.model_name = model_name
+        self.generation_settings = generation_settings
+        self.timeout = timeout
+
+    def caption(self, images, image_bytes_list):
+        payload = json.dumps({
+            "images": [base64.b64encode(data).decode("ascii") for data in image_bytes_list]
+        }).encode("utf-8")
+        request = urllib.request.Request(
+            f"{self.url}/caption", data=payload, headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())["captions"]
+
+
+def caption_server_status(url, timeout=5):
+    """캡션 서버의 상태(/health)를 조회하는 함수"""
+    with urllib.request.urlopen(f"{url.rstrip('/')}/health", timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def connect_caption_server(url, progress=None, poll_interval=1.0, timeout=900):
+    """
+    캡션 서버의 모델이 준비될 때까지 기다린 뒤 RemoteCaptioner를 반환하는 함수 (BackgroundLoader에서 사용)
+    - 서버의 로드 진행 상황을 progress(비율, 메시지)로 전달합니다
+    """
+    report = progress or (lambda fraction, message: None)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            status = caption_server_status(url)
+            if status["status"] == "ready":
+                report(1.0, "완료")
+                return RemoteCaptioner(url, status["model"], status["generation_settings"])
+            if status["status"] == "error":
+                raise RuntimeError(f"캡션 서버 모델 로드 실패: {status.get('message')}")
+            report(status.get("fraction", 0.0), f"캡션 서버: {status.get('message', '')}")
+        except (urllib.error.URLError, ConnectionError) as e:
+            report(0.0, f"캡션 서버 연결 대기 중 ({e})")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"캡션 서버가 {timeout}초 안에 준비되지 않았습니다: {url}")
+        time.sleep(poll_interval)
+
+
+def caption_with_cache(images, image_bytes_list, cache, captioner):
+    """
+    캐시를 먼저 조회하고, 캐시에 없는 이미지만 captioner(LocalCaptioner/RemoteCaptioner)로 캡션을 생성하는 함수
+    - images와 image_bytes_list는 같은 순서여야 합니다 (image_bytes_list는 원본 파일 바이트)
+    - images가 None이면 캐시에 없는 이미지만 필요할 때 원본 바이트에서 디코딩합니다
+    - 모든 이미지가 캐시에 있으면 모델을 전혀 실행하지 않습니다
+    """
+    captions, keys = lookup_cached_captions(image_bytes_list, cache, captioner.model_name,
+                                            captioner.generation_settings)
+
+    missing = [i for i, caption in enumerate(captions) if caption is None]
+    if missing:
+        missing_images = [images[i] for i in missing] if images is not None else None
+        new_captions = captioner.caption(missing_images, [image_bytes_list[i] for i in missing])
+        for i, caption in zip(missing, new_captions):
+            captions[i] = caption
+            cache.set(keys[i], caption)
+
+    return captions
+
+
+def generate_captions_cached(images, image_bytes_list, processor, model, device, cache, model_name,
+                             max_batch_size=DEFAULT_CAPTION_BATCH_SIZE, dtype=torch.float16, **generate_kwargs):
+    """
+    캐시를 먼저 조회하고, 캐시에 없는 이미지만 배치로 캡션을 생성하는 함수
+    - images와 image_bytes_list는 같은 순서여야 합니다 (image_bytes_list는 원본 파일 바이트)
+    - 모든 이미지가 캐시에 있으면 모델 forward를 전혀 실행하지 않습니다
+    """
+    captioner = LocalCaptioner(device, processor, model, model_name=model_name,
+                               max_batch_size=max_batch_size, dtype=dtype, **generate_kwargs)
+    return caption_with_cache(images, image_bytes_list, cache, captioner)
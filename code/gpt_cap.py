@@ -9,123 +9,130 @@ Original file is located at
 
 import streamlit as st
 import os
-from PIL import Image
-from transformers import Blip2Processor, Blip2ForConditionalGeneration
-import torch
-from openai import OpenAI
+from llm_utils import create_client
 import dotenv
-import datetime
+from prompt_builder import build_diary_prompt, format_korean_date
+from ui_utils import (write_diary, diary_messages, show_last_diary, show_prompt_estimate, show_trace,
+                      wait_for_model, load_uploaded_photos, DIARY_STATE_KEY)
+from metrics import Trace
+from caption_utils import (caption_with_cache, connect_caption_server, lookup_cached_captions, load_local_captioner,
+                           BackgroundLoader)
+from cache_utils import PersistentLRUCache
 
 
 # 환경 변수 로드
 dotenv.load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+formatted_date = format_korean_date()
 
 # 페이지 설정
 st.set_page_config(page_title="사진 일기 생성기", layout="wide")
 st.title("AI 사진 일기 생성기")
 
-# BLIP 모델 초기화
+# 캡션 서버(caption_server.py) 주소를 지정하면 이 프로세스에는 모델을 올리지 않고 서버에 캡션을 요청
+CAPTION_SERVER_URL = os.getenv("CAPTION_SERVER_URL")
+
+# BLIP 모델은 백그라운드 스레드에서 불러오고, 화면은 바로 표시 (업로드/입력은 로딩 중에도 가능)
+@st.cache_resource
+def get_model_loader():
+    if CAPTION_SERVER_URL:
+        print(f"캡션 서버 사용: {CAPTION_SERVER_URL}")
+        return BackgroundLoader(connect_caption_server, CAPTION_SERVER_URL).start()
+    print("캡션 모델 백그라운드 로드 시작")
+    return BackgroundLoader(load_local_captioner).start()
+
+model_loader = get_model_loader()
+
+# 캡션 캐시 초기화 (이미지 내용 해시 기준, 세션 메모리 + 디스크)
 @st.cache_resource
-def load_models():
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    processor = Blip2Processor.from_pretrained("Salesforce/blip2-opt-2.7b")
-    model = Blip2ForConditionalGeneration.from_pretrained(
-        "Salesforce/blip2-opt-2.7b",
-        load_in_8bit=True,
-        device_map={"": 0},
-        torch_dtype=torch.float16
-    )
-    return device, processor, model
-
-device, processor, model = load_models()
-
-# OpenAI 클라이언트 초기화
-client = OpenAI(api_key=OPENAI_API_KEY)
+def load_caption_cache():
+    return PersistentLRUCache(table="captions")
+
+caption_cache = load_caption_cache()
+
+# LLM 클라이언트 초기화 (LLM_BACKEND 환경 변수로 OpenAI/스텁 서버 선택)
+client = create_client()
 
 # 파일 업로드 섹션
 st.header("사진 업로드")
 uploaded_files = st.file_uploader("여러 장의 사진을 선택하세요", type=['jpg', 'jpeg', 'png'], accept_multiple_files=True)
 
 if uploaded_files:
+    trace = Trace("gpt_cap", variant="caption")
     captions_with_info = []
 
-    for uploaded_file in uploaded_files:
-        st.subheader(f"사진: {uploaded_file.name}")
+    # 사진별 썸네일은 내용 해시 기준으로 session_state에 캐시 (다시 실행되어도 원본을 다시 디코딩하지 않음)
+    photos = load_uploaded_photos(uploaded_files, trace=trace)
+
+    # 이번 세션에서 이미 만든 캡션은 재사용하고, 나머지만 캐시 조회 후 배치로 생성
+    # 원본 크기 이미지는 캡션을 새로 생성할 사진만 디코딩하고, 생성이 끝나면 바로 해제
+    # 모델이 아직 준비되지 않았으면 캐시에 있는 캡션만 먼저 표시
+    pending = [photo for photo in photos if photo["entry"].get("caption") is None]
+    if pending:
+        pending_bytes = [photo["data"] for photo in pending]
+        captioner = wait_for_model(model_loader)
+        with trace.span("caption"):
+            if captioner is not None:
+                new_captions = caption_with_cache(None, pending_bytes, caption_cache, captioner)
+            else:
+                new_captions, _ = lookup_cached_captions(pending_bytes, caption_cache)
+        for photo, caption in zip(pending, new_captions):
+            if caption is not None:
+                photo["entry"]["caption"] = caption
+    generated_captions = [photo["entry"].get("caption") for photo in photos]
+    captions_ready = all(caption is not None for caption in generated_captions)
+
+    for photo, generated_text in zip(photos, generated_captions):
+        st.subheader(f"사진: {photo['name']}")
 
         # 이미지와 입력 필드를 나란히 배치
         col1, col2 = st.columns([1, 2])  # 1:2 비율로 컬럼 분할
 
         with col1:
-            # 이미지 표시
-            image = Image.open(uploaded_file)
-            # PIL 이미지를 RGB로 변환
-            image = image.convert('RGB')
-            st.image(image, caption=uploaded_file.name, width=200)
+            # 썸네일 표시
+            st.image(photo["entry"]["thumbnail"], caption=photo["name"], width=200)
 
         with col2:
-            # BLIP 캡션 생성
-            inputs = processor(images=image, return_tensors="pt").to(device, torch.float16)
-            generated_ids = model.generate(**inputs)
-            generated_text = processor.batch_decode(generated_ids, skip_special_tokens=True)[0].strip()
-
-            st.write(f"BLIP 캡션: {generated_text}")
+            st.write(f"BLIP 캡션: {generated_text}" if generated_text is not None
+                     else "BLIP 캡션: 모델을 불러오는 중입니다...")
 
 
         # 정보 저장
         caption_info = {
-            'image': uploaded_file.name,
-            'caption': generated_text
+            'image': photo['name'],
+            'caption': generated_text or ""
         }
         captions_with_info.append(caption_info)
 
         # 구분선 추가
         st.divider()
 
-    # 일기 분위기 직접 입력
-    mood = st.text_input('일기의 분위기를 입력해주세요 (입력하지 않으면 평범한 톤으로 작성됩니다)', '')
-
-    # 일기 생성 버튼
-    if st.button("일기 생성하기"):
-        with st.spinner("AI가 일기를 작성하고 있습니다..."):
-            diary_prompt = """오늘 찍은 사진들을 보고 일기를 작성해주세요.
-각 사진에는 AI가 생성한 캡션이 제공됩니다.
-이 정보들을 자연스럽게 활용하여 실제 있었던 일만을 서술해주세요.
-"""
-            diary_prompt += "**입력된 사진 정보** (순서대로 작성해주세요):\n"
-
-            for i, info in enumerate(captions_with_info, 1):
-                diary_prompt += f"사진 {i}\n"
-                diary_prompt += f"- AI 캡션: {info['caption']}\n\n"
-
-            base_guidelines = """
-**일기 작성 가이드라인**:
-1. **일기의 주체는 "나"**입니다.
-2. **AI 캡션의 장소, 인물, 활동 내용을 적극적으로 활용**하여 실제 경험을 기록하는 것처럼 자연스럽게 서술해주세요.
-3. **감정 표현을 추가적으로 반영**하여 좀 더 몰입할 수 있는 글이 되도록 해주세요.
-4. **사진이 업로드된 순서를 시간 순서로 간주하고**, 입력된 순서대로 일기를 작성해주세요. (밤에 찍은 사진 뒤에 낮에 찍은 사진이 오면, 다음 날로 간주해주세요)
-5. **주어진 정보만을 활용**하여, 날짜 정보는 반영하지않고, 사실적으로 일기를 작성해주세요."""
-
-            if mood.strip():  # mood가 비어있지 않은 경우
-                diary_prompt += base_guidelines + f'\n6. **입력 받은 분위기에 맞게 일기를 작성**해주세요. 입력 받은 분위기: "{mood}"'
-            else:  # mood가 비어있는 경우
-                diary_prompt += base_guidelines
-
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "당신은 사진 속 상황을 객관적으로 서술하는 작가입니다."},
-                    {"role": "user", "content": diary_prompt}
-                ],
-                temperature=0.3,  # 창의성을 낮춰서 더 사실적인 응답 유도
-                max_tokens=1000
-            )
-
-            # 결과 표시
-            today = datetime.date.today()
-            weekday = ["월요일", "화요일", "수요일", "목요일", "금요일", "토요일", "일요일"]
-            formatted_date = f"{today.year}년 {today.month}월 {today.day}일, {weekday[today.weekday()]}"
-            st.header(f"📅 {formatted_date}")
-            st.write(response.choices[0].message.content)
+    # 분위기 입력은 폼으로 묶어, 입력하는 동안에는 다시 실행되지 않고 '일기 생성하기'를 누를 때 한 번에 반영
+    with st.form("diary_inputs"):
+        # 일기 분위기 직접 입력
+        mood = st.text_input('일기의 분위기를 입력해주세요 (입력하지 않으면 평범한 톤으로 작성됩니다)', '')
+        use_cache = st.checkbox("같은 입력이면 이전에 생성한 일기 재사용 (해제하면 새로 생성)", value=True)
+
+        # 일기 생성 버튼
+        submitted = st.form_submit_button("일기 생성하기", disabled=not captions_ready)
+
+    # 일기 프롬프트 구성 (보내기 전에 예상 입력 토큰 수 표시)
+    with trace.span("prompt"):
+        diary_prompt = build_diary_prompt(captions_with_info, "caption", mood)
+    show_prompt_estimate(diary_prompt, len(captions_with_info))
+
+    if submitted:
+        # 결과 표시 (스트리밍 모드에서는 토큰이 도착할 때마다 갱신)
+        st.header(f"📅 {formatted_date}")
+        messages = diary_messages(diary_prompt, captions_with_info, "caption", mood,
+                                  use_cache=use_cache, trace=trace)
+        write_diary(client, messages, use_cache=use_cache, trace=trace)
+    elif DIARY_STATE_KEY in st.session_state:
+        # 이전에 생성한(또는 중단된) 일기를 다시 표시
+        st.header(f"📅 {formatted_date}")
+        show_last_diary()
+
+    # 이번 실행의 단계별 처리 시간 (사이드바)
+    show_trace(trace)
 else:
     st.info("위의 업로더를 통해 사진을 선택해주세요.")
\ No newline at end of file
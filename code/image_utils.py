@@ -0,0 +1,94 @@
+import base64
+import os
+from io import BytesIO
+from PIL import Image, ImageOps
+
+# GPT에 보낼 이미지 전처리 설정 (환경 변수로 조정 가능)
+DEFAULT_MAX_EDGE = int(os.getenv("GPT_IMAGE_MAX_EDGE", "1024"))
+DEFAULT_JPEG_QUALITY = int(os.getenv("GPT_IMAGE_JPEG_QUALITY", "85"))
+# 한 요청에 담을 이미지의 base64 총 용량 (bytes)
+DEFAULT_PAYLOAD_BUDGET = int(os.getenv("GPT_IMAGE_PAYLOAD_BUDGET", str(8 * 1024 * 1024)))
+# 예산을 맞추기 위해 줄일 수 있는 최소 크기와 품질
+MIN_MAX_EDGE = 384
+MIN_JPEG_QUALITY = 50
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+class PayloadBudgetError(ValueError):
+    """이미지를 최소 크기로 줄여도 요청 용량 예산을 넘을 때 발생하는 예외"""
+
+
+def _has_alpha(image):
+    """이미지에 투명도 정보가 있는지 확인하는 함수"""
+    return image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def prepare_image(data, max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_JPEG_QUALITY, keep_original=True):
+    """
+    업로드된 이미지 바이트를 GPT 전송용으로 줄이는 함수
+    - JPEG은 축소 디코딩(draft)으로 필요한 크기만큼만 디코딩합니다
+    - EXIF 회전 정보를 반영하고, 긴 변이 max_edge를 넘지 않도록 리사이즈한 뒤 다시 인코딩합니다
+    - keep_original=True이고 이미 충분히 작으며 회전이 필요 없으면 원본 바이트를 그대로 사용합니다
+    - (이미지 바이트, MIME 타입, (가로, 세로))를 반환합니다
+    """
+    with Image.open(BytesIO(data)) as image:
+        image_format = image.format
+        original_size = image.size
+        orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+
+        if (keep_original and max(original_size) <= max_edge and orientation == 1
+                and image_format in MIME_TYPES):
+            return data, MIME_TYPES[image_format], original_size
+
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        output = BytesIO()
+        if image_format == "PNG" and _has_alpha(image):
+            # 투명 배경이 있는 PNG는 JPEG으로 바꾸면 배경이 깨지므로 PNG로 유지
+            image.save(output, format="PNG", optimize=True)
+            return output.getvalue(), "image/png", image.size
+
+        image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue(), "image/jpeg", image.size
+
+
+def encode_image(data, max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_JPEG_QUALITY, keep_original=True):
+    """이미지 하나를 전송용으로 줄여 (base64 문자열, MIME 타입, (가로, 세로))로 반환하는 함수"""
+    image_bytes, mime_type, size = prepare_image(data, max_edge=max_edge, quality=quality,
+                                                 keep_original=keep_original)
+    return base64.b64encode(image_bytes).decode("utf-8"), mime_type, size
+
+
+def encode_images_within_budget(images_data, max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_JPEG_QUALITY,
+                                budget_bytes=DEFAULT_PAYLOAD_BUDGET):
+    """
+    여러 이미지를 base64로 인코딩하되, 한 요청의 총 용량이 예산을 넘지 않도록 하는 함수
+    - 예산을 넘으면 max_edge와 quality를 단계적으로 낮춰 다시 인코딩합니다
+    - [(base64 문자열, MIME 타입, (가로, 세로)), ...]를 입력 순서대로 반환합니다
+    """
+    keep_original = True
+    while True:
+        encoded = [encode_image(data, max_edge=max_edge, quality=quality, keep_original=keep_original)
+                   for data in images_data]
+
+        total_bytes = sum(len(b64) for b64, _, _ in encoded)
+        if total_bytes <= budget_bytes:
+            return encoded
+        if max_edge <= MIN_MAX_EDGE and quality <= MIN_JPEG_QUALITY:
+            raise PayloadBudgetError(
+                f"이미지 {len(encoded)}장의 전송 용량({total_bytes / 1024 / 1024:.1f}MB)이 "
+                f"예산({budget_bytes / 1024 / 1024:.1f}MB)을 넘습니다. 사진 수를 줄여주세요."
+            )
+        # 다시 인코딩할 때는 작은 원본도 함께 압축
+        keep_original = False
+        max_edge = max(MIN_MAX_EDGE, int(max_edge * 0.75))
+        quality = max(MIN_JPEG_QUALITY, quality - 10)
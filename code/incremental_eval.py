@@ -0,0 +1,59 @@
+"""
+keyword.txt 행 단위 증분 평가 도우미
+
+- 행 지문: (이미지 파일명, 캡션, 키워드, 평가, 이미지 파일의 수정 시각/크기)로 만든 해시
+- 이전 결과 파일에 지문 컬럼을 함께 저장해 두고, 다음 실행에서는 지문이 바뀌었거나 새로 생긴 행만 다시 계산합니다
+"""
+from pathlib import Path
+import pandas as pd
+from cache_utils import make_cache_key
+
+FINGERPRINT_COLUMN = "row_fingerprint"
+
+
+def image_signature(path):
+    """이미지 파일의 (수정 시각(ns), 크기) 문자열을 반환하는 함수 (파일이 없으면 None)"""
+    try:
+        stat = Path(path).stat()
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def row_fingerprints(image_files, captions, keywords, labels, img_dir=None):
+    """
+    행마다 지문을 만드는 함수 (입력 순서대로 반환)
+    - img_dir를 주면 이미지 파일의 수정 시각/크기도 지문에 포함되어, 사진을 교체한 행도 다시 계산합니다
+    - 같은 이미지가 여러 행에 나와도 stat은 한 번만 호출합니다
+    """
+    signatures = {}
+    if img_dir is not None:
+        img_dir = Path(img_dir)
+        signatures = {name: image_signature(img_dir / name) for name in dict.fromkeys(image_files)}
+    return [
+        make_cache_key("eval_row", image_file, caption, keyword, label, signatures.get(image_file))
+        for image_file, caption, keyword, label in zip(image_files, captions, keywords, labels)
+    ]
+
+
+def load_previous_rows(result_file):
+    """
+    이전 실행 결과 CSV에서 {행 지문: 행(dict)}을 읽는 함수
+    - 파일이 없거나 지문 컬럼이 없는(증분 모드 이전에 만든) 결과면 빈 dict를 반환합니다
+    """
+    result_file = Path(result_file)
+    if not result_file.exists():
+        return {}
+    previous = pd.read_csv(result_file, encoding='utf-8-sig', keep_default_na=False)
+    if FINGERPRINT_COLUMN not in previous.columns:
+        print(f"{result_file}에 행 지문이 없어 전체를 다시 계산합니다.")
+        return {}
+    return {row[FINGERPRINT_COLUMN]: row for row in previous.to_dict('records')}
+
+
+def split_delta(fingerprints, previous_rows):
+    """재사용할 행과 다시 계산할 행 번호를 나누는 함수 ((재사용 행 번호 목록, 계산할 행 번호 목록) 반환)"""
+    reused, pending = [], []
+    for i, fingerprint in enumerate(fingerprints):
+        (reused if fingerprint in previous_rows else pending).append(i)
+    return reused, pending
@@ -0,0 +1,137 @@
+import pandas as pd
+
+# keyword.txt 한 줄의 형식: [이미지명] : [생성된 캡션] / [키워드] / [평가(O/X)]
+IMAGE_SEPARATOR = ' : '
+FIELD_SEPARATOR = ' / '
+KEYWORD_COLUMNS = ['line_no', 'image_file', 'caption', 'keyword', 'label']
+
+
+class KeywordFileError(ValueError):
+    """keyword.txt에 형식이 잘못된 줄이 있을 때 발생하는 예외"""
+
+    def __init__(self, path, malformed):
+        self.path = path
+        self.malformed = malformed
+        line_numbers = ", ".join(str(line_no) for line_no, _ in malformed[:20])
+        more = " ..." if len(malformed) > 20 else ""
+        super().__init__(f"{path}: 형식이 잘못된 줄 {len(malformed)}개 (줄 번호: {line_numbers}{more})")
+
+
+class KeywordRecord:
+    """keyword.txt의 한 줄을 담는 레코드 (행 단위로 처리할 때 메모리를 적게 쓰도록 __slots__ 사용)"""
+    __slots__ = ('line_no', 'image_file', 'caption', 'keyword', 'label')
+
+    def __init__(self, line_no, image_file, caption, keyword, label):
+        self.line_no = line_no
+        self.image_file = image_file
+        self.caption = caption
+        self.keyword = keyword
+        self.label = label
+
+    def __iter__(self):
+        return iter((self.image_file, self.caption, self.keyword, self.label))
+
+    def __repr__(self):
+        return (f"KeywordRecord(line_no={self.line_no}, image_file={self.image_file!r}, "
+                f"caption={self.caption!r}, keyword={self.keyword!r}, label={self.label!r})")
+
+
+def parse_line(line):
+    """한 줄을 (이미지명, 캡션, 키워드, 평가)로 나누는 함수 (형식이 잘못되면 None 반환)"""
+    parts = line.strip().split(IMAGE_SEPARATOR)
+    if len(parts) != 2:
+        return None
+    fields = parts[1].split(FIELD_SEPARATOR)
+    if len(fields) != 3:
+        return None
+    return parts[0], fields[0], fields[1], fields[2]
+
+
+def iter_keyword_records(file_path, malformed=None, strict=False):
+    """
+    keyword.txt를 한 줄씩 읽어 KeywordRecord를 생성하는 제너레이터
+    - 빈 줄은 건너뜁니다
+    - 형식이 잘못된 줄은 malformed 리스트에 (줄 번호, 내용)으로 기록하며, strict=True이면 바로 예외를 발생시킵니다
+    """
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            parsed = parse_line(line)
+            if parsed is None:
+                if strict:
+                    raise KeywordFileError(file_path, [(line_no, line.rstrip('\n'))])
+                if malformed is not None:
+                    malformed.append((line_no, line.rstrip('\n')))
+                continue
+            yield KeywordRecord(line_no, *parsed)
+
+
+def load_keyword_frame(file_path, strict=False):
+    """
+    keyword.txt 전체를 열 단위(pandas DataFrame)로 읽는 함수
+    - 줄마다 리스트에 추가하지 않고, pandas 문자열 연산으로 한 번에 분리합니다
+    - (DataFrame, 형식이 잘못된 줄의 (줄 번호, 내용) 리스트)를 반환합니다
+    - 컬럼: line_no, image_file, caption, keyword, label
+    """
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        lines = pd.Series(f.read().splitlines(), dtype=object)
+
+    line_no = pd.RangeIndex(1, len(lines) + 1)
+    lines.index = line_no
+    stripped = lines.str.strip()
+    non_empty = stripped != ''
+
+    # 원래 형식과 같이 ' : '는 정확히 1번, ' / '는 정확히 2번 나와야 함
+    image_split = stripped.str.split(IMAGE_SEPARATOR, n=1, regex=False, expand=True)
+    if image_split.shape[1] < 2:
+        image_split[1] = None
+    rest = image_split[1].fillna('')
+    valid = (
+        non_empty
+        & (stripped.str.count(IMAGE_SEPARATOR) == 1)
+        & (rest.str.count(FIELD_SEPARATOR) == 2)
+    )
+
+    malformed = list(zip(lines.index[non_empty & ~valid].tolist(), lines[non_empty & ~valid].tolist()))
+    if strict and malformed:
+        raise KeywordFileError(file_path, malformed)
+
+    fields = rest[valid].str.split(FIELD_SEPARATOR, regex=False, expand=True)
+    if fields.empty:
+        return pd.DataFrame({column: pd.Series(dtype=object) for column in KEYWORD_COLUMNS}), malformed
+
+    frame = pd.DataFrame({
+        'line_no': lines.index[valid],
+        'image_file': image_split[0][valid].to_numpy(),
+        'caption': fields[0].to_numpy(),
+        'keyword': fields[1].to_numpy(),
+        'label': fields[2].to_numpy(),
+    })
+    return frame, malformed
+
+
+def report_malformed(file_path, malformed, limit=20):
+    """형식이 잘못된 줄의 번호와 내용을 출력하는 함수"""
+    if not malformed:
+        return
+    print(f"경고: {file_path}에 형식이 잘못된 줄이 {len(malformed)}개 있어 제외했습니다.")
+    for line_no, line in malformed[:limit]:
+        print(f"  {line_no}번째 줄: {line}")
+    if len(malformed) > limit:
+        print(f"  ... 외 {len(malformed) - limit}줄")
+
+
+def load_keyword_columns(file_path, strict=False):
+    """
+    keyword.txt를 읽어 (이미지 파일, 캡션, 키워드, 평가) 네 개의 리스트로 반환하는 함수
+    - 기존 평가 스크립트와 같은 반환 형식이며, 형식이 잘못된 줄은 줄 번호와 함께 출력합니다
+    """
+    frame, malformed = load_keyword_frame(file_path, strict=strict)
+    report_malformed(file_path, malformed)
+    return (
+        frame['image_file'].tolist(),
+        frame['caption'].tolist(),
+        frame['keyword'].tolist(),
+        frame['label'].tolist(),
+    )
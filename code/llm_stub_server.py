@@ -0,0 +1,252 @@
+"""
+OpenAI chat completions 형식을 흉내 내는 로컬 스텁 서버 (네트워크 없이 테스트/부하 측정용)
+
+실행:
+    python llm_stub_server.py --port 8800 --latency 0.5 --tokens_per_second 50 --error_rate 0.05
+
+앱에서 사용:
+    LLM_BACKEND=stub streamlit run blip_streamlit.py
+
+- POST /v1/chat/completions: 일반 응답과 스트리밍(stream=True, SSE) 응답을 모두 지원합니다
+- GET /v1/models: 모델 목록
+- 응답 내용은 요청 메시지의 해시로 정해지므로 같은 요청에는 항상 같은 응답을 돌려줍니다
+- response_format이 json_object이면 입력 JSON의 리스트를 같은 길이의 {"translations": [...]}로 돌려줍니다
+- 오류 주입은 --seed로 고정한 난수를 요청 순서대로 사용하므로 같은 순서의 요청에는 같은 결과가 나옵니다
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from prompt_builder import count_message_tokens, count_tokens
+
+# 응답 문장을 만들 때 사용하는 어휘
+STUB_WORDS = [
+    "오늘은", "친구와", "함께", "공원에", "갔다.", "날씨가", "맑아서", "기분이", "좋았다.",
+    "사진을", "많이", "찍었다.", "저녁에는", "맛있는", "음식을", "먹었다.", "즐거운", "하루였다."
+]
+
+ERROR_TYPES = {
+    429: ("rate_limit_exceeded", "Rate limit reached (stub)"),
+    500: ("server_error", "Internal server error (stub)"),
+    503: ("server_error", "Service unavailable (stub)"),
+}
+
+
+class StubConfig:
+    """스텁 서버 동작 설정 (모든 요청 스레드가 공유)"""
+
+    def __init__(self, latency=0.0, tokens_per_second=0.0, response_tokens=120,
+                 error_rate=0.0, error_status=429, seed=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.request_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def should_fail(self):
+        """이번 요청에 오류를 주입할지 정하는 함수 (요청 순서대로 같은 난수열 사용)"""
+        with self._lock:
+            self.request_count += 1
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+
+def _last_user_text(messages):
+    """마지막 사용자 메시지의 텍스트를 꺼내는 함수"""
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, list):
+            return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+        return content or ""
+    return ""
+
+
+def build_stub_reply(body, response_tokens):
+    """요청 내용으로 결정되는 응답 텍스트를 만드는 함수"""
+    messages = body.get("messages", [])
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        try:
+            payload = json.loads(_last_user_text(messages))
+            items = next(value for value in payload.values() if isinstance(value, list))
+        except (ValueError, StopIteration, AttributeError):
+            items = []
+        return json.dumps({"translations": [f"(stub) {item}" for item in items]}, ensure_ascii=False)
+
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8")).digest()
+    rng = random.Random(digest)
+    limit = min(response_tokens, body.get("max_tokens") or response_tokens)
+    return " ".join(rng.choice(STUB_WORDS) for _ in range(max(1, limit)))
+
+
+def split_tokens(text):
+    """스트리밍으로 보낼 조각(단어 + 뒤따르는 공백) 목록을 만드는 함수"""
+    words = text.split(" ")
+    return [word + " " for word in words[:-1]] + [words[-1]]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenAI chat completions 요청을 처리하는 핸들러"""
+
+    config = None
+
+    def log_message(self, format, *args):
+        # 부하 테스트 중 요청마다 로그가 찍히지 않도록 끔
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status):
+        code, message = ERROR_TYPES.get(status, ("server_error", "Error (stub)"))
+        headers = {"Retry-After": "1"} if status == 429 else None
+        self._send_json(status, {"error": {"message": message, "type": code, "code": code}}, headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "Invalid JSON", "type": "invalid_request_error"}})
+            return
+
+        config = self.config
+        if config.latency > 0:
+            time.sleep(config.latency)
+        if config.should_fail():
+            self._send_error(config.error_status)
+            return
+
+        model = body.get("model", "stub")
+        text = build_stub_reply(body, config.response_tokens)
+        usage = {
+            "prompt_tokens": count_message_tokens(body.get("messages", []), model),
+            "completion_tokens": count_tokens(text, model),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            self._stream(model, text, usage if include_usage else None)
+            return
+
+        self._send_json(200, {
+            "id": f"chatcmpl-stub-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    def _stream(self, model, text, usage):
+        """SSE(data: ...) 형식으로 응답을 조각내어 보내는 함수 (tokens_per_second로 속도 조절)"""
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        def chunk(delta, finish_reason=None, chunk_usage=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [] if chunk_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if chunk_usage:
+                payload["usage"] = chunk_usage
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        delay = 1.0 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0
+        try:
+            self.wfile.write(chunk({"role": "assistant", "content": ""}))
+            for piece in split_tokens(text):
+                if delay:
+                    time.sleep(delay)
+                self.wfile.write(chunk({"content": piece}))
+                self.wfile.flush()
+            self.wfile.write(chunk({}, finish_reason="stop"))
+            if usage:
+                self.wfile.write(chunk(None, chunk_usage=usage))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 클라이언트가 생성 중단으로 연결을 닫은 경우
+            pass
+
+
+def create_server(host="127.0.0.1", port=8800, config=None):
+    """스텁 서버를 만드는 함수 (테스트에서 스레드로 띄울 수 있도록 serve_forever는 호출하지 않음)"""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config or StubConfig()})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI 호환 로컬 스텁 서버')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='바인딩할 주소')
+    parser.add_argument('--port', type=int, default=8800,
+                        help='바인딩할 포트')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='응답(첫 토큰) 전 대기 시간 (초)')
+    parser.add_argument('--tokens_per_second', type=float, default=0.0,
+                        help='스트리밍 시 초당 전송할 조각 수 (0이면 지연 없음)')
+    parser.add_argument('--response_tokens', type=int, default=120,
+                        help='응답 길이 (단어 수, 요청의 max_tokens를 넘지 않음)')
+    parser.add_argument('--error_rate', type=float, default=0.0,
+                        help='오류를 돌려줄 요청 비율 (0~1)')
+    parser.add_argument('--error_status', type=int, default=429, choices=sorted(ERROR_TYPES),
+                        help='주입할 오류의 HTTP 상태 코드')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='오류 주입 난수 시드')
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency, tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens, error_rate=args.error_rate,
+        error_status=args.error_status, seed=args.seed
+    )
+    server = create_server(args.host, args.port, config)
+    print(f"스텁 서버 실행 중: http://{args.host}:{args.port}/v1 (Ctrl+C로 종료)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"처리한 요청: {config.request_count}건")
+
+
+if __name__ == "__main__":
+    main()
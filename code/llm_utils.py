@@ -0,0 +1,242 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+import dotenv
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError
+from cache_utils import PersistentLRUCache, hash_bytes, make_cache_key
+
+# 백엔드/모델 설정을 .env에서도 읽을 수 있도록 먼저 로드
+dotenv.load_dotenv()
+
+# LLM 백엔드 설정
+# - LLM_BACKEND=openai: OpenAI API (LLM_BASE_URL을 지정하면 다른 OpenAI 호환 서버)
+# - LLM_BACKEND=stub: 로컬 스텁 서버 (llm_stub_server.py, 네트워크 없이 테스트/부하 측정용)
+LLM_BACKENDS = {
+    "openai": None,
+    "stub": os.getenv("LLM_STUB_URL", "http://127.0.0.1:8800/v1"),
+}
+
+# 일기 생성 기본 설정
+DIARY_MODEL = os.getenv("DIARY_MODEL", "gpt-4o-mini")
+DIARY_TEMPERATURE = 0.3  # 창의성을 낮춰서 더 사실적인 응답 유도
+DIARY_MAX_TOKENS = 1000
+
+# 재시도할 오류 (요청 제한, 일시적인 연결 문제)
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError)
+
+# 응답 캐시 설정 (LLM_RESPONSE_CACHE=0이면 전체 비활성화)
+RESPONSE_CACHE_ENABLED = os.getenv("LLM_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_TTL = float(os.getenv("LLM_RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+class ChatResult:
+    """
+    채팅 응답 결과
+    - 스트리밍 도중 중단되어도 그때까지 받은 text가 남도록, 호출하는 쪽에서 미리 만들어 넘길 수 있습니다
+    - finished는 응답을 끝까지 받았을 때만 True가 됩니다
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.usage = None
+        self.finished = False
+        self.cancelled = False
+        self.cached = False
+        self.time_to_first_token = None
+        self.elapsed = None
+
+
+def usage_to_dict(usage):
+    """응답의 usage 객체를 dict로 바꾸는 함수"""
+    if usage is None:
+        return None
+    if hasattr(usage, "model_dump"):
+        return usage.model_dump(exclude_none=True)
+    return dict(usage)
+
+
+def create_client(async_client=False, backend=None, base_url=None, **kwargs):
+    """
+    설정된 백엔드의 OpenAI 호환 클라이언트를 만드는 함수
+    - backend를 지정하지 않으면 LLM_BACKEND 환경 변수(기본 openai)를 따릅니다
+    - base_url을 지정하면 LLM_BASE_URL과 백엔드 기본 주소보다 우선합니다
+    - async_client=True이면 AsyncOpenAI를 반환합니다
+    - 나머지 인자(max_retries 등)는 클라이언트 생성자에 그대로 전달합니다
+    """
+    backend = backend or os.getenv("LLM_BACKEND", "openai")
+    if backend not in LLM_BACKENDS:
+        raise ValueError(f"지원하지 않는 LLM 백엔드입니다: {backend} (선택: {', '.join(LLM_BACKENDS)})")
+    base_url = base_url or os.getenv("LLM_BASE_URL") or LLM_BACKENDS[backend]
+    # 스텁 서버는 키를 확인하지 않지만 클라이언트 생성에는 값이 필요함
+    api_key = os.getenv("OPENAI_API_KEY") or ("stub" if backend == "stub" else None)
+    client_class = AsyncOpenAI if async_client else OpenAI
+    return client_class(api_key=api_key, base_url=base_url, **kwargs)
+
+
+def get_response_cache():
+    """응답 캐시를 한 번만 열어 공유하는 함수 (비활성화되어 있으면 None)"""
+    global _response_cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = PersistentLRUCache(
+                table="responses", max_disk_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL
+            )
+        return _response_cache
+
+
+def _normalize_content(content):
+    """메시지 내용에서 base64 이미지를 해시로 바꾸는 함수 (캐시 키를 짧게 유지)"""
+    if not isinstance(content, list):
+        return content
+    normalized = []
+    for part in content:
+        if part.get("type") == "image_url":
+            url = part["image_url"]["url"]
+            part = {**part, "image_url": {**part["image_url"], "url": "sha256:" + hash_bytes(url.encode("utf-8"))}}
+        normalized.append(part)
+    return normalized
+
+
+def response_cache_key(model, messages, base_url="", **kwargs):
+    """
+    모델, 메시지(이미지는 해시), temperature/max_tokens 등 요청 옵션으로 응답 캐시 키를 만드는 함수
+    - base_url을 함께 넣어 스텁 서버 등 다른 백엔드의 응답이 섞이지 않도록 합니다
+    """
+    normalized = [{**message, "content": _normalize_content(message.get("content"))} for message in messages]
+    return make_cache_key("chat", str(base_url), model, normalized, kwargs)
+
+
+def _lookup_response(use_cache, client, model, messages, **kwargs):
+    """응답 캐시를 조회해 (캐시, 키, 저장된 값)을 반환하는 함수"""
+    cache = get_response_cache() if use_cache else None
+    if cache is None:
+        return None, None, None
+    key = response_cache_key(model, messages, base_url=getattr(client, "base_url", ""), **kwargs)
+    return cache, key, cache.get(key)
+
+
+def complete_chat(client, messages, result=None, model=DIARY_MODEL, temperature=DIARY_TEMPERATURE,
+                  max_tokens=DIARY_MAX_TOKENS, use_cache=True):
+    """
+    스트리밍 없이 전체 응답을 한 번에 받는 함수
+    - use_cache=True이면 같은 요청의 이전 응답을 재사용합니다 (result.cached=True)
+    """
+    result = result if result is not None else ChatResult()
+    start = time.perf_counter()
+    cache, key, cached = _lookup_response(use_cache, client, model, messages,
+                                                  temperature=temperature, max_tokens=max_tokens)
+    if cached is not None:
+        result.text = cached["text"]
+        result.usage = cached["usage"]
+        result.cached = True
+    else:
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        result.text = response.choices[0].message.content
+        result.usage = usage_to_dict(response.usage)
+        if cache is not None:
+            cache.set(key, {"text": result.text, "usage": result.usage})
+    result.elapsed = time.perf_counter() - start
+    result.time_to_first_token = result.elapsed
+    result.finished = True
+    return result
+
+
+def stream_chat_completion(client, messages, result=None, on_text=None,
+                           model=DIARY_MODEL, temperature=DIARY_TEMPERATURE, max_tokens=DIARY_MAX_TOKENS,
+                           use_cache=True):
+    """
+    응답을 스트리밍으로 받는 함수
+    - 토큰 조각이 도착할 때마다 result.text에 이어 붙이고 on_text(조각)을 호출합니다
+    - 중단은 호출한 쪽에서 예외로 빠져나오는 방식입니다 (Streamlit의 '생성 중단' 버튼은 재실행으로 현재 실행을 멈춤).
+      이때도 finally에서 연결을 닫아 서버 쪽 생성을 멈추고 result.elapsed를 기록합니다
+    - 마지막 청크의 토큰 사용량(usage)을 result.usage에 기록합니다
+    - use_cache=True이면 같은 요청의 이전 응답을 한 번에 돌려주고, 끝까지 받은 응답만 캐시에 저장합니다
+    """
+    result = result if result is not None else ChatResult()
+    start = time.perf_counter()
+    cache, key, cached = _lookup_response(use_cache, client, model, messages,
+                                                  temperature=temperature, max_tokens=max_tokens)
+    if cached is not None:
+        result.text = cached["text"]
+        result.usage = cached["usage"]
+        result.cached = True
+        if on_text is not None:
+            on_text(result.text)
+        result.elapsed = result.time_to_first_token = time.perf_counter() - start
+        result.finished = True
+        return result
+
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                result.usage = usage_to_dict(chunk.usage)
+            if not chunk.choices:
+                continue
+            piece = chunk.choices[0].delta.content
+            if piece:
+                if result.time_to_first_token is None:
+                    result.time_to_first_token = time.perf_counter() - start
+                result.text += piece
+                if on_text is not None:
+                    on_text(piece)
+        result.finished = True
+    finally:
+        # 중단되거나 예외가 발생해도 HTTP 연결을 닫아 생성을 멈춤
+        stream.close()
+        result.elapsed = time.perf_counter() - start
+    if result.finished and cache is not None:
+        cache.set(key, {"text": result.text, "usage": result.usage})
+    return result
+
+
+def _cached_response(cached):
+    """캐시에 저장된 값을 응답 객체처럼 사용할 수 있게 감싸는 함수 (choices[0].message.content, usage)"""
+    message = SimpleNamespace(content=cached["text"])
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=cached["usage"], cached=True)
+
+
+async def acreate_with_retry(client, max_retries=5, base_delay=1.0, use_cache=True, **kwargs):
+    """
+    비동기 클라이언트로 요청하고, 요청 제한(429)이나 일시적인 연결 오류가 나면 지수 백오프로 재시도하는 함수
+    - use_cache=True이면 같은 요청의 이전 응답을 재사용합니다
+    """
+    cache, key, cached = _lookup_response(use_cache, client, **kwargs)
+    if cached is not None:
+        return _cached_response(cached)
+    for attempt in range(max_retries + 1):
+        try:
+            response = await client.chat.completions.create(**kwargs)
+            if cache is not None:
+                cache.set(key, {
+                    "text": response.choices[0].message.content,
+                    "usage": usage_to_dict(response.usage)
+                })
+            return response
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * (2 ** attempt) + random.uniform(0, base_delay)
+            print(f"요청 제한/연결 오류로 {delay:.1f}초 후 재시도합니다 ({attempt + 1}/{max_retries}): {e}")
+            await asyncio.sleep(delay)
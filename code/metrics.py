@@ -0,0 +1,141 @@
+"""
+요청 단위 단계별 처리 시간과 토큰 사용량 기록
+
+사용 예:
+    trace = Trace("blip_streamlit", variant="blip")
+    with trace.span("caption"):
+        ...
+    trace.record_usage(result.usage)
+    write_trace(trace)
+
+- AUTODIARY_METRICS_FORMAT=jsonl(기본): output/metrics/metrics.jsonl에 요청마다 한 줄 추가
+- AUTODIARY_METRICS_FORMAT=prometheus: output/metrics/autodiary_<이름>.prom을 Prometheus 텍스트 형식으로 갱신
+  (node_exporter textfile collector용, 누적값은 프로세스가 다시 시작되면 0부터 다시 셉니다)
+- AUTODIARY_METRICS=0이면 파일에 기록하지 않습니다
+"""
+import datetime
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+METRICS_ENABLED = os.getenv("AUTODIARY_METRICS", "1") != "0"
+METRICS_FORMAT = os.getenv("AUTODIARY_METRICS_FORMAT", "jsonl")
+DEFAULT_METRICS_DIR = Path(os.getenv(
+    "AUTODIARY_METRICS_DIR",
+    str(Path(__file__).parent.parent / "output" / "metrics")
+))
+# 합산할 토큰 사용량 항목
+USAGE_KEYS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+_write_lock = threading.Lock()
+# Prometheus 누적값: {(지표 이름, 라벨 튜플): 값}
+_prometheus_totals = {}
+
+
+class Trace:
+    """요청 하나의 단계별 처리 시간(초)과 토큰 사용량을 모으는 객체"""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.spans = {}
+        self.usage = {}
+        self.timestamp = datetime.datetime.now().isoformat(timespec="seconds")
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage):
+        """with 블록의 실행 시간을 stage 이름으로 기록하는 함수 (같은 이름이면 합산)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage, seconds):
+        """이미 잰 시간을 stage 이름으로 기록하는 함수"""
+        if seconds is not None:
+            self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def record_usage(self, usage):
+        """응답의 usage(dict)에서 토큰 수를 합산하는 함수 (프롬프트 캐시 적중 토큰 포함)"""
+        if not usage:
+            return
+        for key in USAGE_KEYS:
+            if isinstance(usage.get(key), int):
+                self.usage[key] = self.usage.get(key, 0) + usage[key]
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        if isinstance(cached, int):
+            self.usage["cached_tokens"] = self.usage.get("cached_tokens", 0) + cached
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def to_dict(self):
+        return {
+            "timestamp": self.timestamp,
+            "name": self.name,
+            "labels": self.labels,
+            "spans": {stage: round(seconds, 6) for stage, seconds in self.spans.items()},
+            "usage": self.usage,
+            "elapsed": round(self.elapsed, 6),
+        }
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    return ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels)
+
+
+def _write_prometheus(trace, metrics_dir):
+    """누적값을 갱신하고 Prometheus 텍스트 파일을 통째로 다시 쓰는 함수 (임시 파일 후 교체)"""
+    base = tuple(sorted((key, str(value)) for key, value in {"app": trace.name, **trace.labels}.items()))
+
+    def inc(metric, value, **extra):
+        key = (metric, tuple(sorted(base + tuple(extra.items()))))
+        _prometheus_totals[key] = _prometheus_totals.get(key, 0) + value
+
+    inc("autodiary_requests_total", 1)
+    for stage, seconds in trace.spans.items():
+        inc("autodiary_stage_seconds_sum", seconds, stage=stage)
+        inc("autodiary_stage_seconds_count", 1, stage=stage)
+    for kind, tokens in trace.usage.items():
+        inc("autodiary_tokens_total", tokens, kind=kind)
+
+    lines = [
+        "# TYPE autodiary_requests_total counter",
+        "# TYPE autodiary_stage_seconds summary",
+        "# TYPE autodiary_tokens_total counter",
+    ]
+    for (metric, labels), value in sorted(_prometheus_totals.items()):
+        if dict(labels).get("app") != trace.name:
+            continue
+        lines.append(f"{metric}{{{_format_labels(labels)}}} {value}")
+
+    path = metrics_dir / f"autodiary_{trace.name}.prom"
+    tmp_path = path.with_suffix(".prom.tmp")
+    tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_trace(trace, metrics_dir=DEFAULT_METRICS_DIR, fmt=METRICS_FORMAT):
+    """Trace를 지표 파일에 기록하는 함수 (기록한 파일 경로 반환, 비활성화되어 있으면 None)"""
+    if not METRICS_ENABLED:
+        return None
+    metrics_dir = Path(metrics_dir)
+    with _write_lock:
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        if fmt == "prometheus":
+            return _write_prometheus(trace, metrics_dir)
+        path = metrics_dir / "metrics.jsonl"
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+        return path
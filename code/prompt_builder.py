@@ -0,0 +1,329 @@
+import datetime
+import functools
+import math
+import os
+from llm_utils import DIARY_MODEL
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken이 없으면 글자 수 기반 추정치 사용
+    tiktoken = None
+
+SYSTEM_PROMPT = "당신은 사진 속 상황을 객관적으로 서술하는 작가입니다."
+WEEKDAYS = ["월요일", "화요일", "수요일", "목요일", "금요일", "토요일", "일요일"]
+
+# 입력 프롬프트의 텍스트 토큰 예산 (이미지 토큰은 따로 추정, 환경 변수로 조정 가능)
+DEFAULT_PROMPT_TOKEN_BUDGET = int(os.getenv("DIARY_PROMPT_TOKEN_BUDGET", "6000"))
+# 예산을 맞추기 위해 사진별 항목을 줄일 때의 최소 글자 수
+MIN_FIELD_CHARS = 20
+
+GUIDELINE_HEADER = "**일기 작성 가이드라인**:"
+GUIDELINE_ORDER = "4. **사진이 업로드된 순서를 시간 순서로 간주하고**, 입력된 순서대로 일기를 작성해주세요. (밤에 찍은 사진 뒤에 낮에 찍은 사진이 오면, 다음 날로 간주해주세요)"
+GUIDELINE_EMOTION = "3. **감정 표현을 추가적으로 반영**하여 좀 더 몰입할 수 있는 글이 되도록 해주세요."
+GUIDELINE_NO_DATE = "5. **주어진 정보만을 활용**하여, 날짜 정보는 반영하지않고, 사실적으로 일기를 작성해주세요."
+
+# 프런트엔드별 프롬프트 구성
+# - intro/guidelines는 모든 요청에서 같은 정적인 텍스트이므로 시스템 메시지 앞부분에 둡니다 (제공자 측 프롬프트 prefix 캐시 활용)
+# - 사진 정보, 날짜, 분위기처럼 요청마다 바뀌는 내용은 그 뒤의 사용자 메시지에 둡니다
+DIARY_VARIANTS = {
+    # blip_streamlit.py, batch_diary.py: BLIP 캡션 + 사용자 입력
+    "blip": {
+        "intro": """오늘 찍은 사진들을 보고 일기를 작성해주세요.
+각 사진에는 AI가 생성한 캡션과 함께 장소, 함께한 사람들, 활동 키워드가 제공됩니다.
+이 정보들을 자연스럽게 활용하여 실제 있었던 일만을 서술해주세요.""",
+        "guidelines": [
+            '1. **일기의 주체는 "나"**이며, 함께한 사람들을 적절히 언급해주세요.',
+            "2. **AI 캡션, 장소, 인물, 활동 키워드를 적극적으로 활용**하여 실제 경험을 기록하는 것처럼 자연스럽게 서술해주세요.",
+            GUIDELINE_EMOTION,
+            GUIDELINE_ORDER,
+            "5. **주어진 정보만을 활용**하여, 일기를 작성해주세요.",
+        ],
+        "fields": ["caption", "location", "person", "keywords"],
+        "include_date": True,
+    },
+    # gpt_cap.py: BLIP 캡션만 사용
+    "caption": {
+        "intro": """오늘 찍은 사진들을 보고 일기를 작성해주세요.
+각 사진에는 AI가 생성한 캡션이 제공됩니다.
+이 정보들을 자연스럽게 활용하여 실제 있었던 일만을 서술해주세요.""",
+        "guidelines": [
+            '1. **일기의 주체는 "나"**입니다.',
+            "2. **AI 캡션의 장소, 인물, 활동 내용을 적극적으로 활용**하여 실제 경험을 기록하는 것처럼 자연스럽게 서술해주세요.",
+            GUIDELINE_EMOTION,
+            GUIDELINE_ORDER,
+            GUIDELINE_NO_DATE,
+        ],
+        "fields": ["caption"],
+        "include_date": False,
+    },
+    # gpt_kw.py: 사용자 입력(장소, 인물, 키워드)만 사용
+    "keyword": {
+        "intro": """오늘 찍은 사진들을 보고 일기를 작성해주세요.
+각 사진에는 장소, 함께한 사람들, 활동 키워드가 제공됩니다.
+이 정보들을 자연스럽게 활용하여 실제 있었던 일만을 서술해주세요.""",
+        "guidelines": [
+            '1. **일기의 주체는 "나"**이며, 함께한 사람들을 적절히 언급해주세요.',
+            "2. **장소, 인물, 활동 키워드를 적극적으로 활용**하여 실제 경험을 기록하는 것처럼 자연스럽게 서술해주세요.",
+            GUIDELINE_EMOTION,
+            GUIDELINE_ORDER,
+            GUIDELINE_NO_DATE,
+        ],
+        "fields": ["location", "person", "keywords"],
+        "include_date": False,
+    },
+    # gpt_img_kw.py: 이미지 + 사용자 입력
+    "image": {
+        "intro": """오늘 찍은 사진들을 보고 일기를 작성해주세요.
+각 사진과 함께 장소, 함께한 사람들, 활동 키워드가 제공됩니다.
+이 정보들을 자연스럽게 활용하여 실제 있었던 일만을 서술해주세요.""",
+        "guidelines": [
+            '1. **일기의 주체는 "나"**이며, 함께한 사람들을 적절히 언급해주세요.',
+            "2. **장소, 인물, 활동 키워드를 적극적으로 활용**하여 실제 경험을 기록하는 것처럼 자연스럽게 서술해주세요.",
+            GUIDELINE_EMOTION,
+            GUIDELINE_ORDER,
+            GUIDELINE_NO_DATE,
+        ],
+        "fields": ["image", "location", "person", "keywords"],
+        "include_date": False,
+    },
+}
+
+# 사진이 많은 앨범의 구간 요약(map) 프롬프트 (모든 구간에서 같은 정적인 텍스트)
+CHUNK_SUMMARY_INTRO = """아래는 하루 동안 찍은 사진 중 시간 순서로 이어진 한 구간입니다.
+나중에 여러 구간을 하나의 일기로 엮을 수 있도록, 이 구간에서 있었던 일을 사진 순서대로 간결하게 요약해주세요.
+장소, 함께한 사람, 활동을 빠뜨리지 말고, 주어진 정보에 없는 내용이나 감정 표현은 넣지 마세요."""
+
+FIELD_LABELS = {
+    "image": "사진 파일",
+    "caption": "AI 캡션",
+    "location": "장소",
+    "person": "함께한 사람",
+    "keywords": "키워드",
+}
+
+
+class DiaryPrompt:
+    """
+    완성된 일기 프롬프트
+    - messages: chat.completions에 그대로 넘길 메시지 목록
+    - text_tokens: 보내기 전에 로컬에서 계산한 텍스트 입력 토큰 수
+    - image_tokens: 함께 보내는 이미지의 추정 토큰 수
+    - trimmed: 토큰 예산을 맞추기 위해 사진별 항목을 줄였는지 여부
+    - over_budget: 최대한 줄여도 텍스트가 예산을 넘는지 여부
+    """
+
+    def __init__(self, messages, text_tokens, image_tokens=0, trimmed=False, over_budget=False):
+        self.messages = messages
+        self.text_tokens = text_tokens
+        self.image_tokens = image_tokens
+        self.trimmed = trimmed
+        self.over_budget = over_budget
+
+    @property
+    def input_tokens(self):
+        """이미지를 포함한 전체 입력 토큰 추정치"""
+        return self.text_tokens + self.image_tokens
+
+
+def format_korean_date(date=None):
+    """날짜를 'YYYY년 M월 D일, 요일' 형식으로 바꾸는 함수 (기본값: 오늘)"""
+    date = date or datetime.date.today()
+    return f"{date.year}년 {date.month}월 {date.day}일, {WEEKDAYS[date.weekday()]}"
+
+
+@functools.lru_cache(maxsize=8)
+def _get_encoding(model):
+    """모델에 맞는 tiktoken 인코딩을 불러오는 함수 (불러올 수 없으면 None)"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # 인코딩 파일을 내려받을 수 없는 환경 등
+        return None
+
+
+def count_tokens(text, model=DIARY_MODEL):
+    """텍스트의 토큰 수를 로컬에서 계산하는 함수 (tiktoken이 없으면 보수적으로 추정)"""
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # 영문/숫자는 약 4글자당 1토큰, 한글 등은 글자당 약 1토큰으로 추정
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+
+def estimate_image_tokens(width, height, model=DIARY_MODEL):
+    """
+    이미지 한 장의 입력 토큰 수를 추정하는 함수 (detail=auto/high 기준 타일 계산)
+    - 긴 변을 2048, 짧은 변을 768로 맞춘 뒤 512px 타일 수로 계산합니다
+    """
+    base_tokens, tile_tokens = (2833, 5667) if "mini" in model else (85, 170)
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return base_tokens + tile_tokens * tiles
+
+
+def count_message_tokens(messages, model=DIARY_MODEL):
+    """메시지 목록의 텍스트 토큰 수를 계산하는 함수 (메시지별 형식 토큰 포함, 이미지는 제외)"""
+    total = 3  # 응답 시작 토큰
+    for message in messages:
+        total += 3
+        content = message["content"]
+        if isinstance(content, str):
+            total += count_tokens(content, model)
+        else:
+            total += sum(count_tokens(part["text"], model) for part in content if part.get("type") == "text")
+    return total
+
+
+def _truncate(value, limit):
+    """글자 수 제한을 넘는 값을 잘라내는 함수"""
+    if limit is None or len(value) <= limit:
+        return value
+    return value[:limit] + "…"
+
+
+def _photo_value(info, field):
+    """사진 정보 dict에서 항목 값을 꺼내는 함수 (프런트엔드마다 다른 키 이름 처리)"""
+    if field == "image":
+        return str(info.get("image") or info.get("file_name") or "")
+    return str(info.get(field) or "")
+
+
+def _render_photos(photos, fields, limit, start=1):
+    """사진 정보를 프롬프트 텍스트로 만드는 함수 (limit이 있으면 항목별 글자 수 제한, start는 첫 사진 번호)"""
+    lines = ["**입력된 사진 정보** (순서대로 작성해주세요):"]
+    for i, info in enumerate(photos, start):
+        lines.append(f"사진 {i}")
+        for j, field in enumerate(fields):
+            prefix = "- " if j == 0 else "  "
+            value = _photo_value(info, field)
+            if field != "image":
+                value = _truncate(value, limit)
+            lines.append(f"{prefix}{FIELD_LABELS[field]}: {value}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def build_system_prompt(variant):
+    """프런트엔드별 정적인 시스템 프롬프트(역할, 작성 방법, 가이드라인)를 만드는 함수"""
+    config = DIARY_VARIANTS[variant]
+    return "\n\n".join([
+        SYSTEM_PROMPT,
+        config["intro"],
+        "\n".join([GUIDELINE_HEADER] + config["guidelines"]),
+    ])
+
+
+def _date_header(config, formatted_date):
+    if config["include_date"] and formatted_date:
+        return f"다음은 {formatted_date}에 있었던 일들에 대한 일기를 작성하기 위한 정보입니다.\n\n"
+    return ""
+
+
+def _mood_footer(mood):
+    if mood.strip():
+        return f'\n추가 가이드라인: 6. **입력 받은 분위기에 맞게 일기를 작성**해주세요. 입력 받은 분위기: "{mood}"'
+    return ""
+
+
+def _user_content(text, images):
+    """사용자 메시지 내용을 만드는 함수 (이미지가 있으면 텍스트 + 이미지 파트 목록)"""
+    if not images:
+        return text
+    return [{"type": "text", "text": text}] + [
+        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{b64}"}}
+        for b64, mime_type, _ in images
+    ]
+
+
+def build_diary_prompt(photos, variant="blip", mood="", formatted_date=None, images=None,
+                       token_budget=DEFAULT_PROMPT_TOKEN_BUDGET, model=DIARY_MODEL):
+    """
+    모든 프런트엔드가 공통으로 사용하는 일기 프롬프트를 만드는 함수
+    - 정적인 가이드라인은 시스템 메시지에, 사진 정보/날짜/분위기는 사용자 메시지에 둡니다
+    - images: [(base64 문자열, MIME 타입, (가로, 세로)), ...] (gpt_img_kw.py처럼 이미지를 함께 보낼 때)
+    - 텍스트 입력 토큰이 token_budget을 넘으면 사진별 항목(캡션, 키워드 등)을 점점 짧게 잘라 예산에 맞춥니다
+    - DiaryPrompt를 반환하며, 보내기 전에 input_tokens로 예상 입력 토큰 수를 확인할 수 있습니다
+    """
+    config = DIARY_VARIANTS[variant]
+    system_prompt = build_system_prompt(variant)
+    images = images or []
+    image_tokens = sum(estimate_image_tokens(w, h, model) for _, _, (w, h) in images)
+
+    header = _date_header(config, formatted_date)
+    footer = _mood_footer(mood)
+
+    def render(limit):
+        user_text = header + _render_photos(photos, config["fields"], limit) + footer
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": _user_content(user_text, images)},
+        ]
+        return messages, count_message_tokens(messages, model)
+
+    limit = None
+    messages, text_tokens = render(limit)
+    longest = max(
+        (len(_photo_value(info, field)) for info in photos for field in config["fields"] if field != "image"),
+        default=0
+    )
+    while text_tokens > token_budget and longest > MIN_FIELD_CHARS:
+        limit = max(MIN_FIELD_CHARS, (limit or longest) // 2)
+        messages, text_tokens = render(limit)
+        if limit == MIN_FIELD_CHARS:
+            break
+
+    return DiaryPrompt(
+        messages, text_tokens, image_tokens,
+        trimmed=limit is not None,
+        over_budget=text_tokens > token_budget
+    )
+
+
+def chunk_photos(photos, chunk_size):
+    """사진 목록을 순서(시간 순서)를 유지한 채 chunk_size장씩 나누는 함수 ([(첫 사진 번호, 사진 목록), ...])"""
+    chunk_size = max(1, chunk_size)
+    return [(start + 1, photos[start:start + chunk_size]) for start in range(0, len(photos), chunk_size)]
+
+
+def build_chunk_prompt(photos, variant="blip", start=1, formatted_date=None, images=None, model=DIARY_MODEL):
+    """
+    사진이 많은 앨범의 한 구간을 요약하는 프롬프트를 만드는 함수 (map 단계)
+    - start는 구간 첫 사진의 전체 앨범 기준 번호이며, images는 이 구간의 이미지만 넘깁니다
+    """
+    config = DIARY_VARIANTS[variant]
+    images = images or []
+    user_text = _date_header(config, formatted_date) + _render_photos(photos, config["fields"], None, start=start)
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT + "\n\n" + CHUNK_SUMMARY_INTRO},
+        {"role": "user", "content": _user_content(user_text, images)},
+    ]
+    image_tokens = sum(estimate_image_tokens(w, h, model) for _, _, (w, h) in images)
+    return DiaryPrompt(messages, count_message_tokens(messages, model), image_tokens)
+
+
+def build_compose_prompt(summaries, variant="blip", mood="", formatted_date=None, model=DIARY_MODEL):
+    """
+    구간별 요약을 이어 붙여 최종 일기 프롬프트를 만드는 함수 (reduce 단계)
+    - summaries: [(첫 사진 번호, 마지막 사진 번호, 요약 텍스트), ...] (시간 순서)
+    - 시스템 프롬프트는 build_diary_prompt와 같아 일기 형식과 가이드라인이 그대로 적용됩니다
+    """
+    config = DIARY_VARIANTS[variant]
+    lines = ["**구간별 요약** (사진을 시간 순서대로 나눈 구간입니다. 순서대로 하나의 일기로 작성해주세요):"]
+    for i, (first, last, summary) in enumerate(summaries, 1):
+        lines.append(f"구간 {i} (사진 {first}~{last})")
+        lines.append(summary.strip())
+        lines.append("")
+    user_text = _date_header(config, formatted_date) + "\n".join(lines) + _mood_footer(mood)
+    messages = [
+        {"role": "system", "content": build_system_prompt(variant)},
+        {"role": "user", "content": user_text},
+    ]
+    return DiaryPrompt(messages, count_message_tokens(messages, model))
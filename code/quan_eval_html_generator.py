@@ -1,7 +1,20 @@
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import html
+import json
+import multiprocessing
 import os
 import pandas as pd
 import argparse
+from PIL import Image, ImageOps
+from keyword_parser import load_keyword_columns
+from cache_utils import make_cache_key
+
+THUMBNAIL_DIR_NAME = "thumbs"
+SCORE_COLUMNS = ['BERTScore_Precision', 'BERTScore_Recall', 'BERTScore_F1']
+# 페이지별 내용 지문 (증분 모드에서 바뀌지 않은 페이지는 다시 쓰지 않음)
+PAGE_MANIFEST_NAME = ".quan_eval_pages.json"
 
 def parse_arguments():
     # 현재 스크립트의 위치를 기준으로 상위 디렉토리 경로 설정
@@ -12,51 +25,116 @@ def parse_arguments():
     parser.add_argument('--base_dir', type=str, 
                         default=str(base_dir),
                         help='프로젝트 기본 디렉토리 경로')
+    parser.add_argument('--page_size', type=int,
+                        default=200,
+                        help='HTML 한 페이지에 표시할 행 수')
+    parser.add_argument('--thumb_size', type=int,
+                        default=300,
+                        help='썸네일의 최대 가로/세로 크기(px)')
+    parser.add_argument('--workers', type=int,
+                        default=None,
+                        help='썸네일 생성에 사용할 프로세스 수 (기본값: CPU 코어 수)')
+    parser.add_argument('--scores_csv', type=str,
+                        default=None,
+                        help='BERTScore 결과 CSV 경로 (기본값: output/bert_score_results.csv가 있으면 사용)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='내용이 바뀌지 않은 HTML 페이지는 다시 쓰지 않음')
     return parser.parse_args()
 
-def main():
-    args = parse_arguments()
-    
-    # 기본 디렉토리 경로 설정
-    base_dir = Path(args.base_dir)
-    data_dir = base_dir / "data"
-    img_dir = data_dir / "all_imgs"
-    output_dir = base_dir / "output"
+def thumbnail_name(img_file):
+    """이미지 파일명으로 썸네일 파일명을 만드는 함수 (한글/공백이 포함된 파일명도 안전하게 처리)"""
+    return hashlib.sha1(img_file.encode('utf-8')).hexdigest()[:20] + ".jpg"
 
-    # output 디렉토리가 없는 경우 생성
-    output_dir.mkdir(parents=True, exist_ok=True)
+def make_thumbnail(src_path, dst_path, max_size):
+    """
+    원본 이미지로 썸네일을 만드는 함수 (프로세스 풀에서 실행)
+    - 썸네일이 원본보다 최신이면 다시 만들지 않습니다
+    - JPEG은 축소 디코딩(draft)을 사용해 큰 사진도 빠르게 처리합니다
+    """
+    src_path, dst_path = Path(src_path), Path(dst_path)
+    if dst_path.exists() and dst_path.stat().st_mtime >= src_path.stat().st_mtime:
+        return False
+    with Image.open(src_path) as image:
+        image.draft('RGB', (max_size, max_size))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image.thumbnail((max_size, max_size))
+        tmp_path = dst_path.with_suffix('.tmp')
+        image.save(tmp_path, format='JPEG', quality=80)
+    os.replace(tmp_path, dst_path)
+    return True
 
-    # keyword.txt 파일 경로
-    keyword_file = data_dir / "keyword.txt"
-    if not keyword_file.exists():
-        raise FileNotFoundError(f"keyword.txt 파일을 찾을 수 없습니다: {keyword_file}")
+def build_thumbnails(image_files, img_dir, output_dir, max_size=300, workers=None):
+    """
+    존재하는 이미지들의 썸네일을 프로세스 풀에서 생성하는 함수
+    - {이미지 파일명: HTML 기준 썸네일 상대 경로}를 반환합니다 (원본이 없는 이미지는 제외)
+    """
+    img_dir = Path(img_dir)
+    thumb_dir = Path(output_dir) / THUMBNAIL_DIR_NAME
+    thumb_dir.mkdir(parents=True, exist_ok=True)
 
-    # 이미지 파일과 키워드를 저장할 리스트
-    image_files = []
-    blip2_captions = []
-    keywords = []
-    similarities = []  # O, X 평가 저장 리스트
-
-    # keyword.txt 파일 읽기
-    with open(keyword_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            parts = line.strip().split(' : ')
-            if len(parts) == 2:
-                image_files.append(parts[0])
-                caption_keyword_sim = parts[1].split(' / ')
-                if len(caption_keyword_sim) == 3:
-                    blip2_captions.append(caption_keyword_sim[0])
-                    keywords.append(caption_keyword_sim[1])
-                    similarities.append(caption_keyword_sim[2])
+    jobs = {}
+    thumbnails = {}
+    for img_file in dict.fromkeys(image_files):
+        src_path = img_dir / img_file
+        dst_path = thumb_dir / thumbnail_name(img_file)
+        try:
+            src_mtime = src_path.stat().st_mtime
+        except OSError:
+            continue
+        # 원본보다 최신인 썸네일은 프로세스 풀에 보내지 않고 바로 재사용
+        if dst_path.exists() and dst_path.stat().st_mtime >= src_mtime:
+            thumbnails[img_file] = f"{THUMBNAIL_DIR_NAME}/{dst_path.name}"
+        else:
+            jobs[img_file] = (src_path, dst_path)
 
-    # 통계 계산
-    total_images = len(image_files)
-    similar_count = similarities.count('O')
-    not_similar_count = similarities.count('X')
-    similar_percent = (similar_count / total_images) * 100
+    created = 0
+    if not jobs:
+        print(f"썸네일: 새로 생성 0개 / 재사용 {len(thumbnails)}개")
+        return thumbnails
+    # run_eval.py에서는 BERTScore 단계(torch 로드)와 다른 스레드에서 동시에 실행되므로,
+    # 멀티스레드 프로세스를 fork하지 않도록 spawn 방식 사용
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {
+            executor.submit(make_thumbnail, str(src), str(dst), max_size): img_file
+            for img_file, (src, dst) in jobs.items()
+        }
+        for future, img_file in futures.items():
+            try:
+                created += future.result()
+            except Exception as e:
+                print(f"썸네일 생성 중 오류 발생 ({img_file}): {e}")
+                continue
+            thumbnails[img_file] = f"{THUMBNAIL_DIR_NAME}/{jobs[img_file][1].name}"
+
+    print(f"썸네일: 새로 생성 {created}개 / 재사용 {len(thumbnails) - created}개")
+    return thumbnails
+
+def scores_from_frame(results_df):
+    """BERTScore 결과 DataFrame을 {(이미지, 캡션, 키워드): (P, R, F1)} dict로 바꾸는 함수"""
+    keys = zip(results_df['이미지 파일'], results_df['BLIP-2 캡션(원본)'], results_df['키워드'])
+    values = zip(*(results_df[column] for column in SCORE_COLUMNS))
+    return dict(zip(keys, values))
+
+def load_bert_scores(csv_path):
+    """BERTScore 결과 CSV가 있으면 필요한 컬럼만 읽어 점수 dict로 반환하는 함수 (없으면 None)"""
+    csv_path = Path(csv_path)
+    if not csv_path.exists():
+        return None
+    # "NA", "None", 빈 문자열 같은 캡션/키워드도 keyword.txt 파싱 결과와 같은 문자열로 읽어야 점수를 찾을 수 있음
+    results_df = pd.read_csv(
+        csv_path, encoding='utf-8-sig', keep_default_na=False, na_values=[],
+        usecols=['이미지 파일', 'BLIP-2 캡션(원본)', '키워드'] + SCORE_COLUMNS
+    )
+    return scores_from_frame(results_df)
+
+def page_file_name(page):
+    """페이지 번호로 HTML 파일명을 만드는 함수 (1페이지는 기존과 같은 quan_eval.html)"""
+    return "quan_eval.html" if page == 1 else f"quan_eval_p{page}.html"
 
-    # HTML 파일 생성
-    html_content = f"""
+def write_page_header(f, stats_html, nav_html, with_scores):
+    """HTML 페이지의 머리 부분(스타일, 통계, 표 제목)을 쓰는 함수"""
+    score_headers = "".join(f"<th>{column}</th>" for column in SCORE_COLUMNS) if with_scores else ""
+    f.write(f"""
     <html>
     <head>
         <meta charset="utf-8">
@@ -80,52 +158,188 @@ def main():
                 background-color: #f0f0f0;
                 border-radius: 5px;
             }}
+            .nav a {{
+                margin: 0 4px;
+            }}
         </style>
     </head>
     <body>
-        <div class="stats">
-            <h2>통계</h2>
-            <p>총 이미지 개수: {total_images}개</p>
-            <p>유사한 경우(O): {similar_count}개 ({similar_percent:.1f}%)</p>
-            <p>유사하지 않은 경우(X): {not_similar_count}개 ({100-similar_percent:.1f}%)</p>
-        </div>
+        {stats_html}
+        {nav_html}
         <table>
             <tr>
                 <th>이미지</th>
                 <th>BLIP-2 캡셔닝</th>
                 <th>키워드</th>
                 <th>정성평가</th>
+                {score_headers}
             </tr>
-    """
+    """)
 
-    # 각 이미지, BLIP-2 캡셔닝, 키워드, 유사도에 대한 행 추가
-    for img_file, caption, keyword, similarity in zip(image_files, blip2_captions, keywords, similarities):
-        img_path = img_dir / img_file
-        if img_path.exists():
-            html_content += f"""
-            <tr>
-                <td><img src="{img_path}" alt="{img_file}"></td>
-                <td>{caption}</td>
-                <td>{keyword}</td>
-                <td>{similarity}</td>
-            </tr>
-            """
-
-    html_content += """
+def write_page_footer(f, nav_html):
+    """HTML 페이지의 끝 부분을 쓰는 함수"""
+    f.write(f"""
         </table>
+        {nav_html}
     </body>
     </html>
+    """)
+
+def page_nav_html(page, page_count):
     """
+    페이지 이동 링크를 만드는 함수
+    - 1페이지: 전체 페이지 목록
+    - 나머지 페이지: 1페이지(통계, 목록)와 이전/다음 페이지 링크만 (전체 페이지 수가 늘어도 바뀌지 않도록)
+    """
+    if page_count <= 1:
+        return ""
+    if page == 1:
+        links = " ".join(
+            "<b>1</b>" if p == 1 else f'<a href="{page_file_name(p)}">{p}</a>'
+            for p in range(1, page_count + 1)
+        )
+        return f'<div class="nav">페이지: {links}</div>'
+    links = [f'<a href="{page_file_name(1)}">1페이지(통계, 목록)</a>',
+             f'<a href="{page_file_name(page - 1)}">이전</a>',
+             f"<b>{page}</b>"]
+    if page < page_count:
+        links.append(f'<a href="{page_file_name(page + 1)}">다음</a>')
+    return f'<div class="nav">{" ".join(links)}</div>'
 
-    # HTML 파일로 저장 (출력 경로 수정)
-    output_file = output_dir / "quan_eval.html"
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+def load_page_manifest(output_dir):
+    """이전 실행의 {페이지 파일명: 내용 지문}을 읽는 함수 (없으면 빈 dict)"""
+    try:
+        with open(Path(output_dir) / PAGE_MANIFEST_NAME, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def generate_html_report(image_files, blip2_captions, keywords, similarities, img_dir, output_dir,
+                         scores=None, page_size=200, thumb_size=300, workers=None, thumbnails=None,
+                         incremental=False):
+    """
+    로드된 데이터로 정성평가 HTML을 생성하는 함수
+    - run_eval.py에서 같은 프로세스 안에서 호출할 수 있도록 main과 분리되어 있습니다
+    - 원본 대신 캐시된 썸네일을 lazy-loading으로 표시하고, page_size 행마다 페이지를 나눠 파일에 바로 씁니다
+    - scores({(이미지, 캡션, 키워드): (P, R, F1)})가 주어지면 BERTScore 컬럼을 함께 표시합니다
+    - 통계와 전체 페이지 목록은 1페이지에만 쓰고, 나머지 페이지에는 1페이지와 이전/다음 페이지 링크만 둡니다
+    - incremental=True이면 페이지 내용(행, 점수, 썸네일, 링크)의 지문이 이전 실행과 같은 페이지는 다시 쓰지 않습니다
+      (행이 추가되어도 1페이지와 바뀐 뒤쪽 페이지만 다시 씁니다)
+    - 첫 페이지 HTML 파일 경로를 반환합니다
+    """
+    img_dir = Path(img_dir)
+    output_dir = Path(output_dir)
+
+    # output 디렉토리가 없는 경우 생성
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # 통계 계산
+    total_images = len(image_files)
+    similar_count = similarities.count('O')
+    not_similar_count = similarities.count('X')
+    similar_percent = (similar_count / total_images) * 100
+
+    if thumbnails is None:
+        thumbnails = build_thumbnails(image_files, img_dir, output_dir, max_size=thumb_size, workers=workers)
+
+    # 원본 이미지가 있는 행만 표시
+    rows = [
+        row for row in zip(image_files, blip2_captions, keywords, similarities)
+        if row[0] in thumbnails
+    ]
+    page_size = max(1, page_size)
+    page_count = max(1, (len(rows) + page_size - 1) // page_size)
+    with_scores = bool(scores)
+
+    stats_html = f"""<div class="stats">
+            <h2>통계</h2>
+            <p>총 이미지 개수: {total_images}개</p>
+            <p>유사한 경우(O): {similar_count}개 ({similar_percent:.1f}%)</p>
+            <p>유사하지 않은 경우(X): {not_similar_count}개 ({100-similar_percent:.1f}%)</p>
+        </div>"""
+
+    previous_manifest = load_page_manifest(output_dir) if incremental else {}
+    manifest = {}
+    written = 0
+
+    for page in range(1, page_count + 1):
+        page_stats_html = stats_html if page == 1 else ""
+        nav_html = page_nav_html(page, page_count)
+
+        page_rows = rows[(page - 1) * page_size:page * page_size]
+        page_scores = [scores.get(tuple(row[:3])) for row in page_rows] if with_scores else None
+        # 통계는 1페이지에만 들어가므로, 나머지 페이지는 자기 행과 링크가 그대로면 지문도 그대로 유지됨
+        page_key = make_cache_key(page_stats_html, nav_html, page_rows, page_scores,
+                                  [thumbnails[row[0]] for row in page_rows])
+        page_path = output_dir / page_file_name(page)
+        manifest[page_path.name] = page_key
+        if previous_manifest.get(page_path.name) == page_key and page_path.exists():
+            continue
+        written += 1
+
+        with open(page_path, 'w', encoding='utf-8') as f:
+            write_page_header(f, page_stats_html, nav_html, with_scores)
+
+            # 각 이미지, BLIP-2 캡셔닝, 키워드, 유사도에 대한 행 추가
+            for (img_file, caption, keyword, similarity), row_scores in zip(
+                    page_rows, page_scores or [None] * len(page_rows)):
+                score_cells = ""
+                if with_scores:
+                    score_cells = "".join(
+                        f"<td>{value:.4f}</td>" for value in row_scores
+                    ) if row_scores else "<td>-</td>" * len(SCORE_COLUMNS)
+                f.write(f"""
+            <tr>
+                <td><img src="{html.escape(thumbnails[img_file])}" alt="{html.escape(img_file)}" loading="lazy"></td>
+                <td>{html.escape(caption)}</td>
+                <td>{html.escape(keyword)}</td>
+                <td>{html.escape(similarity)}</td>
+                {score_cells}
+            </tr>
+            """)
+
+            write_page_footer(f, nav_html)
+
+    # 이전 실행에서 더 많은 페이지가 만들어졌다면 남은 페이지 삭제
+    for stale_file in output_dir.glob("quan_eval_p*.html"):
+        page_number = stale_file.stem.rsplit("_p", 1)[-1]
+        if page_number.isdigit() and int(page_number) > page_count:
+            stale_file.unlink()
+    with open(output_dir / PAGE_MANIFEST_NAME, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+    output_file = output_dir / page_file_name(1)
 
     # 콘솔에 통계 출력
     print(f"총 이미지 개수: {total_images}개")
     print(f"유사한 경우(O): {similar_count}개 ({similar_percent:.1f}%)")
     print(f"유사하지 않은 경우(X): {not_similar_count}개 ({100-similar_percent:.1f}%)")
+    print(f"정성평가 HTML {page_count}페이지를 {output_dir}에 저장했습니다. (새로 작성 {written}페이지)")
+
+    return output_file
+
+def main():
+    args = parse_arguments()
+    
+    # 기본 디렉토리 경로 설정
+    base_dir = Path(args.base_dir)
+    data_dir = base_dir / "data"
+    img_dir = data_dir / "all_imgs"
+    output_dir = base_dir / "output"
+
+    # keyword.txt 파일 경로
+    keyword_file = data_dir / "keyword.txt"
+    if not keyword_file.exists():
+        raise FileNotFoundError(f"keyword.txt 파일을 찾을 수 없습니다: {keyword_file}")
+
+    # BERTScore 결과가 있으면 함께 표시
+    scores_csv = Path(args.scores_csv) if args.scores_csv else output_dir / "bert_score_results.csv"
+    scores = load_bert_scores(scores_csv)
+
+    image_files, blip2_captions, keywords, similarities = load_keyword_columns(keyword_file)
+    generate_html_report(image_files, blip2_captions, keywords, similarities, img_dir, output_dir,
+                         scores=scores, page_size=args.page_size, thumb_size=args.thumb_size,
+                         workers=args.workers, incremental=args.incremental)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
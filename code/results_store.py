@@ -0,0 +1,193 @@
+"""
+BERTScore 평가 결과를 실행(run) 단위로 쌓아 두는 SQLite 저장소와 조회 명령
+
+사용 예:
+    python results_store.py runs                      # 실행 목록
+    python results_store.py summary [RUN_ID]          # 실행별 평균 점수, 수동 평가(O/X)별 평균 (기본: 최근 실행)
+    python results_store.py diff RUN_A RUN_B --top 20 # 두 실행 사이 F1 변화가 큰 행
+
+- runs 테이블: 실행 ID, 시각, 설정(채점 모델, 레이어, 번역 모델 등)
+- scores 테이블: 실행별 행 단위 점수 (조회는 필요한 컬럼만 SELECT)
+- 실행마다 새 run_id로 추가되므로 이전 결과를 덮어쓰지 않습니다
+"""
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import uuid
+from pathlib import Path
+
+DEFAULT_RESULTS_DB = Path(os.getenv(
+    "AUTODIARY_RESULTS_DB",
+    str(Path(__file__).parent.parent / "output" / "eval_results.sqlite3")
+))
+
+# DataFrame 컬럼 -> scores 테이블 컬럼
+SCORE_TABLE_COLUMNS = {
+    '이미지 파일': 'image_file',
+    'BLIP-2 캡션(원본)': 'caption',
+    'BLIP-2 캡션(번역)': 'translated_caption',
+    '키워드': 'keyword',
+    '수동 평가': 'label',
+    'BERTScore_Precision': 'precision',
+    'BERTScore_Recall': 'recall',
+    'BERTScore_F1': 'f1',
+    'row_fingerprint': 'fingerprint',
+}
+
+
+def connect(db_path=DEFAULT_RESULTS_DB):
+    """결과 DB에 연결하고 테이블이 없으면 만드는 함수"""
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS runs ("
+        "run_id TEXT PRIMARY KEY, created_at TEXT NOT NULL, row_count INTEGER NOT NULL, config TEXT NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS scores ("
+        "run_id TEXT NOT NULL, row_no INTEGER NOT NULL, image_file TEXT, caption TEXT, translated_caption TEXT, "
+        "keyword TEXT, label TEXT, precision REAL, recall REAL, f1 REAL, fingerprint TEXT, "
+        "PRIMARY KEY (run_id, row_no))"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scores_fingerprint ON scores (fingerprint)")
+    conn.commit()
+    return conn
+
+
+def save_run(results_df, config, db_path=DEFAULT_RESULTS_DB):
+    """평가 결과 DataFrame을 새 실행으로 저장하는 함수 (run_id 반환)"""
+    run_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + uuid.uuid4().hex[:6]
+    columns = [column for column in SCORE_TABLE_COLUMNS if column in results_df.columns]
+    table_columns = [SCORE_TABLE_COLUMNS[column] for column in columns]
+    rows = (
+        (run_id, row_no, *values)
+        for row_no, values in enumerate(results_df[columns].itertuples(index=False, name=None))
+    )
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO runs (run_id, created_at, row_count, config) VALUES (?, ?, ?, ?)",
+                (run_id, datetime.datetime.now().isoformat(timespec="seconds"), len(results_df),
+                 json.dumps(config, ensure_ascii=False, sort_keys=True))
+            )
+            placeholders = ", ".join("?" * (len(table_columns) + 2))
+            conn.executemany(
+                f"INSERT INTO scores (run_id, row_no, {', '.join(table_columns)}) VALUES ({placeholders})", rows
+            )
+    finally:
+        conn.close()
+    return run_id
+
+
+def list_runs(conn, limit=20):
+    """최근 실행 목록을 반환하는 함수 ([(run_id, 시각, 행 수, 설정 dict)])"""
+    rows = conn.execute(
+        "SELECT run_id, created_at, row_count, config FROM runs ORDER BY rowid DESC LIMIT ?",
+        (limit,)
+    ).fetchall()
+    return [(run_id, created_at, row_count, json.loads(config)) for run_id, created_at, row_count, config in rows]
+
+
+def latest_run_id(conn):
+    row = conn.execute("SELECT run_id FROM runs ORDER BY rowid DESC LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def run_summary(conn, run_id):
+    """실행 하나의 평균 점수와 수동 평가(O/X)별 평균 F1을 반환하는 함수"""
+    count, precision, recall, f1 = conn.execute(
+        "SELECT COUNT(*), AVG(precision), AVG(recall), AVG(f1) FROM scores WHERE run_id = ?", (run_id,)
+    ).fetchone()
+    by_label = conn.execute(
+        "SELECT label, COUNT(*), AVG(f1) FROM scores WHERE run_id = ? GROUP BY label ORDER BY label", (run_id,)
+    ).fetchall()
+    return {
+        "run_id": run_id,
+        "rows": count,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "by_label": {label: {"rows": rows, "f1": label_f1} for label, rows, label_f1 in by_label},
+    }
+
+
+def diff_runs(conn, run_a, run_b, top=20):
+    """
+    두 실행에서 같은 행(이미지, 캡션, 키워드)의 F1 변화를 비교하는 함수
+    - keyword.txt에 같은 (이미지, 캡션, 키워드) 행이 여러 번 나올 수 있으므로, 같은 행 안에서의 순번까지 맞춰
+      1:1로 짝짓습니다 (그냥 조인하면 중복 행끼리 곱해져 행 수와 평균이 부풀려짐)
+    - (공통 행 수, 평균 F1 변화, 변화가 큰 순서의 [(이미지, 키워드, F1(A), F1(B))] 목록)을 반환합니다
+    """
+    numbered = (
+        "SELECT image_file, caption, keyword, f1, ROW_NUMBER() OVER ("
+        "PARTITION BY image_file, caption, keyword ORDER BY row_no) AS occurrence "
+        "FROM scores WHERE run_id = ?"
+    )
+    join = (
+        f"FROM ({numbered}) a JOIN ({numbered}) b ON a.image_file = b.image_file AND a.caption = b.caption "
+        "AND a.keyword = b.keyword AND a.occurrence = b.occurrence"
+    )
+    count, mean_delta = conn.execute(f"SELECT COUNT(*), AVG(b.f1 - a.f1) {join}", (run_a, run_b)).fetchone()
+    changed = conn.execute(
+        f"SELECT a.image_file, a.keyword, a.f1, b.f1 {join} ORDER BY ABS(b.f1 - a.f1) DESC LIMIT ?",
+        (run_a, run_b, top)
+    ).fetchall()
+    return count, mean_delta, changed
+
+
+def _format(value):
+    return "-" if value is None else f"{value:.4f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BERTScore 평가 결과 저장소 조회')
+    parser.add_argument('--db', type=str, default=str(DEFAULT_RESULTS_DB),
+                        help='결과 DB 경로')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    runs_parser = subparsers.add_parser('runs', help='실행 목록')
+    runs_parser.add_argument('--limit', type=int, default=20)
+    summary_parser = subparsers.add_parser('summary', help='실행별 평균 점수')
+    summary_parser.add_argument('run_id', nargs='?', default=None,
+                                help='실행 ID (기본: 가장 최근 실행)')
+    diff_parser = subparsers.add_parser('diff', help='두 실행의 행 단위 F1 비교')
+    diff_parser.add_argument('run_a')
+    diff_parser.add_argument('run_b')
+    diff_parser.add_argument('--top', type=int, default=20,
+                             help='표시할 변화가 큰 행 수')
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        raise FileNotFoundError(f"결과 DB를 찾을 수 없습니다: {args.db}")
+    conn = connect(args.db)
+    try:
+        if args.command == 'runs':
+            for run_id, created_at, row_count, config in list_runs(conn, args.limit):
+                print(f"{run_id}  {created_at}  {row_count}행  {json.dumps(config, ensure_ascii=False)}")
+        elif args.command == 'summary':
+            run_id = args.run_id or latest_run_id(conn)
+            if run_id is None:
+                print("저장된 실행이 없습니다.")
+                return
+            summary = run_summary(conn, run_id)
+            print(f"=== {run_id} ({summary['rows']}행) ===")
+            print(f"평균 Precision: {_format(summary['precision'])}")
+            print(f"평균 Recall: {_format(summary['recall'])}")
+            print(f"평균 F1 Score: {_format(summary['f1'])}")
+            for label, stats in summary['by_label'].items():
+                print(f"수동 평가 '{label}' ({stats['rows']}행) 평균 F1 Score: {_format(stats['f1'])}")
+        elif args.command == 'diff':
+            count, mean_delta, changed = diff_runs(conn, args.run_a, args.run_b, args.top)
+            print(f"공통 행: {count}개, 평균 F1 변화: {_format(mean_delta)}")
+            for image_file, keyword, f1_a, f1_b in changed:
+                print(f"{image_file} / {keyword}: {_format(f1_a)} -> {_format(f1_b)}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
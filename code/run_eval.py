@@ -1,48 +1,149 @@
-import subprocess
+import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 import argparse
+import bert_score_eval
+import quan_eval_html_generator
+from keyword_parser import load_keyword_columns
+from metrics import Trace, write_trace
 
-def run_evaluation(base_dir):
+def run_stages(stages, max_workers=4):
     """
-    정성평가와 BERTScore 평가를 순차적으로 실행하는 함수
+    의존성이 있는 평가 단계들을 작은 DAG로 실행하는 함수
+    - stages: {단계 이름: (의존 단계 이름 목록, 함수)} 형태이며, 함수는 의존 단계 결과 dict를 인자로 받습니다
+    - 의존 단계가 모두 끝난 단계부터 스레드 풀에서 동시에 실행합니다
+    - 한 단계가 실패하면 아직 시작하지 않은 단계는 취소하고, 실행 중인 단계를 기다리지 않고 바로 오류를 전달합니다
+      (실행 중인 단계의 스레드는 멈출 수 없으므로 계속 돌고, 인터프리터 종료 시 join됩니다.
+       바로 끝내려면 호출한 쪽에서 os._exit로 종료해야 합니다. run_evaluation 참고)
+    - (단계별 결과 dict, 단계별 실행 시간(초) dict)를 반환합니다
     """
-    print("=== Auto Diary 프로젝트 평가 시작 ===\n")
+    pending = dict(stages)
+    running = {}
+    results = {}
+    timings = {}
 
-    # 실행할 스크립트들의 경로
-    current_dir = Path(__file__).parent
-    quan_eval_script = current_dir / "quan_eval_html_generator.py"
-    bert_eval_script = current_dir / "bert_score_eval.py"
+    def timed(fn, inputs):
+        start = time.perf_counter()
+        result = fn(inputs)
+        return result, time.perf_counter() - start
 
+    executor = ThreadPoolExecutor(max_workers=max_workers)
     try:
-        # 1. 정성평가 HTML 생성 실행
-        print("1. 정성평가 HTML 생성 중...")
-        subprocess.run([sys.executable, str(quan_eval_script), "--base_dir", str(base_dir)], check=True)
-        print("정성평가 HTML 생성 완료\n")
+        while pending or running:
+            # 실행 가능한(의존 단계가 모두 끝난) 단계 제출
+            for name, (deps, fn) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    inputs = {dep: results[dep] for dep in deps}
+                    running[executor.submit(timed, fn, inputs)] = name
+                    del pending[name]
+
+            if not running:
+                raise RuntimeError(f"실행할 수 없는 단계가 있습니다 (의존성 확인 필요): {list(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name], timings[name] = future.result()
+                except Exception:
+                    print(f"[{name}] 실패, 남은 단계를 취소합니다: {list(pending) + list(running.values())}")
+                    raise
+                print(f"[{name}] 완료 ({timings[name]:.2f}초)\n")
+    finally:
+        # 정상 종료 시에는 모든 단계가 끝난 상태이고, 실패 시에는 대기 중인 단계만 취소하고 바로 반환
+        # (이미 실행 중인 단계는 끝까지 실행됨)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results, timings
+
+def run_evaluation(base_dir, score_workers=1, incremental=False):
+    """
+    정성평가와 BERTScore 평가를 같은 프로세스에서 실행하는 함수
+    - keyword.txt는 한 번만 읽고, 서로 독립적인 썸네일 생성과 BERTScore 평가는 동시에 실행합니다
+    - incremental=True이면 이전 결과에서 바뀌지 않은 행/페이지는 재사용하고 바뀐 부분만 계산합니다
+    """
+    print("=== Auto Diary 프로젝트 평가 시작 ===\n")
 
-        # 2. BERTScore 평가 실행
+    data_dir = base_dir / "data"
+    output_dir = base_dir / "output"
+    keyword_file = data_dir / "keyword.txt"
+    trace = Trace("run_eval")
+
+    def load_dataset(_):
+        if not keyword_file.exists():
+            raise FileNotFoundError(f"keyword.txt 파일을 찾을 수 없습니다: {keyword_file}")
+        return load_keyword_columns(keyword_file)
+
+    def thumbnails(inputs):
+        print("1. 정성평가용 썸네일 생성 중...")
+        image_files = inputs["load"][0]
+        return quan_eval_html_generator.build_thumbnails(image_files, data_dir / "all_imgs", output_dir)
+
+    def bert_score(inputs):
         print("2. BERTScore 평가 시작...")
-        subprocess.run([sys.executable, str(bert_eval_script), "--data_dir", str(base_dir / "data")], check=True)
-        print("BERTScore 평가 완료\n")
+        return bert_score_eval.run_bert_score_evaluation(
+            *inputs["load"], output_dir / "bert_score_results.csv", trace=trace,
+            score_workers=score_workers, incremental=incremental, img_dir=data_dir / "all_imgs"
+        )
+
+    def html_report(inputs):
+        print("3. 정성평가 HTML 생성 중...")
+        return quan_eval_html_generator.generate_html_report(
+            *inputs["load"], data_dir / "all_imgs", output_dir,
+            scores=quan_eval_html_generator.scores_from_frame(inputs["bertscore"]),
+            thumbnails=inputs["thumbnails"], incremental=incremental
+        )
 
-        print("=== 모든 평가가 성공적으로 완료되었습니다 ===")
-        print(f"결과는 {base_dir}/output 디렉토리에서 확인하실 수 있습니다.")
+    # 썸네일 생성과 BERTScore 평가는 서로 독립적이므로 동시에 실행하고,
+    # HTML은 두 결과가 모두 준비된 뒤 BERTScore 컬럼을 포함하여 생성
+    stages = {
+        "load": ([], load_dataset),
+        "thumbnails": (["load"], thumbnails),
+        "bertscore": (["load"], bert_score),
+        "html": (["load", "thumbnails", "bertscore"], html_report),
+    }
 
-    except subprocess.CalledProcessError as e:
+    total_start = time.perf_counter()
+    try:
+        _, timings = run_stages(stages)
+    except Exception as e:
         print(f"평가 실행 중 오류가 발생했습니다: {e}")
-        sys.exit(1)
+        # sys.exit는 아직 실행 중인 단계(예: BERTScore)의 스레드가 끝날 때까지 기다리므로,
+        # 출력을 비운 뒤 바로 프로세스를 종료 (끝난 BERTScore 샤드는 partial 파일에 남아 다음 실행에서 재사용됨)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(1)
+
+    print("=== 단계별 실행 시간 ===")
+    for name, elapsed in timings.items():
+        trace.add(name, elapsed)
+        print(f"{name}: {elapsed:.2f}초")
+    print(f"전체: {time.perf_counter() - total_start:.2f}초\n")
+    metrics_file = write_trace(trace)
+    if metrics_file is not None:
+        print(f"단계별 지표 기록: {metrics_file}")
+
+    print("=== 모든 평가가 성공적으로 완료되었습니다 ===")
+    print(f"결과는 {base_dir}/output 디렉토리에서 확인하실 수 있습니다.")
 
 def main():
     # 현재 스크립트의 위치를 기준으로 상위 디렉토리 경로 설정
     default_base_dir = Path(__file__).parent.parent
 
     parser = argparse.ArgumentParser(description='Auto Diary 프로젝트 평가 실행')
-    parser.add_argument('--base_dir', type=str, 
+    parser.add_argument('--base_dir', type=str,
                        default=str(default_base_dir),
                        help='프로젝트 기본 디렉토리 경로')
-    
+    parser.add_argument('--score_workers', type=int,
+                       default=1,
+                       help='BERTScore를 나누어 계산할 워커 프로세스 수 (2 이상이면 분할 채점)')
+    parser.add_argument('--incremental', action='store_true',
+                       help='새로 생기거나 바뀐 keyword.txt 행만 계산해 기존 결과에 합침')
+
     args = parser.parse_args()
-    run_evaluation(Path(args.base_dir))
+    run_evaluation(Path(args.base_dir), score_workers=args.score_workers, incremental=args.incremental)
 
 if __name__ == "__main__":
     main()
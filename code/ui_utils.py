@@ -0,0 +1,259 @@
+import asyncio
+import os
+from contextlib import nullcontext
+import streamlit as st
+from album_diary import DIARY_CHUNK_SIZE, needs_map_reduce, summarize_chunks
+from cache_utils import hash_bytes
+from image_utils import DEFAULT_PAYLOAD_BUDGET, encode_image, encode_images_within_budget, prepare_image
+from llm_utils import DIARY_MODEL, ChatResult, complete_chat, create_client, stream_chat_completion
+from metrics import write_trace
+from prompt_builder import build_compose_prompt, count_message_tokens, count_tokens
+
+# 일기를 스트리밍으로 표시할지 여부 (DIARY_STREAMING=0이면 완성된 뒤 한 번에 표시)
+DIARY_STREAMING = os.getenv("DIARY_STREAMING", "1") != "0"
+DIARY_STATE_KEY = "diary_result"
+# 업로드 사진별 썸네일/캡션/전송용 인코딩 캐시 ({내용 해시: dict})와 파일 ID -> 내용 해시
+PHOTO_STATE_KEY = "photo_cache"
+PHOTO_DIGEST_STATE_KEY = "photo_digests"
+# 화면 표시용 썸네일의 긴 변 (표시 너비 200px의 2배, 고해상도 화면 대응)
+THUMBNAIL_MAX_EDGE = 400
+
+
+def load_uploaded_photos(uploaded_files, trace=None):
+    """
+    업로드된 파일마다 내용 해시, 위젯 키, 화면 표시용 썸네일을 준비하는 함수
+    - 썸네일은 내용 해시 기준으로 session_state에 캐시하므로, 다시 실행될 때 원본을 다시 디코딩하지 않습니다
+    - 위젯 키는 파일 이름 대신 내용 해시(+같은 내용의 순번)로 만들어 이름이 같은 사진끼리 충돌하지 않습니다
+    - 업로드 목록에서 빠진 사진의 캐시는 지웁니다
+    - [{"name", "digest", "key", "data"(원본 바이트), "entry"(캐시 dict)}, ...]를 업로드 순서대로 반환합니다
+    """
+    cache = st.session_state.setdefault(PHOTO_STATE_KEY, {})
+    digests = st.session_state.setdefault(PHOTO_DIGEST_STATE_KEY, {})
+    photos = []
+    occurrences = {}
+    for uploaded_file in uploaded_files:
+        data = uploaded_file.getvalue()
+        file_id = getattr(uploaded_file, "file_id", None)
+        digest = digests.get(file_id) if file_id else None
+        if digest is None:
+            digest = hash_bytes(data)
+            if file_id:
+                digests[file_id] = digest
+
+        entry = cache.get(digest)
+        if entry is None:
+            with trace.span("decode") if trace is not None else nullcontext():
+                thumbnail, _, _ = prepare_image(data, max_edge=THUMBNAIL_MAX_EDGE)
+            entry = cache[digest] = {"thumbnail": thumbnail}
+
+        index = occurrences.get(digest, 0)
+        occurrences[digest] = index + 1
+        photos.append({
+            "name": uploaded_file.name,
+            "digest": digest,
+            "key": f"{digest[:16]}_{index}",
+            "data": data,
+            "entry": entry,
+        })
+
+    for digest in set(cache) - set(occurrences):
+        del cache[digest]
+    for file_id, digest in list(digests.items()):
+        if digest not in occurrences:
+            del digests[file_id]
+    return photos
+
+
+def encode_photos(photos, budget_bytes=DEFAULT_PAYLOAD_BUDGET):
+    """
+    GPT에 보낼 사진들을 base64로 인코딩하는 함수 (사진별 결과는 session_state 캐시에 저장)
+    - 예산은 요청 단위로 적용합니다: 한 번에 보내면 전체 사진, 사진이 많아 구간별로 요약하면(diary_messages)
+      구간마다 해당 구간의 사진(DIARY_CHUNK_SIZE장)만 첨부되므로 구간별로 예산을 확인합니다
+    - 기본 설정으로 인코딩한 결과를 재사용하고, 합계가 예산을 넘는 요청의 사진만 다시 줄여 인코딩합니다
+    - 줄여도 예산을 넘으면 PayloadBudgetError가 발생합니다
+    """
+    for photo in photos:
+        if "encoded" not in photo["entry"]:
+            photo["entry"]["encoded"] = encode_image(photo["data"])
+    # summarize_chunks와 같은 경계로 나누어야 요청마다 예산이 지켜짐
+    group_size = DIARY_CHUNK_SIZE if needs_map_reduce(len(photos)) else max(1, len(photos))
+    encoded = []
+    for start in range(0, len(photos), group_size):
+        group = photos[start:start + group_size]
+        group_encoded = [photo["entry"]["encoded"] for photo in group]
+        if sum(len(b64) for b64, _, _ in group_encoded) > budget_bytes:
+            group_encoded = encode_images_within_budget([photo["data"] for photo in group], budget_bytes=budget_bytes)
+        encoded.extend(group_encoded)
+    return encoded
+
+
+def diary_messages(diary_prompt, photos, variant, mood="", formatted_date=None, images=None, use_cache=True,
+                   trace=None):
+    """
+    일기 생성 요청에 보낼 메시지를 반환하는 함수
+    - 사진이 많으면(album_diary.DIARY_CHUNK_SIZE 초과) 구간별 요약을 동시에 만든 뒤 최종 일기 프롬프트를 반환합니다 (map 단계)
+    - 그 외에는 diary_prompt의 메시지를 그대로 반환합니다
+    """
+    if not needs_map_reduce(len(photos)):
+        return diary_prompt.messages
+    with st.spinner(f"사진 {len(photos)}장을 구간별로 나누어 요약하고 있습니다..."):
+        with trace.span("map") if trace is not None else nullcontext():
+            summaries = asyncio.run(summarize_chunks(
+                create_client(async_client=True, max_retries=0), photos, variant, formatted_date, images,
+                use_cache=use_cache, trace=trace
+            ))
+    return build_compose_prompt(summaries, variant, mood, formatted_date).messages
+
+
+def write_diary(client, messages, state_key=DIARY_STATE_KEY, streaming=DIARY_STREAMING, trace=None, **kwargs):
+    """
+    일기를 생성해 화면에 표시하고, 결과(ChatResult)를 session_state에 저장하는 함수
+    - 스트리밍 모드에서는 토큰이 도착할 때마다 화면을 갱신합니다
+    - '생성 중단' 버튼을 누르면 Streamlit이 현재 실행을 멈추고 다시 실행하며, 그때까지 받은 내용은 session_state에 남습니다
+    - trace가 주어지면 LLM 응답 시간과 토큰 사용량을 기록하고 지표 파일에 씁니다
+      (중단되거나 오류로 끝난 생성도 finally에서 기록하며, 마지막 청크의 usage를 받지 못했으므로 토큰 수는 추정값입니다)
+    """
+    result = ChatResult()
+    st.session_state[state_key] = result
+
+    if not streaming:
+        with st.spinner("AI가 일기를 작성하고 있습니다..."):
+            complete_chat(client, messages, result=result, **kwargs)
+        st.write(result.text)
+        show_usage(result)
+        _finish_trace(trace, result)
+        return result
+
+    st.button("생성 중단", key=f"{state_key}_stop")
+    placeholder = st.empty()
+    placeholder.markdown("AI가 일기를 작성하고 있습니다...")
+
+    def on_text(_):
+        placeholder.markdown(result.text + "▌")
+
+    try:
+        stream_chat_completion(client, messages, result=result, on_text=on_text, **kwargs)
+    finally:
+        # 중단 버튼으로 재실행되면 Streamlit이 on_text 안에서 예외를 일으켜 여기로 빠져나옴
+        if not result.finished:
+            result.cancelled = True
+            _estimate_partial_usage(result, messages, kwargs.get("model", DIARY_MODEL))
+        _finish_trace(trace, result)
+    placeholder.markdown(result.text)
+    show_usage(result)
+    return result
+
+
+def _estimate_partial_usage(result, messages, model):
+    """끝까지 받지 못한 응답의 토큰 사용량을 입력 메시지와 받은 텍스트로 추정하는 함수"""
+    if result.usage:
+        return
+    prompt_tokens = count_message_tokens(messages, model)
+    completion_tokens = count_tokens(result.text, model)
+    result.usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "estimated": True,
+    }
+
+
+def _finish_trace(trace, result):
+    """일기 생성 결과의 응답 시간과 토큰 사용량을 trace에 넣고 지표 파일에 기록하는 함수"""
+    if trace is None:
+        return
+    trace.add("llm", result.elapsed)
+    trace.add("llm_first_token", result.time_to_first_token)
+    trace.record_usage(result.usage)
+    trace.labels["cached"] = result.cached
+    trace.labels["cancelled"] = result.cancelled
+    write_trace(trace)
+
+
+def show_last_diary(state_key=DIARY_STATE_KEY):
+    """이전 실행에서 생성한(또는 중단된) 일기를 다시 표시하는 함수"""
+    result = st.session_state.get(state_key)
+    if result is None:
+        return False
+    st.write(result.text)
+    if not result.finished:
+        st.warning("일기 생성이 중단되었습니다. 중단 전까지 생성된 내용만 표시합니다.")
+    show_usage(result)
+    return True
+
+
+def wait_for_model(loader, label="캡션 모델"):
+    """
+    모델이 준비되었으면 결과를 반환하고, 아직 불러오는 중이면 진행 상황을 표시한 뒤 None을 반환하는 함수
+    - 업로드나 키워드 입력은 막지 않고, 모델이 필요한 단계만 준비될 때까지 기다리게 합니다
+    - st.fragment를 지원하는 Streamlit에서는 1초마다 진행 상황만 갱신하고, 준비되면 앱을 다시 실행합니다
+    """
+    if loader.ready:
+        return loader.result
+    if loader.error is not None:
+        st.error(f"{label}을 불러오지 못했습니다: {loader.error}")
+        return None
+
+    def render_progress():
+        st.progress(min(1.0, loader.fraction),
+                    text=f"{label} 준비 중: {loader.message} ({loader.elapsed:.0f}초 경과)")
+
+    fragment = getattr(st, "fragment", None)
+    if fragment is None:
+        render_progress()
+        st.button("모델 상태 새로고침")
+        return None
+
+    @fragment(run_every=1)
+    def progress_panel():
+        render_progress()
+        if loader.done:
+            st.rerun()
+
+    progress_panel()
+    return None
+
+
+def show_prompt_estimate(diary_prompt, num_photos=0):
+    """보내기 전에 예상 입력 토큰 수를 표시하는 함수 (num_photos로 구간별 요약 여부를 함께 표시)"""
+    if needs_map_reduce(num_photos):
+        st.caption(f"사진이 많아 구간별로 요약한 뒤 일기를 작성합니다 (전체 예상 입력 토큰: {diary_prompt.input_tokens:,})")
+        return
+    message = f"예상 입력 토큰: {diary_prompt.input_tokens:,}"
+    if diary_prompt.image_tokens:
+        message += f" (이미지 {diary_prompt.image_tokens:,} 포함)"
+    if diary_prompt.trimmed:
+        message += " · 토큰 예산에 맞추어 사진 정보를 줄였습니다"
+    st.caption(message)
+    if diary_prompt.over_budget:
+        st.warning("사진 정보를 줄여도 토큰 예산을 넘습니다. 사진 수를 줄이는 것을 권장합니다.")
+
+
+def show_trace(trace):
+    """이번 실행의 단계별 처리 시간과 토큰 사용량을 사이드바에 접어서 표시하는 함수"""
+    with st.sidebar.expander("⏱ 단계별 처리 시간", expanded=False):
+        if not trace.spans:
+            st.caption("기록된 단계가 없습니다.")
+        for stage, seconds in trace.spans.items():
+            st.write(f"{stage}: {seconds * 1000:,.0f} ms")
+        if trace.usage:
+            st.write(" · ".join(f"{kind}: {tokens:,}" for kind, tokens in trace.usage.items()))
+
+
+def show_usage(result):
+    """응답 시간과 토큰 사용량을 표시하는 함수"""
+    if not result.finished:
+        return
+    details = []
+    if result.cached:
+        details.append("캐시된 응답")
+    if result.time_to_first_token is not None:
+        details.append(f"첫 토큰 {result.time_to_first_token:.2f}초")
+    if result.elapsed is not None:
+        details.append(f"전체 {result.elapsed:.2f}초")
+    if result.usage:
+        details.append(
+            f"토큰: 입력 {result.usage.get('prompt_tokens', '-')} / 출력 {result.usage.get('completion_tokens', '-')}"
+        )
+    if details:
+        st.caption(" · ".join(details))